@@ -487,7 +487,8 @@ Ultra-HD Realistic NSFW Image Generation
 import os
 os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = '0'
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict
@@ -496,9 +497,17 @@ import base64
 from io import BytesIO
 from diffusers import StableDiffusionXLPipeline, DPMSolverMultistepScheduler, AutoencoderKL
 import time
-import glob
 import json
 
+from gpu_worker import GPUWorker, QueueFullError
+from model_loader import ModelLoader
+from model_catalog import ModelCatalog
+from character_index import KeywordMatcher
+from catalog import Payload
+
+# Checkpoints are discovered here by reading their safetensors headers
+MODELS_DIR = os.environ.get("MODELS_DIR", "/workspace")
+
 # ============================================
 # LOAD POSE LIBRARY
 # ============================================
@@ -528,6 +537,13 @@ POSE_LIBRARY = {
     }
 }
 
+# /poses body, encoded once with gzip copy + ETag (catalog.py) - the library only changes on deploy
+POSES_PAYLOAD = Payload({
+    "total_categories": len(POSE_LIBRARY),
+    "total_poses": sum(len(poses) for poses in POSE_LIBRARY.values()),
+    "poses": POSE_LIBRARY
+})
+
 # ============================================
 # FASTAPI APP
 # ============================================
@@ -545,22 +561,19 @@ app.add_middleware(
 # FIND MODEL
 # ============================================
 def find_model_file():
-    search_paths = [
-        "/workspace/lustify.safetensors",
-        "/workspace/lustify_7.safetensors",
-        "/workspace/*.safetensors",
-    ]
-    
-    for path in search_paths:
-        if "*" in path:
-            files = glob.glob(path)
-            if files:
-                print(f"✅ Found model: {files[0]}")
-                return files[0]
-        else:
-            if os.path.exists(path):
-                print(f"✅ Found model: {path}")
-                return path
+    """LUSTIFY by name, else the first complete SDXL checkpoint by name - classified from headers, not guessed"""
+    model_catalog = ModelCatalog(MODELS_DIR, os.path.join(MODELS_DIR, ".model_catalog.json"))
+    model_catalog.scan()
+    checkpoints = model_catalog.find("sdxl")
+    for preferred in ("lustify", "lustify_7"):
+        for entry in checkpoints:
+            if entry["name"] == preferred:
+                print(f"✅ Found model: {entry['path']} ({entry['dtype']}, {entry['size_gb']}GB)")
+                return entry["path"]
+    if checkpoints:
+        entry = checkpoints[0]
+        print(f"✅ Found model: {entry['path']} ({entry['architecture']}, {entry['dtype']}, {entry['size_gb']}GB)")
+        return entry["path"]
     return None
 
 # ============================================
@@ -569,12 +582,17 @@ def find_model_file():
 pipe = None
 MODEL_PATH = None
 
+# Single owner of the GPU - every render goes through this queue
+gpu_worker = GPUWorker(max_queue=int(os.environ.get("GPU_QUEUE_SIZE", "8")))
+
 def load_model():
+    """The pipeline - waits for the background load started at startup (starts it if needed)"""
+    return model_loader.wait()
+
+def _load_model(step):
     global pipe, MODEL_PATH
     
-    if pipe is not None:
-        return pipe
-    
+    step("weights")
     MODEL_PATH = find_model_file()
     
     if MODEL_PATH is None:
@@ -594,6 +612,7 @@ def load_model():
         vae=vae
     )
     
+    step("pipeline")
     pipe.scheduler = DPMSolverMultistepScheduler.from_config(
         pipe.scheduler.config,
         use_karras_sigmas=True,
@@ -613,6 +632,9 @@ def load_model():
     print("✅ LUSTIFY model loaded!")
     return pipe
 
+# Loaded in the background once the server is up; /ready follows its progress
+model_loader = ModelLoader(_load_model, stages=("weights", "pipeline"))
+
 # ============================================
 # PYDANTIC MODELS
 # ============================================
@@ -638,22 +660,24 @@ class GenerateRequest(BaseModel):
 # ============================================
 # PARSE CHARACTER
 # ============================================
+# Description keywords in priority order (character_index.py) - one scan each instead of one per keyword
+HAIR_COLORS = KeywordMatcher(["red", "ginger", "blonde"])
+HAIR_COLOR_PROMPTS = {"red": "red hair, ginger hair", "ginger": "red hair, ginger hair", "blonde": "blonde hair"}
+EYE_COLORS = KeywordMatcher(["green", "blue"])
+
 def parse_character(data: CharacterData) -> Dict[str, str]:
     name = data.name
     age = data.age
     desc = data.description.lower()
     
-    # Hair
-    hair_color = "blonde hair" if "blonde" in desc else "brown hair"
-    if "red" in desc or "ginger" in desc:
-        hair_color = "red hair, ginger hair"
+    # Hair: red / ginger beat blonde, brown when neither is mentioned
+    hair_color = HAIR_COLOR_PROMPTS.get(HAIR_COLORS.first(desc), "brown hair")
     
     hair_style = "braided hair" if "braid" in desc else "long hair"
     
-    # Eyes
-    eyes = "blue eyes" if "blue" in desc else "brown eyes"
-    if "green" in desc:
-        eyes = "green eyes"
+    # Eyes: green beats blue, brown when neither is mentioned
+    eye_color = EYE_COLORS.first(desc)
+    eyes = f"{eye_color} eyes" if eye_color else "brown eyes"
     
     # Skin
     skin = "fair skin, pale skin" if "white" in desc else "fair skin"
@@ -751,6 +775,16 @@ def generate_image(character_data: CharacterData, quality: str = "hq"):
     
     return image, time.time() - t0, prompt
 
+def render_to_base64(character_data: CharacterData, quality: str = "hq"):
+    """Generate + PNG/base64 encode - runs on the GPU worker thread"""
+    image, gen_time, prompt = generate_image(character_data, quality)
+    
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", quality=95)
+    img_base64 = base64.b64encode(buffered.getvalue()).decode()
+    
+    return img_base64, gen_time, prompt
+
 # ============================================
 # ENDPOINTS
 # ============================================
@@ -765,6 +799,7 @@ async def root():
         "endpoints": {
             "generate": "/generate",
             "health": "/health",
+            "ready": "/ready",
             "poses": "/poses"
         }
     }
@@ -772,33 +807,57 @@ async def root():
 @app.get("/health")
 async def health():
     return {
-        "status": "healthy" if pipe is not None else "model not loaded",
-        "model_loaded": pipe is not None,
+        "status": "healthy" if model_loader.ready else "model not loaded",
+        "model_loaded": model_loader.ready,
         "model_path": MODEL_PATH,
-        "gpu_available": torch.cuda.is_available()
+        "gpu_available": torch.cuda.is_available(),
+        "queue": gpu_worker.stats()
+    }
+
+@app.get("/live")
+async def live():
+    """Liveness - the process answers; only a failed model load (needs a restart) is fatal"""
+    if model_loader.failed:
+        return JSONResponse(status_code=503, content={"alive": False, "error": model_loader.error})
+    return {"alive": True}
+
+@app.get("/ready")
+async def ready():
+    """Readiness - 503 with load progress until the pipeline is usable"""
+    status = model_loader.status()
+    if not model_loader.ready:
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": "5"})
+    return status
+
+def payload_response(request: Request, payload: Payload) -> Response:
+    """Pre-encoded bytes: 304 if the client has this version, gzip if it accepts it"""
+    gzip_ok = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "ETag": payload.etag_gzip if gzip_ok else payload.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
     }
+    if payload.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=payload.gzipped, media_type="application/json", headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
 
 @app.get("/poses")
-async def get_poses():
+async def get_poses(request: Request):
     """Get all available poses"""
-    return {
-        "total_categories": len(POSE_LIBRARY),
-        "total_poses": sum(len(poses) for poses in POSE_LIBRARY.values()),
-        "poses": POSE_LIBRARY
-    }
+    return payload_response(request, POSES_PAYLOAD)
 
 @app.post("/generate")
 async def generate(request: GenerateRequest):
     try:
-        image, gen_time, prompt = generate_image(
+        img_base64, gen_time, prompt = await gpu_worker.submit(
+            render_to_base64,
             request.character_data,
             request.quality
         )
         
-        buffered = BytesIO()
-        image.save(buffered, format="PNG", quality=95)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
         pose_name = "Standing"
         pose_category = "Community"
         
@@ -819,6 +878,8 @@ async def generate(request: GenerateRequest):
             }
         }
     
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -831,14 +892,14 @@ async def startup_event():
     print("🚀 LUSTIFY API SERVER STARTING...")
     print("="*60 + "\n")
     
-    try:
-        load_model()
-        print(f"\n✅ Pose library loaded: {sum(len(poses) for poses in POSE_LIBRARY.values())} poses")
-        print("\n" + "="*60)
-        print("✅ SERVER READY!")
-        print("="*60 + "\n")
-    except Exception as e:
-        print(f"\n❌ Startup failed: {e}\n")
+    gpu_worker.start()
+    
+    # Load in the background - /generate requests wait in the GPU queue, /ready reports progress
+    model_loader.start()
+    print(f"\n✅ Pose library loaded: {sum(len(poses) for poses in POSE_LIBRARY.values())} poses")
+    print("\n" + "="*60)
+    print("✅ SERVER UP - model loading in the background (GET /ready)")
+    print("="*60 + "\n")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Batched SDXL rendering
+Compatible requests (same QUALITY_PRESETS entry) are merged into one txt2img call
+and one img2img highres call. Every sample gets its own torch.Generator, so each
+output matches what it would be if it had been rendered alone.
+Text encode, denoise and VAE decode run as separate stages, timed by stage_meter.
+Prompts go through the embedding cache, and every pass gets tensors, not strings.
+render_continuous() does the same per job on a DenoiseEngine, where jobs join
+and leave the running batch between denoising steps.
+Both reuse base-pass latents from a LatentCache when one is passed in.
+A step callback reports per-sample progress (plus latent previews) and aborts
+the batch within one denoising step once every sample in it has been cancelled.
+
+Self-check on CPU:  python batch_render.py
+"""
+import base64
+import time
+from typing import Callable, List, Optional, Sequence
+
+import torch
+from PIL import Image
+
+from gpu_worker import JobCancelledError
+from latent_preview import latents_to_jpeg
+from embedding_cache import embedding_cache
+from stage_meter import stage_meter
+
+
+# ============================================
+# HELPERS
+# ============================================
+def make_generators(seeds: Sequence[int], device, offset: int = 0) -> List[torch.Generator]:
+    """One generator per sample - seed + offset, same as the single-image path"""
+    return [torch.Generator(device=device).manual_seed(seed + offset) for seed in seeds]
+
+def highres_size(preset: dict) -> tuple:
+    return (
+        int(preset['base_width'] * preset['highres_scale']),
+        int(preset['base_height'] * preset['highres_scale']),
+    )
+
+
+class StageCancelled(Exception):
+    """Every sample in the running stage was cancelled, but other samples in the batch are live"""
+
+
+class StepMonitor:
+    """diffusers callback_on_step_end for a batch of samples
+
+    controls[i] is the per-sample handle (a GPUJob): is_cancelled(), emit(),
+    wants_preview(step), preview_size. Tracks steps across the base and highres
+    passes so an abort can report how much GPU time it saved.
+    active are the samples in the running stage, live the ones whose result is
+    still wanted (by default the whole batch).
+    """
+
+    def __init__(self, controls: Sequence, total_steps: int):
+        self.controls = controls
+        self.total_steps = total_steps
+        self.steps_done = 0
+        self.started_at = time.time()
+        self.active: List[int] = list(range(len(controls)))
+        self.live: List[int] = list(range(len(controls)))
+        self.stage = "base"
+        self.stage_total = 0
+
+    def start_stage(self, stage: str, active: List[int], stage_total: int, live: Optional[List[int]] = None):
+        self.stage = stage
+        self.active = active
+        self.live = live if live is not None else list(range(len(self.controls)))
+        self.stage_total = stage_total
+        for i in active:
+            self.controls[i].emit({"type": "stage", "stage": stage, "total_steps": stage_total})
+
+    def check(self):
+        """JobCancelledError once every live sample is cancelled, StageCancelled if only the stage's are"""
+        if not self.active or not all(self.controls[i].is_cancelled() for i in self.active):
+            return
+        if all(self.controls[i].is_cancelled() for i in self.live):
+            per_step = (time.time() - self.started_at) / max(1, self.steps_done)
+            remaining = max(0, self.total_steps - self.steps_done)
+            raise JobCancelledError("cancelled", recovered_s=per_step * remaining)
+        raise StageCancelled(self.stage)
+
+    def __call__(self, pipe, step, timestep, callback_kwargs):
+        self.steps_done += 1
+        self.check()
+
+        latents = callback_kwargs.get("latents")
+        for row, i in enumerate(self.active):
+            control = self.controls[i]
+            if control.is_cancelled():
+                continue
+            event = {
+                "type": "progress",
+                "stage": self.stage,
+                "step": step + 1,
+                "total_steps": self.stage_total,
+                "progress": round(self.steps_done / max(1, self.total_steps), 3),
+            }
+            if latents is not None and control.wants_preview(step + 1):
+                preview = latents_to_jpeg(latents[row], control.preview_size)
+                if preview is not None:
+                    event["preview"] = "data:image/jpeg;base64," + base64.b64encode(preview).decode()
+            control.emit(event)
+        return callback_kwargs
+
+
+# ============================================
+# STAGES
+# ============================================
+def encode_prompts(model, prompts: Sequence[str], negative_prompt: str, clip_skip: Optional[int] = None, tokens: Optional[Sequence] = None) -> dict:
+    """Text encode stage - both CLIP encoders through the embedding cache, as pipeline kwargs
+
+    tokens are pre-assembled input ids (prompt_library), one per prompt or None.
+    """
+    with stage_meter.track("text_encode"):
+        prompt_embeds, pooled = embedding_cache.encode(model, prompts, clip_skip, tokens)
+        # diffusers encodes the negative prompt at the penultimate layer whatever clip_skip is
+        negative, negative_pooled = embedding_cache.encode(model, [negative_prompt], None)
+    batch = len(prompts)
+    return {
+        "prompt_embeds": prompt_embeds,
+        "negative_prompt_embeds": negative.repeat(batch, 1, 1),
+        "pooled_prompt_embeds": pooled,
+        "negative_pooled_prompt_embeds": negative_pooled.repeat(batch, 1),
+    }
+
+def select_embeds(embeds: dict, idx: List[int]) -> dict:
+    return {key: value[idx] for key, value in embeds.items()}
+
+@torch.no_grad()
+def decode_latents(model, latents: torch.Tensor) -> List[Image.Image]:
+    """Decode stage - same VAE steps as the pipeline's own output_type="pil" path"""
+    with stage_meter.track("decode"):
+        vae = model.vae
+        needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+        if needs_upcasting:
+            model.upcast_vae()
+            latents = latents.to(next(iter(vae.post_quant_conv.parameters())).dtype)
+
+        latents_mean = getattr(vae.config, "latents_mean", None)
+        latents_std = getattr(vae.config, "latents_std", None)
+        if latents_mean is not None and latents_std is not None:
+            latents_mean = torch.tensor(latents_mean).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+            latents_std = torch.tensor(latents_std).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+            latents = latents * latents_std / vae.config.scaling_factor + latents_mean
+        else:
+            latents = latents / vae.config.scaling_factor
+
+        image = vae.decode(latents, return_dict=False)[0]
+        if needs_upcasting:
+            vae.to(dtype=torch.float16)
+        if getattr(model, "watermark", None) is not None:
+            image = model.watermark.apply_watermark(image)
+        return model.image_processor.postprocess(image, output_type="pil")
+
+@torch.no_grad()
+def encode_image(model, image: Image.Image, generator: torch.Generator) -> torch.Tensor:
+    """VAE encode for img2img - same steps as the img2img pipeline's prepare_latents"""
+    vae = model.vae
+    pixels = model.image_processor.preprocess(image).to(model.device)
+    needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+    if needs_upcasting:
+        vae.to(dtype=torch.float32)
+        pixels = pixels.float()
+    else:
+        pixels = pixels.to(vae.dtype)
+
+    latents = vae.encode(pixels).latent_dist.sample(generator)
+    if needs_upcasting:
+        vae.to(dtype=torch.float16)
+
+    latents_mean = getattr(vae.config, "latents_mean", None)
+    latents_std = getattr(vae.config, "latents_std", None)
+    if latents_mean is not None and latents_std is not None:
+        latents_mean = torch.tensor(latents_mean).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+        latents_std = torch.tensor(latents_std).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+        return (latents - latents_mean) * vae.config.scaling_factor / latents_std
+    return vae.config.scaling_factor * latents
+
+def render_base(model, embeds: dict, preset: dict, seeds: Sequence[int], **call_kwargs) -> torch.Tensor:
+    """Base txt2img denoise for a whole batch -> latents"""
+    with stage_meter.track("denoise"):
+        return model(
+            **embeds,
+            width=preset['base_width'],
+            height=preset['base_height'],
+            num_inference_steps=preset['steps'],
+            guidance_scale=preset['cfg'],
+            generator=make_generators(seeds, model.device),
+            output_type="latent",
+            **call_kwargs,
+        ).images
+
+def render_highres(model_img2img, images: Sequence[Image.Image], embeds: dict, preset: dict, seeds: Sequence[int], **call_kwargs) -> torch.Tensor:
+    """LANCZOS upscale + img2img highres denoise for a whole batch -> latents"""
+    with stage_meter.track("upscale"):
+        final_w, final_h = highres_size(preset)
+        upscaled = [image.resize((final_w, final_h), Image.LANCZOS) for image in images]
+
+    with stage_meter.track("denoise"):
+        return model_img2img(
+            **embeds,
+            image=upscaled,
+            strength=preset['highres_denoise'],
+            num_inference_steps=preset['highres_steps'],
+            guidance_scale=preset['cfg'],
+            generator=make_generators(seeds, model_img2img.device, offset=1),
+            output_type="latent",
+            **call_kwargs,
+        ).images
+
+def render_batch(model, model_img2img, prompts: Sequence[str], negative_prompt: str, preset: dict, seeds: Sequence[int], use_highres: Optional[Sequence[bool]] = None, controls: Optional[Sequence] = None, latent_cache=None, reused: Optional[List[bool]] = None, tokens: Optional[Sequence] = None, **call_kwargs) -> List[Image.Image]:
+    """GPU stages for a batch: text encode -> base denoise -> decode, then highres for the samples that asked for it
+
+    controls (one GPUJob per sample) are polled every step: progress and
+    previews go out through them, cancelled samples skip the highres pass and
+    the whole call raises JobCancelledError once all samples are cancelled.
+    If only the samples of one pass are cancelled (the highres ones, or the
+    base ones while the rest come from the latent cache), that pass stops and
+    the other samples' images are returned - None for a sample that never got
+    a base pass.
+    With a latent_cache, samples whose base pass is cached skip straight to
+    decode, and new base latents are stored. reused, if given, is filled with
+    one flag per sample. tokens are pre-assembled input ids, one per prompt or None.
+    """
+    use_highres = list(use_highres) if use_highres is not None else [True] * len(prompts)
+    tokens = list(tokens) if tokens is not None else [None] * len(prompts)
+    highres_steps = int(preset['highres_steps'] * preset['highres_denoise'])
+
+    keys, base_latents = [None] * len(prompts), [None] * len(prompts)
+    if latent_cache is not None:
+        keys = [latent_cache.key(model, prompt, negative_prompt, preset, seed) for prompt, seed in zip(prompts, seeds)]
+        base_latents = [latent_cache.get(key, preset['steps']) for key in keys]
+    todo = [i for i, latents in enumerate(base_latents) if latents is None]
+    if reused is not None:
+        reused[:] = [latents is not None for latents in base_latents]
+
+    monitor = None
+    if controls is not None:
+        monitor = StepMonitor(controls, (preset['steps'] if todo else 0) + (highres_steps if any(use_highres) else 0))
+        monitor.check()
+        call_kwargs["callback_on_step_end"] = monitor
+
+    if todo:
+        # The base pass uses clip_skip=2, the highres pass the encoder default
+        embeds = encode_prompts(model, [prompts[i] for i in todo], negative_prompt, clip_skip=2, tokens=[tokens[i] for i in todo])
+        if monitor is not None:
+            monitor.start_stage("base", todo, preset['steps'])
+        try:
+            latents = render_base(model, embeds, preset, [seeds[i] for i in todo], **call_kwargs)
+        except StageCancelled:
+            # Every sample still denoising was cancelled - the ones reused from the cache are live
+            latents = None
+        if latents is not None:
+            for row, i in enumerate(todo):
+                base_latents[i] = latents[row:row + 1]
+                if latent_cache is not None:
+                    latent_cache.put(keys[i], base_latents[i])
+
+    # Cancelled samples without a base pass get no image
+    ready = [i for i, latents in enumerate(base_latents) if latents is not None]
+    images: List[Optional[Image.Image]] = [None] * len(prompts)
+    for i, image in zip(ready, decode_latents(model, torch.cat([base_latents[i].to(model.device) for i in ready]))):
+        images[i] = image
+
+    idx = [i for i, flag in enumerate(use_highres) if flag and not (controls and controls[i].is_cancelled())]
+    if monitor is not None:
+        monitor.total_steps = monitor.steps_done + (highres_steps if idx else 0)
+        monitor.start_stage("highres", idx, highres_steps)
+    if idx:
+        highres_embeds = encode_prompts(model_img2img, [prompts[i] for i in idx], negative_prompt, tokens=[tokens[i] for i in idx])
+        try:
+            latents = render_highres(
+                model_img2img,
+                [images[i] for i in idx],
+                highres_embeds,
+                preset,
+                [seeds[i] for i in idx],
+                **call_kwargs,
+            )
+        except StageCancelled:
+            # Only the highres samples were cancelled - their batch-mates keep the decoded base images
+            return images
+        for i, image in zip(idx, decode_latents(model_img2img, latents)):
+            images[i] = image
+
+    return images
+
+def render_continuous(engine, model, model_img2img, negative_prompt: str, preset: dict, jobs: list, admit: Callable[[int], list], complete: Callable, latent_cache=None) -> None:
+    """Render jobs through a DenoiseEngine, admitting more of them between steps
+
+    jobs are GPUJobs whose payload has prompt, seed and use_highres (and
+    optionally tokens, pre-assembled input ids).
+    admit(n) returns up to n newly started jobs. complete(job, image=None,
+    error=None, reused=False) is called for each job as soon as its own image
+    is ready; reused says the base pass came from latent_cache. A cancelled
+    job's error carries the GPU time its unrun steps would have taken.
+    """
+    base_shape = (model.unet.config.in_channels, preset['base_height'] // model.vae_scale_factor, preset['base_width'] // model.vae_scale_factor)
+
+    def start(job):
+        spec = job.payload
+        key = latent_cache.key(model, spec["prompt"], negative_prompt, preset, spec["seed"]) if latent_cache is not None else None
+        latents = latent_cache.get(key, preset['steps']) if key is not None else None
+        if latents is not None:
+            job.emit({"type": "stage", "stage": "base", "total_steps": 0, "reused": True})
+            return finish_base(job, latents.to(model.device), reused=True)
+
+        embeds = encode_prompts(model, [spec["prompt"]], negative_prompt, clip_skip=2, tokens=[spec.get("tokens")])
+        sample = engine.txt2img(
+            model, embeds, preset['base_width'], preset['base_height'], preset['steps'], preset['cfg'], spec["seed"],
+            control=job, on_done=lambda s: base_done(job, s, key),
+        )
+        job.emit({"type": "stage", "stage": "base", "total_steps": sample.total_steps})
+        engine.add(sample)
+
+    def base_done(job, sample, key):
+        if sample.cancelled:
+            # The highres pass it would have run is saved too
+            highres_steps = int(preset['highres_steps'] * preset['highres_denoise']) if job.payload["use_highres"] else 0
+            recovered_s = sample.recovered_s + engine.step_seconds(highres_steps)
+            return complete(job, error=JobCancelledError(job.cancel_reason or "cancelled", recovered_s=recovered_s))
+        if key is not None:
+            latent_cache.put(key, sample.latents)
+        finish_base(job, sample.latents, reused=False)
+
+    def finish_base(job, latents, reused):
+        image = decode_latents(model, latents)[0]
+        if not job.payload["use_highres"]:
+            return complete(job, image, reused=reused)
+
+        with stage_meter.track("upscale"):
+            upscaled = image.resize(highres_size(preset), Image.LANCZOS)
+        embeds = encode_prompts(model_img2img, [job.payload["prompt"]], negative_prompt, tokens=[job.payload.get("tokens")])
+        sample = engine.img2img(
+            model_img2img, embeds, upscaled, preset['highres_denoise'], preset['highres_steps'], preset['cfg'], job.payload["seed"] + 1,
+            stage="highres", control=job, on_done=lambda s: highres_done(job, s, reused),
+        )
+        job.emit({"type": "stage", "stage": "highres", "total_steps": sample.total_steps})
+        engine.add(sample)
+
+    def highres_done(job, sample, reused):
+        if sample.cancelled:
+            return complete(job, error=JobCancelledError(job.cancel_reason or "cancelled", recovered_s=sample.recovered_s))
+        complete(job, decode_latents(model_img2img, sample.latents)[0], reused=reused)
+
+    for job in list(jobs):
+        start(job)
+    while engine.active:
+        for job in admit(engine.room(base_shape)):
+            start(job)
+        engine.step()
+
+
+# ============================================
+# SELF-CHECK (CPU, tiny random SDXL)
+# ============================================
+if __name__ == "__main__":
+    import numpy as np
+    from tiny_sdxl import build_tiny_sdxl, TINY_PRESETS
+
+    pipe, pipe_img2img = build_tiny_sdxl()
+    preset = TINY_PRESETS["tiny"]
+    prompts = ["1girl, standing, red hair", "1girl, sitting, blonde hair", "1girl, kneeling"]
+    seeds = [11, 22, 33]
+    flags = [True, False, True]
+
+    print("🧪 Batched vs single renders on tiny SDXL")
+    batched = render_batch(pipe, pipe_img2img, prompts, "bad quality", preset, seeds, flags)
+    worst = 0.0
+    for i in range(len(prompts)):
+        single = render_batch(pipe, pipe_img2img, [prompts[i]], "bad quality", preset, [seeds[i]], [flags[i]])[0]
+        diff = np.abs(np.asarray(batched[i], dtype=np.int16) - np.asarray(single, dtype=np.int16)).max()
+        worst = max(worst, diff)
+        print(f"   sample {i}: {single.size}, max pixel diff {diff}")
+
+    assert worst <= 1, f"batched output diverged from single render (max diff {worst})"
+    print("✅ Batched outputs match single renders")
+
+    # Cached embeddings + staged decode vs the plain string-prompt pipeline
+    cached = render_batch(pipe, pipe_img2img, prompts[:1], "bad quality", preset, seeds[:1], [False])[0]
+    plain = pipe(
+        prompt=prompts[:1], negative_prompt=["bad quality"], width=preset['base_width'], height=preset['base_height'],
+        num_inference_steps=preset['steps'], guidance_scale=preset['cfg'], generator=make_generators(seeds[:1], "cpu"), clip_skip=2,
+    ).images[0]
+    assert np.array_equal(np.asarray(cached), np.asarray(plain)), "cached embeddings changed the output"
+    print(f"✅ Cached embeddings match the pipeline ({embedding_cache.stats()})")
+
+    # Follow-up with highres flipped: the base pass comes from the latent cache
+    from latent_cache import LatentCache
+    latent_cache = LatentCache()
+    render_batch(pipe, pipe_img2img, prompts[:2], "bad quality", preset, seeds[:2], [False, False], latent_cache=latent_cache)
+    reused = []
+    again = render_batch(pipe, pipe_img2img, prompts[:2], "bad quality", preset, seeds[:2], [True, True], latent_cache=latent_cache, reused=reused)
+    fresh = render_batch(pipe, pipe_img2img, prompts[:2], "bad quality", preset, seeds[:2], [True, True])
+    assert reused == [True, True], reused
+    assert all(np.array_equal(np.asarray(a), np.asarray(b)) for a, b in zip(again, fresh)), "reused base pass changed the output"
+    print(f"✅ Reused base latents match a fresh render ({latent_cache.stats()})")
+
+    # Cancelling every highres sample stops that pass, not the batch: the base-only sample keeps its image
+    class Control:
+        preview_size = 64
+
+        def __init__(self, cancel_at_stage: Optional[str] = None):
+            self.cancel_at_stage = cancel_at_stage
+            self.cancelled = False
+
+        def is_cancelled(self) -> bool:
+            return self.cancelled
+
+        def emit(self, event: dict):
+            if event["type"] == "stage" and event["stage"] == self.cancel_at_stage:
+                self.cancelled = True
+
+        def wants_preview(self, step: int) -> bool:
+            return False
+
+    controls = [Control("highres"), Control(), Control("highres")]
+    mixed = render_batch(pipe, pipe_img2img, prompts, "bad quality", preset, seeds, flags, controls=controls)
+    assert np.array_equal(np.asarray(mixed[1]), np.asarray(batched[1])), "live base-only sample lost its image"
+    try:
+        render_batch(pipe, pipe_img2img, prompts[::2], "bad quality", preset, seeds[::2], [True, True], controls=[Control("highres"), Control("highres")])
+        raise AssertionError("expected JobCancelledError")
+    except JobCancelledError:
+        pass
+    print("✅ Cancelled highres samples skip that pass without failing live batch-mates")
+
+    # Same for the base pass: a live sample whose base latents are cached keeps its image
+    latent_cache = LatentCache()
+    render_batch(pipe, pipe_img2img, prompts[1:2], "bad quality", preset, seeds[1:2], [False], latent_cache=latent_cache)
+    reused = []
+    mixed = render_batch(pipe, pipe_img2img, prompts[:2], "bad quality", preset, seeds[:2], [False, False], controls=[Control("base"), Control()], latent_cache=latent_cache, reused=reused)
+    assert reused == [False, True] and mixed[0] is None, reused
+    assert np.array_equal(np.asarray(mixed[1]), np.asarray(batched[1])), "live cached sample lost its image"
+    print("✅ Cancelled base samples skip that pass without failing batch-mates reused from the latent cache")
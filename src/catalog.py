@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Catalog - pose / occupation listings, serialized once
+The frontend polls /poses and /occupations constantly, and the data only
+changes on deploy (or once the model's tokenizers give token counts). The
+catalog is built once, versioned by a hash of its content, and every listing is kept as
+ready-to-send JSON bytes plus a gzip copy and an ETag, so a poll is a dict
+lookup - or a bodiless 304 when the client already has that version.
+Category filters use precomputed per-category lists; pages of them are
+encoded on first request and memoized.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class Payload:
+    """One pre-encoded response: JSON bytes, gzip bytes and their ETags"""
+
+    __slots__ = ("body", "gzipped", "etag", "etag_gzip")
+
+    def __init__(self, content: dict):
+        self.body = json.dumps(content, separators=(",", ":")).encode()
+        self.gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.etag_gzip = f'"{digest}-gz"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match hit for either encoding (or *)"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags or self.etag_gzip in tags
+
+
+class Catalog:
+    """Versioned pose + occupation catalog with pre-encoded listings"""
+
+    def __init__(
+        self,
+        prompts: Dict[str, str],
+        categories: Dict[str, Sequence[str]],
+        occupations: Dict[str, dict],
+        presets: Dict[str, dict],
+        cost: Callable[[dict, bool], float],
+        token_info: Optional[Dict[str, dict]] = None,
+        max_pages: int = 256,
+    ):
+        category_of = {pose: category for category, poses in categories.items() for pose in poses}
+        preset_info = {
+            name: {
+                "base": f"{preset['base_width']}x{preset['base_height']}",
+                "highres": f"{int(preset['base_width'] * preset['highres_scale'])}x{int(preset['base_height'] * preset['highres_scale'])}",
+                "work_units": round(cost(preset, True), 2),
+                "work_units_no_highres": round(cost(preset, False), 2),
+            }
+            for name, preset in presets.items()
+        }
+
+        self.poses: List[dict] = []
+        for name, prompt in prompts.items():
+            counts = (token_info or {}).get(name, {})
+            self.poses.append({
+                "name": name,
+                "category": category_of.get(name, "misc"),
+                # CLIP tokens, and where the encoder's 75-token window ends (prompt_library)
+                "tokens": counts.get("tokens"),
+                "dropped_tokens": counts.get("dropped"),
+                "cut_after": counts.get("cut_after"),
+                # Megapixel-steps with highres per preset - /estimate turns them into seconds
+                "cost": {preset: info["work_units"] for preset, info in preset_info.items()},
+            })
+        self.occupations = [{"name": name, **settings} for name, settings in occupations.items()]
+
+        # Precomputed indexes: category -> poses in PROMPTS order
+        self.by_category: Dict[str, List[dict]] = {}
+        for pose in self.poses:
+            self.by_category.setdefault(pose["category"], []).append(pose)
+
+        content = {
+            "categories": {category: len(poses) for category, poses in self.by_category.items()},
+            "presets": preset_info,
+            "poses": self.poses,
+            "occupations": self.occupations,
+        }
+        self.version = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:12]
+        self.full = Payload({"version": self.version, **content})
+        self.occupation_list = Payload({
+            "version": self.version,
+            "total": len(self.occupations),
+            "occupations": [occupation["name"] for occupation in self.occupations],
+            "items": self.occupations,
+        })
+
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[tuple, Payload]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.page(None, 0, None)
+        for category in self.by_category:
+            self.page(category, 0, None)
+
+    def page(self, category: Optional[str], offset: int = 0, limit: Optional[int] = None) -> Payload:
+        """Pose listing (optionally one category, one page) - KeyError for an unknown category"""
+        key = (category, offset, limit)
+        with self._lock:
+            payload = self._pages.get(key)
+            if payload is not None:
+                self._pages.move_to_end(key)
+                return payload
+
+        poses = self.poses if category is None else self.by_category[category]
+        items = poses[offset:offset + limit] if limit is not None else poses[offset:]
+        payload = Payload({
+            "version": self.version,
+            "category": category,
+            "total": len(poses),
+            "offset": offset,
+            "limit": limit,
+            "poses": [pose["name"] for pose in items],
+            "items": items,
+        })
+        with self._lock:
+            self._pages[key] = payload
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "poses": len(self.poses),
+            "categories": len(self.by_category),
+            "occupations": len(self.occupations),
+            "tokens_counted": bool(self.poses) and self.poses[0]["tokens"] is not None,
+            "pages_cached": len(self._pages),
+            "full_kb": round(len(self.full.body) / 1024, 1),
+            "full_gzip_kb": round(len(self.full.gzipped) / 1024, 1),
+        }
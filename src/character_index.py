@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Character Index - lookup structures for resolving CharacterData
+Built once at import from the module-level tables in fastapicyber:
+- occupations: one dict from ID, exact name and lowercased name to the
+  OCCUPATION_SETTINGS key, instead of a linear case-insensitive scan
+- description keywords: one regex scan over the lowercased description that
+  returns the highest-priority keyword present, instead of one substring scan
+  (and one lower()) per keyword
+"""
+import re
+from typing import Dict, Optional, Sequence
+
+
+class KeywordMatcher:
+    """First keyword of a priority-ordered list that occurs anywhere in a text, in one scan
+
+    Same answer as `next(k for k in keywords if k in text)` as long as no keyword
+    overlaps another (no keyword contains another, or ends with another's start) -
+    overlapping occurrences would hide each other from a single scan.
+    """
+
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = list(keywords)
+        self.rank = {keyword: i for i, keyword in enumerate(self.keywords)}
+        self.pattern = re.compile("|".join(re.escape(keyword) for keyword in self.keywords))
+
+    def first(self, text: str) -> Optional[str]:
+        best = None
+        for match in self.pattern.finditer(text):
+            keyword = match.group()
+            if best is None or self.rank[keyword] < self.rank[best]:
+                best = keyword
+                if self.rank[best] == 0:
+                    break
+        return best
+
+
+def build_occupation_index(settings: Dict[str, dict], id_map: Dict[str, str]) -> Dict[str, str]:
+    """ID, exact name or lowercased name -> OCCUPATION_SETTINGS key
+
+    Look up the raw value first, then value.lower(). IDs win over names, exact
+    names over case-insensitive ones, and the first of two names that only
+    differ in case wins - the order the old scan checked them in.
+    """
+    index: Dict[str, str] = {}
+    for name in settings:
+        index.setdefault(name.lower(), name)
+    index.update({name: name for name in settings})
+    index.update(id_map)
+    return index
+
+
+# ============================================
+# EQUIVALENCE CHECK + MICROBENCHMARK
+# ============================================
+if __name__ == "__main__":
+    import contextlib
+    import itertools
+    import os
+    import sys
+    import time
+
+    import fastapicyber as fc
+    from fastapicyber import CharacterData, PersonalityData, PhysicalAttributes
+
+    # The per-request code before the index, verbatim minus comments
+    def legacy_occupation(character):
+        print(f"\n🔍 DEBUG get_occupation_name:")
+        print(f"   character.personalityId: {character.personalityId}")
+        if character.personalityId:
+            print(f"   character.personalityId.occupationId: {character.personalityId.occupationId}")
+        if character.personalityId and character.personalityId.occupationId:
+            occ_value = character.personalityId.occupationId
+            print(f"   occ_value: '{occ_value}'")
+            print(f"   occ_value type: {type(occ_value)}")
+            if occ_value in fc.OCCUPATION_ID_MAP:
+                print(f"   ✅ Found in OCCUPATION_ID_MAP: {fc.OCCUPATION_ID_MAP[occ_value]}")
+                return fc.OCCUPATION_ID_MAP[occ_value]
+            if occ_value in fc.OCCUPATION_SETTINGS:
+                print(f"   ✅ Found in OCCUPATION_SETTINGS: {occ_value}")
+                return occ_value
+            for occ_name in fc.OCCUPATION_SETTINGS.keys():
+                if occ_name.lower() == occ_value.lower():
+                    print(f"   ✅ Found case-insensitive match: {occ_name}")
+                    return occ_name
+            print(f"   ❌ Not found in any mapping, returning 'None'")
+        else:
+            print(f"   ❌ No personalityId or occupationId, returning 'None'")
+        return "None"
+
+    def legacy_features(character):
+        hair_colors = ['blonde', 'brunette', 'red', 'black', 'brown', 'white']
+        hair_color = None
+        for color in hair_colors:
+            if color in character.description.lower():
+                hair_color = color
+                break
+        hair_style = None
+        if character.hairStyle:
+            hair_style = character.hairStyle.lower()
+        elif character.physicalAttributesId and character.physicalAttributesId.hairStyle:
+            hair_style = character.physicalAttributesId.hairStyle.lower()
+        if hair_style and hair_style in ["ponytail", "bun", "braided"]:
+            hair = f"{hair_color or 'long'} hair in {hair_style}"
+        else:
+            hair = f"{hair_color or 'long'} {hair_style or ''} hair".strip()
+        eye_color = (character.eyeColor or (character.physicalAttributesId.eyeColor if character.physicalAttributesId else None) or "blue")
+        breast_size = (character.breastSize or (character.physicalAttributesId.breastSize if character.physicalAttributesId else None) or "Large")
+        breast_map = {"small": "small perky breasts", "medium": "medium natural breasts", "large": "large perky natural breasts", "extra-large": "extremely large natural breasts"}
+        butt_size = (character.buttSize or (character.physicalAttributesId.buttSize if character.physicalAttributesId else None) or "Medium")
+        butt_map = {"small": "small firm butt", "medium": "round bubble butt", "large": "large round ass", "extra-large": "huge bubble butt"}
+        ethnicity = (character.ethnicity or (character.physicalAttributesId.ethnicity if character.physicalAttributesId else None) or "white")
+        skin_map = {"white": "smooth fair skin", "black": "smooth dark skin", "asian": "smooth fair skin", "latina": "smooth tan skin", "arab": "smooth tan skin"}
+        return {
+            "name": character.name, "age": character.age, "hair": hair, "eyes": f"{eye_color.lower()} eyes", "body": "athletic toned",
+            "breasts": breast_map.get(breast_size.lower(), "large perky natural breasts"),
+            "butt": butt_map.get(butt_size.lower(), "round bubble butt"),
+            "skin": skin_map.get(ethnicity.lower(), "smooth tan skin"),
+        }
+
+    def legacy(character):
+        return legacy_features(character), legacy_occupation(character)
+
+    def indexed(character):
+        return fc.parse_character_features(character), fc.get_occupation_name(character)
+
+    # Equivalence over descriptions, occupation spellings and attribute sources
+    descriptions = ["", "Blonde bombshell", "a BRUNETTE with red lips", "black hair, white dress", "tired redhead", "Brown eyes"]
+    occupations = [None, "Doctor", "doctor", "SURFING INSTRUCTOR", "693dbf7e31bf0f5e9dee5509", "Astronaut", ""]
+    attributes = [
+        {},
+        {"hairStyle": "Ponytail", "eyeColor": "Green", "breastSize": "Small", "buttSize": "Extra-Large", "ethnicity": "Latina"},
+        {"physicalAttributesId": PhysicalAttributes(hairStyle="long wavy", eyeColor="Hazel", breastSize="Medium", ethnicity="Black")},
+        {"hairStyle": "bun", "physicalAttributesId": PhysicalAttributes(hairStyle="straight", buttSize="Large", ethnicity="Arab")},
+    ]
+    characters = [
+        CharacterData(
+            name="check", age=24, gender="female", description=description,
+            personalityId=PersonalityData(occupationId=occupation) if occupation is not None else None,
+            **fields,
+        )
+        for description, occupation, fields in itertools.product(descriptions, occupations, attributes)
+    ]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        mismatches = [character for character in characters if legacy(character) != indexed(character)]
+    if mismatches:
+        print(f"❌ {len(mismatches)} of {len(characters)} characters resolve differently, e.g. {mismatches[0]}")
+        sys.exit(1)
+    print(f"✅ {len(characters)} characters resolve identically")
+
+    # Per-request cost; the old debug prints go to /dev/null, so this undercounts them vs a real log pipe
+    rounds = 200
+    for label, fn in (("before", legacy), ("indexed", indexed)):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for character in characters:
+                    fn(character)
+            per = (time.perf_counter() - start) / (rounds * len(characters))
+        print(f"   {label:>7}: {per * 1e6:6.2f} µs/character")
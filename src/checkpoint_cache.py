@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Checkpoint Cache - the single-file checkpoint converted once, loaded directly
+from_single_file re-parses the whole .safetensors checkpoint, maps its keys
+onto diffusers modules and casts everything to fp16 on every process start.
+The first load saves each component (UNet, VAE, both text encoders, plus
+tokenizers and scheduler config) as fp16 safetensors in diffusers layout,
+in a folder named after the source file's sha256. Later starts load the
+components straight from those files (safetensors are memory-mapped, already
+fp16, no key conversion) and report how long each one took.
+
+The sha256 of a multi-GB file is itself slow, so it is remembered per
+(path, size, mtime). Conversion runs under a file lock - workers starting
+together convert once. A new save replaces older conversions of the same
+source path, so the cache holds one entry (~7GB for SDXL) per checkpoint.
+
+Self-check with a tiny generated checkpoint:  python checkpoint_cache.py
+"""
+import fcntl
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import time
+from typing import Callable, Dict, Tuple
+
+import torch
+
+MARKER = "complete.json"
+COMPONENTS = ("unet", "vae", "text_encoder", "text_encoder_2")
+
+
+def file_sha256(path: str, chunk: int = 16 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CheckpointCache:
+    """source checkpoint sha256 -> fp16 diffusers folder under root"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    # ---------- keys ----------
+    def fingerprint(self, path: str) -> str:
+        """sha256 of the source file - hashed once per (path, size, mtime)"""
+        stat = os.stat(path)
+        identity = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        known_path = os.path.join(self.root, "fingerprints.json")
+        try:
+            with open(known_path) as f:
+                known = json.load(f)
+        except (OSError, ValueError):
+            known = {}
+        if identity not in known:
+            known[identity] = file_sha256(path)
+            tmp = f"{known_path}.tmp{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump(known, f, indent=1)
+            os.replace(tmp, known_path)
+        return known[identity]
+
+    def folder(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:16])
+
+    # ---------- load ----------
+    def load(self, path: str, convert: Callable[[str], object], dtype: torch.dtype = torch.float16) -> Tuple[object, Dict]:
+        """(pipeline, timings) - from the cache, or convert(path) once and save it
+
+        convert is the slow path, e.g. StableDiffusionXLPipeline.from_single_file.
+        """
+        start = time.perf_counter()
+        sha256 = self.fingerprint(path)
+        timings: Dict = {"fingerprint_s": round(time.perf_counter() - start, 2)}
+        folder = self.folder(sha256)
+
+        if not os.path.exists(os.path.join(folder, MARKER)):
+            with open(os.path.join(self.root, ".lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                # Another worker may have converted it while we waited
+                if not os.path.exists(os.path.join(folder, MARKER)):
+                    pipe = self._convert(path, convert, dtype, timings)
+                    self._save(pipe, path, sha256, timings)
+                    timings["source"] = "converted"
+                    timings["total_s"] = round(time.perf_counter() - start, 2)
+                    return pipe, timings
+
+        pipe = self._load_folder(folder, dtype, timings)
+        timings["source"] = "cache"
+        timings["total_s"] = round(time.perf_counter() - start, 2)
+        return pipe, timings
+
+    def _convert(self, path: str, convert: Callable[[str], object], dtype: torch.dtype, timings: Dict):
+        started = time.perf_counter()
+        pipe = convert(path)
+        for name in COMPONENTS:
+            getattr(pipe, name).to(dtype=dtype)
+        timings["convert_s"] = round(time.perf_counter() - started, 2)
+        return pipe
+
+    def _save(self, pipe, path: str, sha256: str, timings: Dict):
+        started = time.perf_counter()
+        folder = self.folder(sha256)
+        tmp = f"{folder}.tmp{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        pipe.save_pretrained(tmp, safe_serialization=True)
+        with open(os.path.join(tmp, MARKER), "w") as f:
+            json.dump({"source": os.path.realpath(path), "sha256": sha256, "saved_at": time.time()}, f)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp, folder)
+        timings["save_s"] = round(time.perf_counter() - started, 2)
+
+        # Older conversions of this path are stale - other checkpoints keep theirs
+        for name in os.listdir(self.root):
+            other = os.path.join(self.root, name)
+            if other == folder or not os.path.isdir(other):
+                continue
+            try:
+                with open(os.path.join(other, MARKER)) as f:
+                    stale = json.load(f).get("source") == os.path.realpath(path)
+            except (OSError, ValueError):
+                continue
+            if stale:
+                shutil.rmtree(other, ignore_errors=True)
+
+    def _load_folder(self, folder: str, dtype: torch.dtype, timings: Dict):
+        """Each component from its own fp16 safetensors, then the pipeline from model_index.json"""
+        with open(os.path.join(folder, "model_index.json")) as f:
+            index = json.load(f)
+
+        components, options = {}, {}
+        for name, value in index.items():
+            if name.startswith("_"):
+                continue
+            if not isinstance(value, list):
+                options[name] = value  # e.g. force_zeros_for_empty_prompt
+                continue
+            library, class_name = value
+            if library is None:
+                components[name] = None
+                continue
+            cls = getattr(importlib.import_module(library), class_name)
+            kwargs = {"torch_dtype": dtype} if issubclass(cls, torch.nn.Module) else {}
+            started = time.perf_counter()
+            components[name] = cls.from_pretrained(folder, subfolder=name, **kwargs)
+            timings[f"{name}_s"] = round(time.perf_counter() - started, 3)
+
+        pipeline_class = getattr(importlib.import_module("diffusers"), index["_class_name"])
+        return pipeline_class(**components, **options)
+
+
+# ============================================
+# SELF-CHECK (tiny generated checkpoint)
+# ============================================
+if __name__ == "__main__":
+    import tempfile
+
+    from safetensors.torch import load_file, save_file
+
+    from tiny_sdxl import build_tiny_sdxl
+
+    def write_checkpoint(path: str, seed: int):
+        """A tiny SDXL as one single-file checkpoint (component-prefixed keys, fp32)"""
+        pipe, _ = build_tiny_sdxl(seed=seed)
+        state = {
+            f"{name}.{key}": tensor.detach().clone().contiguous()
+            for name in COMPONENTS
+            for key, tensor in getattr(pipe, name).state_dict().items()
+        }
+        save_file(state, path)
+
+    conversions = []
+
+    def convert(path: str):
+        """The slow path: build the module skeletons and map the single file's keys onto them"""
+        conversions.append(path)
+        pipe, _ = build_tiny_sdxl(seed=123)
+        state = load_file(path)
+        for name in COMPONENTS:
+            prefix = f"{name}."
+            getattr(pipe, name).load_state_dict({key[len(prefix):]: tensor for key, tensor in state.items() if key.startswith(prefix)})
+        return pipe
+
+    def weights(pipe) -> Dict[str, torch.Tensor]:
+        return {f"{name}.{key}": tensor for name in COMPONENTS for key, tensor in getattr(pipe, name).state_dict().items()}
+
+    with tempfile.TemporaryDirectory() as root:
+        source = os.path.join(root, "tiny.safetensors")
+        write_checkpoint(source, seed=7)
+        cache = CheckpointCache(os.path.join(root, "cache"))
+
+        first, cold = cache.load(source, convert)
+        assert cold["source"] == "converted" and len(conversions) == 1
+        assert all(tensor.dtype == torch.float16 for tensor in weights(first).values() if tensor.is_floating_point())
+
+        # A fresh process: nothing converted, same fp16 weights, per-component timings
+        second, warm = CheckpointCache(os.path.join(root, "cache")).load(source, convert)
+        assert warm["source"] == "cache" and len(conversions) == 1, warm
+        expected, loaded = weights(first), weights(second)
+        assert expected.keys() == loaded.keys() and all(torch.equal(expected[key], loaded[key]) for key in expected)
+        assert all(f"{name}_s" in warm for name in COMPONENTS)
+        assert type(second).__name__ == "StableDiffusionXLPipeline" and second.tokenizer_2 is not None
+        print(f"✅ Cached checkpoint loads with identical fp16 weights")
+        print(f"   cold: {cold}")
+        print(f"   warm: {warm}")
+
+        # A second checkpoint gets its own entry next to the first
+        other = os.path.join(root, "other.safetensors")
+        write_checkpoint(other, seed=9)
+        cache.load(other, convert)
+        entries = lambda: [name for name in os.listdir(cache.root) if os.path.isdir(os.path.join(cache.root, name))]
+        assert len(conversions) == 2 and len(entries()) == 2, entries()
+
+        # New source bytes -> new key, the path's old entry dropped
+        write_checkpoint(source, seed=8)
+        os.utime(source, ns=(time.time_ns(), time.time_ns() + 1))
+        _, again = cache.load(source, convert)
+        assert again["source"] == "converted" and len(conversions) == 3
+        assert len(entries()) == 2, entries()
+        print("✅ A changed checkpoint is re-converted and replaces its old entry, other checkpoints keep theirs")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Request Coalescing - one GPU run for identical in-flight requests
+Requests are keyed by their fully resolved inputs (checkpoint, final prompt,
+negative prompt, preset, seed, highres and enhance flags). A request whose key is already
+rendering attaches to that flight instead of queuing a second GPU job - also
+after the GPU is done, while the result is still being uploaded. Every
+attached job record gets the same result when the flight lands. The GPU job is
+cancelled only once every attached record has been cancelled.
+"""
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+from job_store import JobRecord
+
+
+def canonical_key(prompt: str, negative_prompt: str, quality: str, seed: Optional[int], use_highres: bool, enhance: bool, model: str = "") -> str:
+    """Stable hash of everything that determines the output pixels (seed=None: everything but the seed)"""
+    canonical = json.dumps(
+        {
+            "model": model,
+            "prompt": " ".join(prompt.split()),
+            "negative_prompt": " ".join(negative_prompt.split()),
+            "quality": quality,
+            "seed": None if seed is None else int(seed),
+            "use_highres": bool(use_highres),
+            "enhance": bool(enhance),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class Flight:
+    """One GPU job and the job records waiting on it"""
+
+    def __init__(self, key: str, gpu_job):
+        self.key = key
+        self.gpu_job = gpu_job
+        self.records: List[JobRecord] = []
+
+    def has_listeners(self) -> bool:
+        return any(record.subscribers for record in self.records)
+
+    def publish(self, event: dict):
+        for record in self.records:
+            record.publish(event)
+
+
+class FlightTable:
+    """In-flight renders by canonical key (event loop only)"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._by_job: Dict[str, Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Flight]:
+        """In-flight render for key - until land(), so requests arriving while a finished
+        image is still being encoded or uploaded share it. A failed or cancelled run is not joined."""
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        future = flight.gpu_job.future
+        if future.done() and (future.cancelled() or future.exception() is not None):
+            return None
+        return flight
+
+    def of(self, job_id: str) -> Optional[Flight]:
+        return self._by_job.get(job_id)
+
+    def start(self, key: str, gpu_job, record: JobRecord) -> Flight:
+        flight = Flight(key, gpu_job)
+        self._flights[key] = flight
+        self.started += 1
+        self.attach(flight, record)
+        return flight
+
+    def attach(self, flight: Flight, record: JobRecord):
+        if flight.records:
+            self.coalesced += 1
+        flight.records.append(record)
+        self._by_job[record.job_id] = flight
+
+    def detach(self, record: JobRecord):
+        flight = self._by_job.pop(record.job_id, None)
+        if flight is not None and record in flight.records:
+            flight.records.remove(record)
+
+    def land(self, flight: Flight) -> List[JobRecord]:
+        """Flight finished - forget it and return the records to resolve"""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        for record in flight.records:
+            if self._by_job.get(record.job_id) is flight:
+                del self._by_job[record.job_id]
+        return list(flight.records)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "attached": sum(len(flight.records) for flight in self._flights.values()),
+            "gpu_runs": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Cost Model - how long a render will hold the GPU
+Work is measured in megapixel-steps: base pixels x base steps, plus upscaled
+pixels x the highres steps that actually run (steps x denoise). One seconds per
+megapixel-step rate turns that into time. The rate is calibrated online from
+measured batch run times, so it follows the real GPU, attention backend and
+batching efficiency.
+"""
+import threading
+
+
+def preset_units(preset: dict, use_highres: bool = True) -> float:
+    """Megapixel-steps of GPU work for one image of a QUALITY_PRESETS entry"""
+    units = preset['base_width'] * preset['base_height'] * preset['steps'] / 1e6
+    if use_highres:
+        width = int(preset['base_width'] * preset['highres_scale'])
+        height = int(preset['base_height'] * preset['highres_scale'])
+        units += width * height * int(preset['highres_steps'] * preset['highres_denoise']) / 1e6
+    return units
+
+
+class CostModel:
+    """seconds = rate x megapixel-steps, with rate as an EWMA of observed runs"""
+
+    def __init__(self, s_per_unit: float = 0.2, alpha: float = 0.2):
+        self.prior = s_per_unit
+        self.s_per_unit = s_per_unit
+        self.alpha = alpha
+        self.samples = 0
+        self._error = 0.0  # EWMA of |predicted - actual| / actual
+        self._lock = threading.Lock()
+
+    def seconds(self, units: float) -> float:
+        return units * self.s_per_unit
+
+    def observe(self, units: float, elapsed: float):
+        """Calibrate from one finished batch: its total units and wall time"""
+        if units <= 0 or elapsed <= 0:
+            return
+        with self._lock:
+            error = abs(self.seconds(units) - elapsed) / elapsed
+            rate = elapsed / units
+            if self.samples == 0:
+                # First measurement replaces the prior outright - the prior can be off by 10x
+                self.s_per_unit = rate
+                self._error = error
+            else:
+                self.s_per_unit += self.alpha * (rate - self.s_per_unit)
+                self._error += self.alpha * (error - self._error)
+            self.samples += 1
+
+    def stats(self) -> dict:
+        return {
+            "s_per_mpx_step": round(self.s_per_unit, 5),
+            "prior_s_per_mpx_step": self.prior,
+            "samples": self.samples,
+            "calibrated": self.samples > 0,
+            "mean_abs_error": round(self._error, 3) if self.samples else None,
+        }
@@ -3,6 +3,8 @@ import time
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline, DPMSolverMultistepScheduler
 from PIL import Image, ImageEnhance, ImageFilter
 
+from batch_render import encode_prompts
+
 # ============================================
 # CONFIGURATION - ULTRA HD (PORTRAIT)
 # ============================================
@@ -1225,14 +1227,12 @@ def generate_ultra_hd(
     stage1_start = time.time()
     
     image = pipe(
-        prompt=PROMPTS[prompt_key],
-        negative_prompt=NEGATIVE,
+        **encode_prompts(pipe, [PROMPTS[prompt_key]], NEGATIVE, clip_skip=2),
         width=preset['base_width'],
         height=preset['base_height'],
         num_inference_steps=preset['steps'],
         guidance_scale=preset['cfg'],
         generator=generator,
-        clip_skip=2,
     ).images[0]
     
     print(f"   ✅ Base done: {time.time()-stage1_start:.1f}s")
@@ -1246,8 +1246,7 @@ def generate_ultra_hd(
         generator = torch.Generator(device="cuda").manual_seed(seed + 1)
         
         image = pipe_img2img(
-            prompt=PROMPTS[prompt_key],
-            negative_prompt=NEGATIVE,
+            **encode_prompts(pipe_img2img, [PROMPTS[prompt_key]], NEGATIVE),
             image=upscaled,
             strength=preset['highres_denoise'],
             num_inference_steps=preset['highres_steps'],
@@ -1266,8 +1265,7 @@ def generate_ultra_hd(
         detail_prompt = PROMPTS[prompt_key] + ", extremely detailed skin pores, hyper detailed, sharp focus"
         
         image = pipe_img2img(
-            prompt=detail_prompt,
-            negative_prompt=NEGATIVE,
+            **encode_prompts(pipe_img2img, [detail_prompt], NEGATIVE),
             image=image,
             strength=0.2,
             num_inference_steps=20,
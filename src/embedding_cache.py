@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Embedding Cache - LRU of SDXL text-encoder outputs across requests
+Both CLIP encoders run for every prompt on every pass. NEGATIVE_PROMPT never
+changes, and the PROMPTS entries repeat all day, so (model, prompt, clip_skip)
+maps to the same prompt_embeds / pooled_prompt_embeds every time. Entries stay
+on the model's device and are bounded by a byte budget. Misses are looked up
+in the model's mmap'd EmbeddingStore (if one is attached) before the encoders
+run.
+"""
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+
+from embedding_store import EmbeddingStore, text_key, token_key
+
+
+@torch.no_grad()
+def encode_token_ids(model, prompts: Sequence, clip_skip: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """encode_prompt's positive branch, fed pre-assembled ids (prompt_library.TokenizedPrompt) instead of text"""
+    hidden, pooled = [], None
+    for k, encoder in enumerate((model.text_encoder, model.text_encoder_2)):
+        ids = torch.tensor([prompt.ids[k] for prompt in prompts], dtype=torch.long, device=encoder.device)
+        output = encoder(ids, output_hidden_states=True)
+        # Pooled output only comes from the projection encoder (text_encoder_2)
+        if pooled is None and output[0].ndim == 2:
+            pooled = output[0]
+        # "2" because SDXL always indexes from the penultimate layer
+        hidden.append(output.hidden_states[-2] if clip_skip is None else output.hidden_states[-(clip_skip + 2)])
+    return torch.concat(hidden, dim=-1).to(dtype=model.text_encoder_2.dtype, device=model.device), pooled
+
+
+class EmbeddingCache:
+    """(model, prompt, clip_skip) -> (prompt_embeds, pooled_prompt_embeds), LRU by bytes"""
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Text encoder module -> token; pipelines that share encoders share entries
+        self._model_tokens: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        # text_encoder_2 -> precomputed store for that checkpoint
+        self._stores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def model_key(self, model) -> tuple:
+        keys = []
+        for encoder in (model.text_encoder, model.text_encoder_2):
+            if encoder not in self._model_tokens:
+                self._model_tokens[encoder] = uuid.uuid4().hex
+            keys.append(self._model_tokens[encoder])
+        return tuple(keys)
+
+    def attach_store(self, model, store: EmbeddingStore) -> bool:
+        """Serve this model's misses from store first - refused if its shapes don't fit the encoders"""
+        dim = model.text_encoder.config.hidden_size + model.text_encoder_2.config.hidden_size
+        if (store.seq_len, store.dim, store.pooled_dim) != (model.tokenizer.model_max_length, dim, model.text_encoder_2.config.projection_dim):
+            print(f"⚠️ Embedding store {store.path} does not match the text encoders - not used")
+            return False
+        self._stores[model.text_encoder_2] = store
+        return True
+
+    @staticmethod
+    def _size(entry: Tuple[torch.Tensor, torch.Tensor]) -> int:
+        return sum(tensor.numel() * tensor.element_size() for tensor in entry)
+
+    def _put(self, key: tuple, entry: Tuple[torch.Tensor, torch.Tensor]):
+        size = self._size(entry)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._size(self._entries.pop(key))
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= self._size(old)
+            self.evicted += 1
+
+    @torch.no_grad()
+    def encode(self, model, prompts: Sequence[str], clip_skip: Optional[int] = None, tokens: Optional[Sequence] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Batched (prompt_embeds, pooled_prompt_embeds) - only cache misses reach the encoders
+
+        tokens (one TokenizedPrompt or None per prompt) lets misses skip tokenization.
+        """
+        model_key = self.model_key(model)
+        found: dict = {}
+        with self._lock:
+            for prompt in prompts:
+                key = (model_key, prompt, clip_skip)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[prompt] = self._entries[key]
+                    self.hits += 1
+                elif prompt not in found:
+                    found[prompt] = None
+                    self.misses += 1
+
+        missing: List[str] = [prompt for prompt, entry in found.items() if entry is None]
+        token_of = dict(zip(prompts, tokens)) if tokens is not None else {}
+        store = self._stores.get(model.text_encoder_2)
+        if store is not None and missing:
+            missing = self._from_store(model, store, model_key, clip_skip, missing, token_of, found)
+        with_ids = [prompt for prompt in missing if token_of.get(prompt) is not None]
+        as_text = [prompt for prompt in missing if token_of.get(prompt) is None]
+        if with_ids:
+            prompt_embeds, pooled = encode_token_ids(model, [token_of[prompt] for prompt in with_ids], clip_skip)
+            self._store(model_key, clip_skip, with_ids, prompt_embeds, pooled, found)
+        if as_text:
+            prompt_embeds, _, pooled, _ = model.encode_prompt(
+                prompt=as_text,
+                device=model.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+                clip_skip=clip_skip,
+            )
+            self._store(model_key, clip_skip, as_text, prompt_embeds, pooled, found)
+
+        return (
+            torch.cat([found[prompt][0] for prompt in prompts]),
+            torch.cat([found[prompt][1] for prompt in prompts]),
+        )
+
+    def _from_store(self, model, store: EmbeddingStore, model_key: tuple, clip_skip: Optional[int], missing: List[str], token_of: dict, found: dict) -> List[str]:
+        """Fill found from the mmap'd store; returns the prompts it didn't have"""
+        still_missing = []
+        for prompt in missing:
+            tokens = token_of.get(prompt)
+            entry = store.get(token_key(tokens, clip_skip) if tokens is not None else text_key(prompt, clip_skip))
+            if entry is None:
+                still_missing.append(prompt)
+                continue
+            dtype = model.text_encoder_2.dtype
+            entry = (entry[0].to(device=model.device, dtype=dtype), entry[1].to(device=model.device, dtype=dtype))
+            with self._lock:
+                found[prompt] = entry
+                self._put((model_key, prompt, clip_skip), entry)
+        return still_missing
+
+    def _store(self, model_key: tuple, clip_skip: Optional[int], prompts: List[str], prompt_embeds: torch.Tensor, pooled: torch.Tensor, found: dict):
+        with self._lock:
+            for i, prompt in enumerate(prompts):
+                entry = (prompt_embeds[i:i + 1], pooled[i:i + 1])
+                found[prompt] = entry
+                self._put((model_key, prompt, clip_skip), entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "mb": round(self._bytes / 1024 / 1024, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evicted": self.evicted,
+        }
+
+
+# Shared by every render path; the API sets max_bytes from EMBED_CACHE_MB
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Embedding Store - precomputed text-encoder outputs in one read-only mmap file
+Every uvicorn worker / replica warms its own EmbeddingCache from scratch.
+This file holds fp16 prompt_embeds + pooled_prompt_embeds for the library
+prompts, built offline once per checkpoint; each process maps it read-only,
+so the OS page cache holds one copy for the whole host. A miss still falls
+back to live encoding.
+
+Entries are keyed by a hash of the encoder input ids (prompt_library) and
+clip_skip, not the prompt text: CLIP only sees the first 75 tokens, and in
+the PROMPTS library every character / occupation slot but a few sits past
+that, so most pose x occupation x attribute combinations share one entry.
+Text keys are used for prompts without ids (NEGATIVE_PROMPT).
+
+Layout: magic, header length, JSON header, then an open-addressing hash
+table (slots x [key0, key1, row + 1] uint64), the embeds
+(rows x seq x dim fp16) and the pooled embeds (rows x pooled_dim fp16).
+
+Build (GPU + checkpoint):  python embedding_store.py build [--out PATH]
+Self-check on CPU:         python embedding_store.py
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+MAGIC = b"SDXLEMB1"
+ALIGN = 4096
+
+
+def _digest(*parts: bytes) -> Tuple[int, int]:
+    digest = hashlib.blake2b(b"\0".join(parts), digest_size=16).digest()
+    return struct.unpack("<QQ", digest)
+
+
+def token_key(tokens, clip_skip: Optional[int]) -> Tuple[int, int]:
+    """Store key for pre-assembled input ids (prompt_library.TokenizedPrompt)"""
+    ids = b"".join(np.asarray(row, dtype=np.uint32).tobytes() for row in tokens.ids)
+    return _digest(b"ids", str(clip_skip).encode(), ids)
+
+
+def text_key(prompt: str, clip_skip: Optional[int]) -> Tuple[int, int]:
+    """Store key for a prompt encoded from text"""
+    return _digest(b"text", str(clip_skip).encode(), prompt.encode())
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class EmbeddingStore:
+    """Read-only view of a built store file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an embedding store")
+            (length,) = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(length))
+        h = self.header
+        self.model = h["model"]
+        self.rows = h["rows"]
+        self.seq_len, self.dim, self.pooled_dim = h["seq_len"], h["dim"], h["pooled_dim"]
+        self._table = np.memmap(path, dtype=np.uint64, mode="r", offset=h["table_offset"], shape=(h["slots"], 3))
+        self._embeds = np.memmap(path, dtype=np.float16, mode="r", offset=h["embeds_offset"], shape=(self.rows, self.seq_len, self.dim))
+        self._pooled = np.memmap(path, dtype=np.float16, mode="r", offset=h["pooled_offset"], shape=(self.rows, self.pooled_dim))
+        self._mask = h["slots"] - 1
+
+        # Metrics
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, path: str, model: Optional[str] = None) -> Optional["EmbeddingStore"]:
+        """Map path if it exists and was built from this checkpoint - None otherwise"""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            store = cls(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Embedding store {path} unreadable: {e}")
+            return None
+        if model is not None and store.model != model:
+            print(f"⚠️ Embedding store {path} was built for {store.model}, not {model} - ignoring it")
+            return None
+        return store
+
+    def _row(self, key: Tuple[int, int]) -> Optional[int]:
+        k0, k1 = key
+        slot = k0 & self._mask
+        while True:
+            entry0, entry1, row = (int(value) for value in self._table[slot])
+            if row == 0:
+                return None
+            if entry0 == k0 and entry1 == k1:
+                return row - 1
+            slot = (slot + 1) & self._mask
+
+    def get(self, key: Tuple[int, int]) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """(prompt_embeds [1, seq, dim], pooled [1, pooled_dim]) fp16 CPU tensors, or None"""
+        row = self._row(key)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Copy out of the (read-only) mapping - the pages stay shared in the page cache
+        return (
+            torch.from_numpy(np.array(self._embeds[row:row + 1])),
+            torch.from_numpy(np.array(self._pooled[row:row + 1])),
+        )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "rows": self.rows,
+            "mb": round(os.path.getsize(self.path) / 1024 / 1024, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+@torch.no_grad()
+def build_store(
+    path: str,
+    model,
+    model_id: str,
+    tokenized: Iterable = (),
+    texts: Iterable[Tuple[str, Optional[int]]] = (),
+    clip_skips: Sequence[Optional[int]] = (2, None),
+    batch_size: int = 16,
+) -> dict:
+    """Encode every unique (ids, clip_skip) and (text, clip_skip) and write the store file
+
+    tokenized are TokenizedPrompts, encoded once per clip_skip; texts are
+    (prompt, clip_skip) pairs. The file is written next to path and moved into
+    place, so running services keep their old mapping until they restart.
+    """
+    from embedding_cache import encode_token_ids
+
+    started = time.time()
+    sources, seen, total = [], set(), 0
+    for tokens in tokenized:
+        for clip_skip in clip_skips:
+            total += 1
+            key = token_key(tokens, clip_skip)
+            if key not in seen:
+                seen.add(key)
+                sources.append((key, clip_skip, tokens, None))
+    for prompt, clip_skip in texts:
+        total += 1
+        key = text_key(prompt, clip_skip)
+        if key not in seen:
+            seen.add(key)
+            sources.append((key, clip_skip, None, prompt))
+
+    rows = len(sources)
+    seq_len = model.tokenizer.model_max_length
+    dim = model.text_encoder.config.hidden_size + model.text_encoder_2.config.hidden_size
+    pooled_dim = model.text_encoder_2.config.projection_dim
+    slots = 1
+    while slots < max(2, rows * 2):
+        slots *= 2
+
+    header = {"model": model_id, "rows": rows, "slots": slots, "seq_len": seq_len, "dim": dim, "pooled_dim": pooled_dim, "built_at": time.time()}
+    # Offsets depend on the header length, which depends on the offsets - fix them at a generous header size
+    header_size = _aligned(len(MAGIC) + 8 + len(json.dumps(header)) + 256)
+    header["table_offset"] = header_size
+    header["embeds_offset"] = _aligned(header_size + slots * 3 * 8)
+    header["pooled_offset"] = _aligned(header["embeds_offset"] + rows * seq_len * dim * 2)
+    size = header["pooled_offset"] + rows * pooled_dim * 2
+    print(f"🧮 {total} prompt encodings -> {rows} unique, {size / 1024 ** 3:.2f} GB")
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        encoded = json.dumps(header).encode()
+        f.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        f.truncate(size)
+    table = np.memmap(tmp, dtype=np.uint64, mode="r+", offset=header["table_offset"], shape=(slots, 3))
+    embeds = np.memmap(tmp, dtype=np.float16, mode="r+", offset=header["embeds_offset"], shape=(rows, seq_len, dim))
+    pooled = np.memmap(tmp, dtype=np.float16, mode="r+", offset=header["pooled_offset"], shape=(rows, pooled_dim))
+
+    # Batches of one kind (ids or text) and one clip_skip
+    groups: dict = {}
+    for row, (key, clip_skip, tokens, prompt) in enumerate(sources):
+        groups.setdefault((clip_skip, tokens is None), []).append(row)
+    for (clip_skip, from_text), members in groups.items():
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            if from_text:
+                prompt_embeds, _, pooled_embeds, _ = model.encode_prompt(
+                    prompt=[sources[row][3] for row in batch],
+                    device=model.device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=False,
+                    clip_skip=clip_skip,
+                )
+            else:
+                prompt_embeds, pooled_embeds = encode_token_ids(model, [sources[row][2] for row in batch], clip_skip)
+            embeds[batch] = prompt_embeds.to("cpu", torch.float16).numpy()
+            pooled[batch] = pooled_embeds.to("cpu", torch.float16).numpy()
+
+    for row, (key, *_rest) in enumerate(sources):
+        slot = key[0] & (slots - 1)
+        while table[slot, 2]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = (key[0], key[1], row + 1)
+
+    for mapping in (table, embeds, pooled):
+        mapping.flush()
+    del table, embeds, pooled
+    os.replace(tmp, path)
+    return {"encodings": total, "rows": rows, "gb": round(size / 1024 ** 3, 2), "seconds": round(time.time() - started, 1)}
+
+
+# ============================================
+# BUILD COMMAND + SELF-CHECK
+# ============================================
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="command")
+    build = sub.add_parser("build", help="precompute the library prompts for MODEL_PATH (needs the GPU)")
+    build.add_argument("--out", default=None, help="store file (default: EMBED_STORE_PATH)")
+    build.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        import fastapicyber as fc
+        from result_cache import model_identity
+
+        out = args.out or fc.EMBED_STORE_PATH
+        if not out:
+            sys.exit("❌ No output path: pass --out or set EMBED_STORE_PATH")
+        model, _ = fc.load_models()
+        result = build_store(
+            out,
+            model,
+            model_identity(fc.MODEL_PATH),
+            tokenized=fc.store_prompts(),
+            # Base pass encodes with clip_skip=2, highres with the default; the negative always with the default
+            texts=[(fc.NEGATIVE_PROMPT, None)],
+            batch_size=args.batch_size,
+        )
+        print(f"✅ Embedding store written to {out}: {result}")
+        sys.exit(0)
+
+    import tempfile
+
+    from tiny_sdxl import build_tiny_sdxl
+    from embedding_cache import EmbeddingCache
+    from prompt_library import PromptLibrary
+    import fastapicyber as fc
+
+    pipe, pipe_img2img = build_tiny_sdxl()
+    fc.prompt_library = PromptLibrary((pipe.tokenizer, pipe.tokenizer_2), fc.prompt_templates.templates(), fc.prompt_fragments())
+    prompts = list(fc.store_prompts())
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "embeddings.bin")
+        result = build_store(path, pipe, "tiny", tokenized=prompts, texts=[(fc.NEGATIVE_PROMPT, None)])
+        print(f"🧪 {result}")
+        assert EmbeddingStore.open(path, "other checkpoint") is None
+        store = EmbeddingStore.open(path, "tiny")
+
+        # Store hits == live encoding, up to fp16 rounding (the tiny model runs in fp32)
+        cache = EmbeddingCache()
+        cache.attach_store(pipe, store)
+        live = EmbeddingCache()
+        sample = prompts[::max(1, len(prompts) // 50)]
+        for clip_skip in (2, None):
+            texts = [str(i) for i in range(len(sample))]
+            stored = cache.encode(pipe, texts, clip_skip, tokens=sample)
+            fresh = live.encode(pipe, texts, clip_skip, tokens=sample)
+            for a, b in zip(stored, fresh):
+                assert torch.allclose(a, b, atol=2e-3, rtol=1e-3), f"clip_skip={clip_skip}: stored embeddings differ"
+        negative = cache.encode(pipe_img2img, [fc.NEGATIVE_PROMPT], None)
+        expected = live.encode(pipe, [fc.NEGATIVE_PROMPT], None)
+        assert torch.allclose(negative[0], expected[0], atol=2e-3, rtol=1e-3)
+        assert cache.stats()["misses"] == 2 * len(sample) + 1 and store.hits == 2 * len(sample) + 1, (cache.stats(), store.stats())
+
+        # Unknown ids miss the store and are encoded live
+        character = fc.CharacterData(name="check", age=30, gender="female", description="blonde")
+        template, values = fc.resolve_prompt(character, "a prompt the store has never seen, " * 4, "None")
+        cache.encode(pipe, ["unseen"], 2, tokens=[fc.prompt_library.assemble(template, values)])
+        assert store.misses == 1
+        print(f"✅ Store hits match live encoding ({store.stats()})")
@@ -9,17 +9,45 @@ NSFW Image Generator API - Complete with ALL Prompts Included
 import os
 os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = '0'
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Literal, Dict, Tuple, Iterator
 import torch
 import base64
 from io import BytesIO
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline, DPMSolverMultistepScheduler
 from PIL import Image, ImageEnhance, ImageFilter
 import time
-import re
+import math
+import gc
+import uuid
+import json
+import asyncio
+from urllib.parse import urljoin
+
+from gpu_worker import GPUWorker, QueueFullError, AdmissionError, DeadlineError, JobCancelledError, DuplicateJobError
+from job_store import JobStore, JobRecord
+from coalesce import FlightTable, canonical_key
+from result_cache import ResultCache, model_identity
+from batch_render import render_batch, render_continuous, highres_size
+from denoise_engine import DenoiseEngine
+from stage_meter import stage_meter
+from embedding_cache import embedding_cache
+from embedding_store import EmbeddingStore
+from checkpoint_cache import CheckpointCache
+from model_loader import ModelLoader
+from model_registry import ModelRegistry, UnknownModelError
+from model_catalog import ModelCatalog
+from latent_cache import LatentCache
+from catalog import Catalog
+from storage import LocalStorage, S3Storage, Uploader
+from inventory import InventoryPool
+from prompt_templates import PromptTemplate, TemplateCache, slot_values
+from prompt_library import PromptLibrary, TokenizedPrompt
+from character_index import KeywordMatcher, build_occupation_index
+from cost_model import CostModel, preset_units
 
 # ============================================
 # FASTAPI APP
@@ -41,7 +69,108 @@ app.add_middleware(
 # ============================================
 # CONFIGURATION
 # ============================================
-MODEL_PATH = "/workspace/cyberrealistic_pony.safetensors"
+MODEL_PATH = os.environ.get("MODEL_PATH", "/workspace/cyberrealistic_pony.safetensors")
+
+# Every SDXL checkpoint in MODELS_DIR is servable under its file name (found from safetensors headers, GET /models);
+# the scan is cached in MODEL_CATALOG_CACHE so restarts only read new or changed files
+MODELS_DIR = os.environ.get("MODELS_DIR", "/workspace")
+MODEL_CATALOG_CACHE = os.environ.get("MODEL_CATALOG_CACHE", "/workspace/.model_catalog.json")
+
+# More checkpoints on the same GPU: "name=path,name=path"; requests pick one with "model".
+# MODEL_PATH is DEFAULT_MODEL. Pipelines move GPU -> pinned RAM -> disk, least recently used first,
+# within these budgets; components whose weights are identical (shared text encoders / VAE) are held once
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", "cyberrealistic_pony")
+
+def parse_models(spec: str) -> Dict[str, str]:
+    """"name=path,name=path" -> {name: path}; malformed entries are logged and skipped"""
+    models = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, _, path = entry.partition("=")
+        if not name.strip() or not path.strip():
+            print(f"⚠️ MODELS entry ignored (expected name=path): {entry.strip()!r}")
+            continue
+        models[name.strip()] = path.strip()
+    return models
+
+MODELS = {DEFAULT_MODEL: MODEL_PATH, **parse_models(os.environ.get("MODELS", ""))}
+MODEL_GPU_BUDGET_GB = float(os.environ.get("MODEL_GPU_BUDGET_GB", "12"))
+MODEL_RAM_BUDGET_GB = float(os.environ.get("MODEL_RAM_BUDGET_GB", "24"))
+# Per-component weight hashes (how identical components are found) kept across restarts ("" = rehash every start)
+MODEL_HASH_CACHE = os.environ.get("MODEL_HASH_CACHE", "/workspace/.model_hashes.json")
+
+# Max requests waiting for the GPU before /generate answers 429
+GPU_QUEUE_SIZE = int(os.environ.get("GPU_QUEUE_SIZE", "8"))
+
+# Disk cache of seeded results, shared by all uvicorn workers ("" = off)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "/workspace/result_cache")
+RESULT_CACHE_MAX_GB = float(os.environ.get("RESULT_CACHE_MAX_GB", "5"))
+
+# Checkpoints converted once to fp16 diffusers safetensors, keyed by their sha256 ("" = from_single_file every load)
+CHECKPOINT_CACHE_DIR = os.environ.get("CHECKPOINT_CACHE_DIR", "/workspace/checkpoint_cache")
+
+# Before /ready: short renders of each preset, with and without highres, so kernel selection, allocator growth
+# and VAE tiling setup are not paid by the first requests ("all", comma-separated preset names, "" = off)
+WARMUP_PRESETS = os.environ.get("WARMUP_PRESETS", "all")
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", "2"))
+
+# Text-encoder outputs kept on the GPU across requests (~0.3MB per prompt)
+EMBED_CACHE_MB = int(os.environ.get("EMBED_CACHE_MB", "512"))
+
+# Precomputed prompt embeddings (python embedding_store.py build), mapped read-only
+# by every worker on the host; missing file or another checkpoint = live encoding only
+EMBED_STORE_PATH = os.environ.get("EMBED_STORE_PATH", "/workspace/embedding_store.bin")
+
+# Base-pass latents kept in RAM for highres / enhance follow-ups (~0.1MB each, 0 = off)
+LATENT_CACHE_MB = int(os.environ.get("LATENT_CACHE_MB", "256"))
+
+# Where finished images go - responses carry their URL instead of base64 ("" = inline base64)
+# local: files under STORAGE_DIR served at /images (STORAGE_PUBLIC_URL = absolute base, else this API's host)
+# s3: S3_BUCKET on S3_ENDPOINT_URL (AWS when empty), public at S3_PUBLIC_URL; credentials from the usual AWS_* env
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+STORAGE_DIR = os.environ.get("STORAGE_DIR", "/workspace/images")
+STORAGE_PUBLIC_URL = os.environ.get("STORAGE_PUBLIC_URL", "/images")
+# local only: oldest images are deleted past STORAGE_MAX_GB, and any image after STORAGE_MAX_AGE_H (0 = no cap)
+STORAGE_MAX_GB = float(os.environ.get("STORAGE_MAX_GB", "20"))
+STORAGE_MAX_AGE_H = float(os.environ.get("STORAGE_MAX_AGE_H", "72"))
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "generated")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")
+S3_PUBLIC_URL = os.environ.get("S3_PUBLIC_URL", "")
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+
+# Pre-rendered variants of popular unseeded requests, rendered only while the GPU is idle (0 = off).
+# A combination is stocked once its decayed request count reaches INVENTORY_MIN_DEMAND (1.5 = two recent requests);
+# the image budget is split by demand, at most INVENTORY_PER_COMBO each
+INVENTORY_MAX_IMAGES = int(os.environ.get("INVENTORY_MAX_IMAGES", "0"))
+INVENTORY_PER_COMBO = int(os.environ.get("INVENTORY_PER_COMBO", "4"))
+INVENTORY_MIN_DEMAND = float(os.environ.get("INVENTORY_MIN_DEMAND", "1.5"))
+INVENTORY_HALF_LIFE_S = float(os.environ.get("INVENTORY_HALF_LIFE_S", "600"))
+INVENTORY_TTL_S = float(os.environ.get("INVENTORY_TTL_S", "3600"))
+INVENTORY_IDLE_S = float(os.environ.get("INVENTORY_IDLE_S", "2"))  # quiet time before refilling
+
+# Cost model prior (seconds per megapixel-step, calibrated online) and load shedding:
+# new work is refused once the queue is this many seconds behind (0 = never)
+COST_S_PER_MPX_STEP = float(os.environ.get("COST_S_PER_MPX_STEP", "0.2"))
+MAX_QUEUE_ETA_S = float(os.environ.get("MAX_QUEUE_ETA_S", "0"))
+
+# Step-level continuous batching: new requests join the running UNet batch between steps
+CONTINUOUS_BATCHING = os.environ.get("CONTINUOUS_BATCHING", "0") == "1"
+DENOISE_SLOTS = int(os.environ.get("DENOISE_SLOTS", "4"))
+
+# Threads for enhance + PNG encode, which overlap with the next render on the GPU
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", "2"))
+
+# Async job results (POST /jobs) are kept in memory this long / this big
+JOB_STORE_SIZE = int(os.environ.get("JOB_STORE_SIZE", "200"))
+JOB_STORE_MAX_MB = int(os.environ.get("JOB_STORE_MAX_MB", "512"))
+JOB_RESULT_TTL_S = float(os.environ.get("JOB_RESULT_TTL_S", "900"))
+
+# Latent previews on GET /jobs/{id}/events: every N steps (0 = off), longest side in px
+PREVIEW_EVERY = int(os.environ.get("PREVIEW_EVERY", "5"))
+PREVIEW_SIZE = int(os.environ.get("PREVIEW_SIZE", "256"))
+SSE_KEEPALIVE_S = 15
 
 QUALITY_PRESETS = {
     "standard": {
@@ -52,6 +181,8 @@ QUALITY_PRESETS = {
         "highres_scale": 1.5,
         "highres_steps": 25,
         "highres_denoise": 0.45,
+        "max_batch": 4,
+        "batch_window_ms": 150,
     },
     "hd": {
         "base_width": 896,
@@ -61,6 +192,8 @@ QUALITY_PRESETS = {
         "highres_scale": 1.5,
         "highres_steps": 30,
         "highres_denoise": 0.5,
+        "max_batch": 3,
+        "batch_window_ms": 150,
     },
     "ultra_hd": {
         "base_width": 1024,
@@ -70,6 +203,8 @@ QUALITY_PRESETS = {
         "highres_scale": 1.5,
         "highres_steps": 35,
         "highres_denoise": 0.5,
+        "max_batch": 2,
+        "batch_window_ms": 150,
     },
     "extreme": {
         "base_width": 1152,
@@ -79,6 +214,8 @@ QUALITY_PRESETS = {
         "highres_scale": 1.5,
         "highres_steps": 40,
         "highres_denoise": 0.55,
+        "max_batch": 1,
+        "batch_window_ms": 0,
     }
 }
 
@@ -138,25 +275,87 @@ OCCUPATION_SETTINGS = {
     "Professional Dog": {"background": "dog training facility, park", "props": "leash, toys, training", "lighting": "natural outdoor"},
 }
 
+# ID, name or lowercased name -> OCCUPATION_SETTINGS key (character_index.py)
+OCCUPATION_INDEX = build_occupation_index(OCCUPATION_SETTINGS, OCCUPATION_ID_MAP)
+
+# Description keywords for hair color, in priority order
+HAIR_COLORS = KeywordMatcher(['blonde', 'brunette', 'red', 'black', 'brown', 'white'])
+
 # ============================================
 # GLOBAL MODELS
 # ============================================
-pipe = None
-pipe_img2img = None
+prompt_library = None  # PromptLibrary over the loaded tokenizers, built by load_models()
+embedding_store = None  # EmbeddingStore at EMBED_STORE_PATH, if built for MODEL_PATH
+denoise_engine = None  # built on first use when CONTINUOUS_BATCHING=1
+model_load_times = {}  # checkpoint path -> seconds per component of its last load, in /metrics
+warmup_times = {}  # "preset[+highres]" -> first / steady-state seconds of the warm-up renders
+
+# Single owner of the GPU - every render goes through this queue
+gpu_worker = GPUWorker(
+    max_queue=GPU_QUEUE_SIZE,
+    cpu_workers=CPU_WORKERS,
+    cost_model=CostModel(s_per_unit=COST_S_PER_MPX_STEP),
+    max_eta_s=MAX_QUEUE_ETA_S or None
+)
 
-def load_models():
-    global pipe, pipe_img2img
-    
-    if pipe is not None:
-        return pipe, pipe_img2img
-    
-    print(f"\n🔥 Loading model: {MODEL_PATH}")
-    
-    pipe = StableDiffusionXLPipeline.from_single_file(
-        MODEL_PATH,
+# Job engine state - /generate and /jobs share it
+job_store = JobStore(max_jobs=JOB_STORE_SIZE, max_bytes=JOB_STORE_MAX_MB * 1024 * 1024, ttl_s=JOB_RESULT_TTL_S)
+
+# Identical in-flight requests share one GPU run
+flights = FlightTable()
+
+# Seeded generations are deterministic - serve repeats from disk
+result_cache = ResultCache(RESULT_CACHE_DIR, int(RESULT_CACHE_MAX_GB * 1024 ** 3)) if RESULT_CACHE_DIR else None
+
+# Finished PNGs are uploaded on their own pool; None = answer with base64 as before
+if STORAGE_BACKEND == "s3":
+    uploader = Uploader(S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_PUBLIC_URL), workers=UPLOAD_WORKERS)
+elif STORAGE_BACKEND == "local":
+    uploader = Uploader(
+        LocalStorage(STORAGE_DIR, STORAGE_PUBLIC_URL, max_bytes=int(STORAGE_MAX_GB * 1024 ** 3), max_age_s=STORAGE_MAX_AGE_H * 3600),
+        workers=UPLOAD_WORKERS,
+    )
+else:
+    uploader = None
+
+# Unseeded requests for hot combinations are answered from here; refill_inventory() keeps it stocked
+inventory = InventoryPool(
+    max_images=INVENTORY_MAX_IMAGES,
+    per_combo=INVENTORY_PER_COMBO,
+    min_demand=INVENTORY_MIN_DEMAND,
+    half_life_s=INVENTORY_HALF_LIFE_S,
+    ttl_s=INVENTORY_TTL_S,
+) if INVENTORY_MAX_IMAGES > 0 else None
+refill_task = None
+refill_job = None  # the GPUJob of the refill in progress - cancelled when real work arrives
+last_gpu_request = 0.0
+
+# Prompt embeddings for every render path (batch_render.encode_prompts)
+embedding_cache.max_bytes = EMBED_CACHE_MB * 1024 * 1024
+
+# Same seed + prompt + preset again with other highres / enhance flags - skip the base pass
+latent_cache = LatentCache(LATENT_CACHE_MB * 1024 * 1024) if LATENT_CACHE_MB > 0 else None
+
+def load_single_file(path: str):
+    return StableDiffusionXLPipeline.from_single_file(
+        path,
         torch_dtype=torch.float16,
         use_safetensors=True,
     )
+
+def load_pipelines(path: str):
+    """(pipe, pipe_img2img) for one checkpoint, on the CPU - the model registry moves them to the GPU"""
+    print(f"\n🔥 Loading model: {path}")
+    
+    if CHECKPOINT_CACHE_DIR:
+        pipe, times = CheckpointCache(CHECKPOINT_CACHE_DIR).load(path, load_single_file)
+    else:
+        start = time.perf_counter()
+        pipe = load_single_file(path)
+        times = {"source": "single_file", "total_s": round(time.perf_counter() - start, 2)}
+    model_load_times[path] = times
+    print(f"⏱️ Model weights from {times['source']} in {times['total_s']}s: "
+          + ", ".join(f"{name[:-2]} {seconds}s" for name, seconds in times.items() if name.endswith("_s") and name != "total_s"))
     
     pipe_img2img = StableDiffusionXLImg2ImgPipeline(
         vae=pipe.vae,
@@ -176,9 +375,6 @@ def load_models():
     )
     pipe_img2img.scheduler = pipe.scheduler
     
-    pipe = pipe.to("cuda")
-    pipe_img2img = pipe_img2img.to("cuda")
-    
     pipe.enable_vae_slicing()
     pipe.enable_vae_tiling()
     pipe_img2img.enable_vae_slicing()
@@ -190,9 +386,62 @@ def load_models():
     except:
         pass
     
+    if path == MODEL_PATH and embedding_store is not None and embedding_cache.attach_store(pipe, embedding_store):
+        print(f"🗂️ Embedding store mapped: {embedding_store.rows} prompts from {EMBED_STORE_PATH}")
+    return pipe, pipe_img2img
+
+# Checkpoints on disk, described from their headers; the loader's first stage scans MODELS_DIR
+# and registers the SDXL ones under their names, so importing the app reads no checkpoints
+model_catalog = ModelCatalog(MODELS_DIR, MODEL_CATALOG_CACHE, extra=list(MODELS.values()))
+
+# Checkpoints by name; load_pipelines() fills a tier on demand
+model_registry = ModelRegistry(
+    MODELS,
+    load_pipelines,
+    default=DEFAULT_MODEL,
+    gpu_budget=int(MODEL_GPU_BUDGET_GB * 1024 ** 3),
+    ram_budget=int(MODEL_RAM_BUDGET_GB * 1024 ** 3),
+    hash_path=MODEL_HASH_CACHE or None,
+)
+
+def load_models(model: Optional[str] = None):
+    """(pipe, pipe_img2img) of model (default: DEFAULT_MODEL) on the GPU
+
+    Waits for the background load started at startup (starts it if needed). GPU thread only.
+    """
+    model_loader.wait()
+    return model_registry.acquire(model)
+
+def _load_models(step):
+    """Warm-up - runs once, on the model loader's thread"""
+    global catalog, prompt_library, embedding_store
+    
+    step("models")
+    model_catalog.scan()
+    register_found_models()
+    
+    # Opened first so load_pipelines() attaches it to the default model (again after every reload)
+    step("embedding_store")
+    embedding_store = EmbeddingStore.open(EMBED_STORE_PATH, model_identity(MODEL_PATH))
+    
+    step("weights")
+    pipe, pipe_img2img = model_registry.acquire(DEFAULT_MODEL)
+    
+    # Every SDXL checkpoint uses the same two CLIP tokenizers - one library serves all models
+    step("prompts")
+    prompt_library = PromptLibrary((pipe.tokenizer, pipe.tokenizer_2), prompt_templates.templates(), prompt_fragments())
+    catalog = build_catalog(prompt_library)
+    print(f"🔤 Prompt library: {prompt_library.stats()['templates']} templates, {prompt_library.stats()['fragments']} fragments pre-tokenized")
+    
+    step("warmup")
+    warm_up(pipe, pipe_img2img)
+    
     print("✅ Model loaded!\n")
     return pipe, pipe_img2img
 
+# Loaded in the background once the server is up; /ready follows its progress
+model_loader = ModelLoader(_load_models, stages=("models", "embedding_store", "weights", "prompts", "warmup"))
+
 # ============================================
 # PYDANTIC MODELS
 # ============================================
@@ -227,11 +476,22 @@ class CharacterData(BaseModel):
 
 class GenerateRequest(BaseModel):
     character: CharacterData
+    # Checkpoint to render with (one of MODELS, default DEFAULT_MODEL)
+    model: Optional[str] = None
     pose_name: Optional[str] = None
     quality: Optional[str] = "ultra_hd"
     seed: Optional[int] = None
     use_highres: Optional[bool] = True
     enhance: Optional[bool] = True
+    # Scheduling: interactive (character creation) is served before bulk (scripts, galleries)
+    priority: Optional[Literal["interactive", "bulk"]] = "interactive"
+    # Seconds the caller is willing to wait; queued work past this is dropped before the GPU
+    deadline_s: Optional[float] = Field(default=None, gt=0)
+    # Optional caller-chosen id so the render can be aborted with DELETE /jobs/{job_id}
+    job_id: Optional[str] = Field(default=None, max_length=64)
+    # Progress stream previews (GET /jobs/{job_id}/events); defaults from PREVIEW_EVERY / PREVIEW_SIZE
+    preview_every: Optional[int] = Field(default=None, ge=0)
+    preview_size: Optional[int] = Field(default=None, ge=64, le=512)
 
 class GenerateResponse(BaseModel):
     success: bool
@@ -243,6 +503,13 @@ class GenerateResponse(BaseModel):
     resolution: str
     generation_time: str
     seed: int
+    model: Optional[str] = None
+    base_reused: bool = False  # base pass served from the latent cache
+    # Stored image (STORAGE_BACKEND) - image_base64 is only filled when there is no URL
+    image_url: Optional[str] = None
+    upload_path: Optional[str] = None
+    file_size_kb: Optional[int] = None
+    format: str = "png"
 
 # ============================================
 # ALL 150+ PROMPTS (COMPLETE)
@@ -1302,6 +1569,41 @@ PROMPTS = {
         photorealistic, 8K UHD, hyperrealistic, bath realistic, bubbles detailed, wet skin, peaceful lighting, serene, cozy, masterpiece""",
 }
 
+# Every PROMPTS entry pre-parsed into slots at import (prompt_templates.py)
+prompt_templates = TemplateCache(PROMPTS)
+
+# ============================================
+# POSE CATEGORIES (poses not listed are "misc")
+# ============================================
+POSE_CATEGORIES = {
+    "intercourse": [
+        "doggy_style", "missionary", "cowgirl", "reverse_cowgirl", "mating_press", "standing_doggy", "spooning_sex",
+        "pronebone", "full_nelson", "anal", "standing_splits", "against_wall", "seated_straddle", "plowcam",
+    ],
+    "oral": [
+        "blowjob", "deepthroat", "face_fuck", "titfuck", "cunnilingus", "face_sitting", "69_position", "licking_dick",
+        "footjob", "nursing_handjob", "pov_eating_out", "glory_hole", "double_blowjob",
+    ],
+    "solo": [
+        "fingering_solo", "dildo_solo", "pillow_humping", "squirting", "spread_pussy", "vibrator", "stuck", "shower_masturbation",
+    ],
+    "body_focus": ["boobs_close", "pussy_close", "ass_close", "feet_close", "all_fours_rear", "spread_ass", "legs_back"],
+    "aftermath": [
+        "creampie", "cumshot_face", "bukkake", "cum_on_body", "ahegao_breeding", "cumshot_doggystyle", "morning_after", "titfuck_cumshot",
+    ],
+    "bdsm": ["handcuffs", "collar_leash", "blindfolded", "spreader_bar", "suspended", "butt_plug", "gagged"],
+    "group": ["gangbang", "double_penetration", "mfm_threesome", "lesbian_sex", "scissoring", "lesbian_oral"],
+    "misc": ["standing", "spread_legs_sitting", "bent_over_solo", "jack_o_pose", "yoga_pose", "showering_solo", "bath"],
+}
+
+def build_catalog(library: Optional[PromptLibrary] = None) -> Catalog:
+    """Pose / occupation catalog - token counts and truncation points once the tokenizers are loaded"""
+    token_info = {name: library.prompt_info(prompt) for name, prompt in PROMPTS.items()} if library is not None else None
+    return Catalog(PROMPTS, POSE_CATEGORIES, OCCUPATION_SETTINGS, QUALITY_PRESETS, preset_units, token_info=token_info)
+
+# Served pre-encoded by /catalog, /poses and /occupations; rebuilt by load_models() with token counts
+catalog = build_catalog()
+
 # ============================================
 # NEGATIVE PROMPT
 # ============================================
@@ -1320,83 +1622,56 @@ child, minor, underage, young"""
 # ============================================
 # CHARACTER PARSER
 # ============================================
+HAIR_STYLES_WITH_IN = {"ponytail", "bun", "braided"}
+BREAST_MAP = {
+    "small": "small perky breasts",
+    "medium": "medium natural breasts",
+    "large": "large perky natural breasts",
+    "extra-large": "extremely large natural breasts"
+}
+BUTT_MAP = {
+    "small": "small firm butt",
+    "medium": "round bubble butt",
+    "large": "large round ass",
+    "extra-large": "huge bubble butt"
+}
+SKIN_MAP = {
+    "white": "smooth fair skin",
+    "black": "smooth dark skin",
+    "asian": "smooth fair skin",
+    "latina": "smooth tan skin",
+    "arab": "smooth tan skin"
+}
+
 def parse_character_features(character: CharacterData) -> dict:
-    # Extract hair color
-    hair_colors = ['blonde', 'brunette', 'red', 'black', 'brown', 'white']
-    hair_color = None
-    for color in hair_colors:
-        if color in character.description.lower():
-            hair_color = color
-            break
-    
-    # Get hair style
-    hair_style = None
-    if character.hairStyle:
-        hair_style = character.hairStyle.lower()
-    elif character.physicalAttributesId and character.physicalAttributesId.hairStyle:
-        hair_style = character.physicalAttributesId.hairStyle.lower()
-    
-    # Build hair
-    if hair_style and hair_style in ["ponytail", "bun", "braided"]:
+    """Resolve the prompt features in one pass - no per-request lookup tables or logging"""
+    attributes = character.physicalAttributesId
+    
+    # Hair color: the first of HAIR_COLORS (in priority order) found in the description
+    hair_color = HAIR_COLORS.first(character.description.lower())
+    
+    # Top-level fields win over physicalAttributesId
+    hair_style = character.hairStyle or (attributes.hairStyle if attributes else None)
+    hair_style = hair_style.lower() if hair_style else None
+    if hair_style in HAIR_STYLES_WITH_IN:
         hair = f"{hair_color or 'long'} hair in {hair_style}"
     else:
         hair = f"{hair_color or 'long'} {hair_style or ''} hair".strip()
     
-    # Eyes
-    eye_color = (character.eyeColor or 
-                (character.physicalAttributesId.eyeColor if character.physicalAttributesId else None) or 
-                "blue")
-    eyes = f"{eye_color.lower()} eyes"
-    
-    # Body
-    body = "athletic toned"
-    
-    # Breasts
-    breast_size = (character.breastSize or 
-                  (character.physicalAttributesId.breastSize if character.physicalAttributesId else None) or 
-                  "Large")
-    breast_map = {
-        "small": "small perky breasts",
-        "medium": "medium natural breasts",
-        "large": "large perky natural breasts",
-        "extra-large": "extremely large natural breasts"
-    }
-    breasts = breast_map.get(breast_size.lower(), "large perky natural breasts")
-    
-    # Butt
-    butt_size = (character.buttSize or 
-                (character.physicalAttributesId.buttSize if character.physicalAttributesId else None) or 
-                "Medium")
-    butt_map = {
-        "small": "small firm butt",
-        "medium": "round bubble butt",
-        "large": "large round ass",
-        "extra-large": "huge bubble butt"
-    }
-    butt = butt_map.get(butt_size.lower(), "round bubble butt")
-    
-    # Skin
-    ethnicity = (character.ethnicity or 
-                (character.physicalAttributesId.ethnicity if character.physicalAttributesId else None) or 
-                "white")
-    skin_map = {
-        "white": "smooth fair skin",
-        "black": "smooth dark skin",
-        "asian": "smooth fair skin",
-        "latina": "smooth tan skin",
-        "arab": "smooth tan skin"
-    }
-    skin = skin_map.get(ethnicity.lower(), "smooth tan skin")
+    eye_color = character.eyeColor or (attributes.eyeColor if attributes else None) or "blue"
+    breast_size = character.breastSize or (attributes.breastSize if attributes else None) or "Large"
+    butt_size = character.buttSize or (attributes.buttSize if attributes else None) or "Medium"
+    ethnicity = character.ethnicity or (attributes.ethnicity if attributes else None) or "white"
     
     return {
         "name": character.name,
         "age": character.age,
         "hair": hair,
-        "eyes": eyes,
-        "body": body,
-        "breasts": breasts,
-        "butt": butt,
-        "skin": skin
+        "eyes": f"{eye_color.lower()} eyes",
+        "body": "athletic toned",
+        "breasts": BREAST_MAP.get(breast_size.lower(), "large perky natural breasts"),
+        "butt": BUTT_MAP.get(butt_size.lower(), "round bubble butt"),
+        "skin": SKIN_MAP.get(ethnicity.lower(), "smooth tan skin")
     }
 
 def get_pose_name(character: CharacterData, override_pose: Optional[str]) -> str:
@@ -1426,112 +1701,55 @@ def get_pose_name(character: CharacterData, override_pose: Optional[str]) -> str
     return pose_name
 
 def get_occupation_name(character: CharacterData) -> str:
-    """Get occupation name from personalityId.occupationId"""
-    
-    print(f"\n🔍 DEBUG get_occupation_name:")
-    print(f"   character.personalityId: {character.personalityId}")
-    
-    if character.personalityId:
-        print(f"   character.personalityId.occupationId: {character.personalityId.occupationId}")
+    """Get occupation name from personalityId.occupationId - an ID, or a name in any case"""
     
     if character.personalityId and character.personalityId.occupationId:
         occ_value = character.personalityId.occupationId
-        
-        print(f"   occ_value: '{occ_value}'")
-        print(f"   occ_value type: {type(occ_value)}")
-        
-        # Check if it's an ID in the map
-        if occ_value in OCCUPATION_ID_MAP:
-            print(f"   ✅ Found in OCCUPATION_ID_MAP: {OCCUPATION_ID_MAP[occ_value]}")
-            return OCCUPATION_ID_MAP[occ_value]
-        
-        # Otherwise, treat it as the occupation name directly
-        # Check if it exists in OCCUPATION_SETTINGS
-        if occ_value in OCCUPATION_SETTINGS:
-            print(f"   ✅ Found in OCCUPATION_SETTINGS: {occ_value}")
-            return occ_value
-        
-        # If not found, try to find a case-insensitive match
-        for occ_name in OCCUPATION_SETTINGS.keys():
-            if occ_name.lower() == occ_value.lower():
-                print(f"   ✅ Found case-insensitive match: {occ_name}")
-                return occ_name
-        
-        print(f"   ❌ Not found in any mapping, returning 'None'")
-    else:
-        print(f"   ❌ No personalityId or occupationId, returning 'None'")
+        return OCCUPATION_INDEX.get(occ_value) or OCCUPATION_INDEX.get(occ_value.lower(), "None")
     
     return "None"
 
-def build_custom_prompt(character: CharacterData, pose_name: str, base_prompt: str, occupation: str) -> str:
-    """Build custom prompt"""
-    
+def resolve_prompt(character: CharacterData, base_prompt: str, occupation: str) -> Tuple[PromptTemplate, Dict[str, str]]:
+    """Pre-parsed template + slot values - render() gives the text, prompt_library.assemble() the token ids"""
     features = parse_character_features(character)
     occ_setting = OCCUPATION_SETTINGS.get(occupation, OCCUPATION_SETTINGS["None"])
+    return prompt_templates.get(base_prompt), slot_values(features, occ_setting)
+
+def build_custom_prompt(character: CharacterData, pose_name: str, base_prompt: str, occupation: str) -> str:
+    """Build custom prompt"""
     
-    print(f"\n🔍 DEBUG build_custom_prompt:")
-    print(f"   Character features: {features}")
-    print(f"   Occupation: {occupation}")
-    print(f"   Occupation settings: {occ_setting}")
-    
-    custom_prompt = base_prompt
-    
-    # Replace age (e.g., "24 years old" -> "21 years old")
-    custom_prompt = re.sub(r'\b\d{2}\s+years old\b', f"{features['age']} years old", custom_prompt)
-    
-    # Replace hair (more comprehensive patterns)
-    # Match patterns like "long blonde hair in high ponytail", "blonde hair", etc.
-    hair_patterns = [
-        r'long blonde hair in high ponytail whipping around, hair flowing with motion',
-        r'long blonde hair in high ponytail swaying with motion',
-        r'long blonde hair in ponytail cascading down back swaying with motion',
-        r'long blonde hair in high ponytail',
-        r'long flowing blonde hair fanned out on pillow',
-        r'long blonde hair spread out',
-        r'blonde hair in ponytail or loose flowing',
-        r'long [\w\s]+ hair',
-        r'blonde hair',
-    ]
-    for pattern in hair_patterns:
-        custom_prompt = re.sub(pattern, features['hair'], custom_prompt, flags=re.IGNORECASE)
-    
-    # Replace eyes
-    custom_prompt = re.sub(r'(?:piercing |bright |gorgeous )?(?:blue|brown|green|hazel|amber) eyes', features['eyes'], custom_prompt, flags=re.IGNORECASE)
-    
-    # Replace breasts
-    custom_prompt = re.sub(r'(?:small|medium|large|extremely large)(?: perky)?(?: natural)? breasts', features['breasts'], custom_prompt, flags=re.IGNORECASE)
-    
-    # Replace butt
-    custom_prompt = re.sub(r'(?:small firm|round|round firm|round bubble|large round|huge bubble) butt', features['butt'], custom_prompt, flags=re.IGNORECASE)
-    custom_prompt = re.sub(r'(?:round|large round) ass', features['butt'].replace('butt', 'ass'), custom_prompt, flags=re.IGNORECASE)
-    
-    # Replace skin (more comprehensive)
-    skin_patterns = [
-        r'flawless smooth tan skin',
-        r'smooth tan skin',
-        r'smooth fair skin',
-        r'smooth dark skin',
-        r'(?:smooth |realistic |flawless )?(?:tan|fair|dark) skin',
-    ]
-    for pattern in skin_patterns:
-        custom_prompt = re.sub(pattern, features['skin'], custom_prompt, flags=re.IGNORECASE)
-    
-    # Replace setting with occupation
-    custom_prompt = re.sub(r'luxury master bedroom setting.*?full body shot composition', 
-                          f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}, full body shot composition",
-                          custom_prompt, flags=re.IGNORECASE)
-    
-    # Also handle other bedroom variations
-    custom_prompt = re.sub(r'bedroom setting, rumpled sheets, warm lighting', 
-                          f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}",
-                          custom_prompt, flags=re.IGNORECASE)
-    custom_prompt = re.sub(r'luxury bedroom, silk sheets underneath, soft romantic lighting, golden glow, intimate atmosphere', 
-                          f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}, intimate atmosphere",
-                          custom_prompt, flags=re.IGNORECASE)
-    
-    print(f"   ✅ Prompt customization complete\n")
-    
-    return custom_prompt
+    # One pass over the pre-parsed template instead of the old re.sub cascade
+    template, values = resolve_prompt(character, base_prompt, occupation)
+    
+    return template.render(values)
+
+def prompt_fragments() -> List[str]:
+    """Slot values known up front - pre-tokenized by the prompt library at model load"""
+    settings = [f"{s['background']}, {s['props']}, {s['lighting']}" for s in OCCUPATION_SETTINGS.values()]
+    colors = [*HAIR_COLORS.keywords, "long"]
+    styles = [*HAIR_STYLES_WITH_IN, "straight", "curly", "wavy", "short", "long", "long wavy"]
+    hair = [f"{color} hair" for color in colors]
+    hair += [f"{color} hair in {style}" if style in HAIR_STYLES_WITH_IN else f"{color} {style} hair" for color in colors for style in styles]
+    eyes = [f"{color} eyes" for color in ("blue", "brown", "green", "hazel", "amber", "grey", "gray")]
+    bodies = [*BREAST_MAP.values(), *BUTT_MAP.values(), *(butt.replace('butt', 'ass') for butt in BUTT_MAP.values()), *SKIN_MAP.values()]
+    ages = [f"{age} years old" for age in range(18, 100)]
+    return list(dict.fromkeys(settings + hair + eyes + bodies + ages))
+
+# Characters the embedding store is built for, per pose x occupation - other attributes at their defaults
+STORE_CHARACTERS = [
+    CharacterData(name="store", age=age, gender="female", description=description, ethnicity=ethnicity)
+    for age in [*range(18, 31), 35, 40, 45, 50]
+    for description in ("", "blonde", "brunette", "red hair", "black hair", "brown hair", "white hair")
+    for ethnicity in ("white", "black", "latina")
+]
+
+def store_prompts() -> Iterator[TokenizedPrompt]:
+    """Input ids of every PROMPTS entry x occupation x STORE_CHARACTERS (needs the prompt library)"""
+    for base_prompt in PROMPTS.values():
+        for occupation in OCCUPATION_SETTINGS:
+            for character in STORE_CHARACTERS:
+                template, values = resolve_prompt(character, base_prompt, occupation)
+                yield prompt_library.assemble(template, values)
 
 # ============================================
 # POST-PROCESSING
@@ -1546,11 +1764,17 @@ def enhance_image(image: Image.Image) -> Image.Image:
     image = enhancer.enhance(1.1)
     return image
 
+def free_gpu_memory():
+    """Release cached CUDA blocks left by an aborted render"""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
 # ============================================
 # GENERATION FUNCTION
 # ============================================
-def generate_image(character: CharacterData, pose_name: str, quality: str, seed: Optional[int], use_highres: bool, enhance: bool):
-    """Generate image"""
+def prepare_generation(character: CharacterData, pose_name: str, quality: str, seed: Optional[int], use_highres: bool, enhance: bool) -> dict:
+    """Resolve prompt, occupation and seed - everything except the GPU work"""
     
     # Use fallback prompt if pose not in PROMPTS dictionary
     if pose_name not in PROMPTS:
@@ -1563,67 +1787,205 @@ def generate_image(character: CharacterData, pose_name: str, quality: str, seed:
     else:
         base_prompt = PROMPTS[pose_name]
     occupation = get_occupation_name(character)
-    final_prompt = build_custom_prompt(character, pose_name, base_prompt, occupation)
-    
-    preset = QUALITY_PRESETS[quality]
+    template, values = resolve_prompt(character, base_prompt, occupation)
+    final_prompt = template.render(values)
+    # Input ids from pre-tokenized pieces, cut at CLIP's 77 tokens (None until the model is loaded)
+    tokens = prompt_library.assemble(template, values) if prompt_library is not None else None
     
     if seed is None:
         seed = torch.randint(0, 2**32, (1,)).item()
     
-    generator = torch.Generator(device="cuda").manual_seed(seed)
+    return {
+        "name": character.name,
+        "pose_name": pose_name,
+        "occupation": occupation,
+        "prompt": final_prompt,
+        "tokens": tokens,
+        "quality": quality,
+        "seed": seed,
+        "use_highres": use_highres,
+        "enhance": enhance,
+    }
+
+def generate_batch(specs: List[dict], controls: Optional[list] = None):
+    """GPU stages for specs that share a quality preset: one batched base + highres call
+
+    Returns raw images - enhance and encoding are CPU stages (postprocess_image / encode_result).
+    """
+    
+    preset = QUALITY_PRESETS[specs[0]["quality"]]
     
     print(f"\n{'='*70}")
-    print(f"🎨 {character.name} - {pose_name}")
-    print(f"   Occupation: {occupation}")
+    for spec in specs:
+        print(f"🎨 {spec['name']} - {spec['pose_name']}")
+        print(f"   Occupation: {spec['occupation']}")
+    print(f"   Batch size: {len(specs)}")
     print(f"{'='*70}")
     
     start = time.time()
-    model, model_img2img = load_models()
-    
-    # Base generation
-    print("\n📸 Base...")
-    image = model(
-        prompt=final_prompt,
-        negative_prompt=NEGATIVE_PROMPT,
-        width=preset['base_width'],
-        height=preset['base_height'],
-        num_inference_steps=preset['steps'],
-        guidance_scale=preset['cfg'],
-        generator=generator,
-        clip_skip=2,
-    ).images[0]
-    
-    # Highres
-    if use_highres:
-        print("🔍 Highres...")
-        final_w = int(preset['base_width'] * preset['highres_scale'])
-        final_h = int(preset['base_height'] * preset['highres_scale'])
-        
-        upscaled = image.resize((final_w, final_h), Image.LANCZOS)
-        generator = torch.Generator(device="cuda").manual_seed(seed + 1)
-        
-        image = model_img2img(
-            prompt=final_prompt,
-            negative_prompt=NEGATIVE_PROMPT,
-            image=upscaled,
-            strength=preset['highres_denoise'],
-            num_inference_steps=preset['highres_steps'],
-            guidance_scale=preset['cfg'],
-            generator=generator,
-        ).images[0]
-    else:
-        final_w, final_h = preset['base_width'], preset['base_height']
+    model, model_img2img = load_models(specs[0].get("model"))
     
-    # Enhance
-    if enhance:
+    print("\n📸 Base + 🔍 Highres...")
+    cancelled = None
+    reused = []
+    try:
+        images = render_batch(
+            model,
+            model_img2img,
+            prompts=[spec["prompt"] for spec in specs],
+            tokens=[spec["tokens"] for spec in specs],
+            negative_prompt=NEGATIVE_PROMPT,
+            preset=preset,
+            seeds=[spec["seed"] for spec in specs],
+            use_highres=[spec["use_highres"] for spec in specs],
+            controls=controls,
+            latent_cache=latent_cache,
+            reused=reused,
+        )
+    except JobCancelledError as e:
+        # Drop the traceback so its frames stop pinning latents, then free VRAM
+        cancelled = e.with_traceback(None)
+    
+    if cancelled is not None:
+        free_gpu_memory()
+        print(f"🛑 Cancelled after {time.time() - start:.1f}s, ~{cancelled.recovered_s:.1f}s of GPU time saved")
+        raise cancelled
+    
+    if any(reused):
+        print(f"♻️ Base pass reused for {sum(reused)} of {len(specs)} image(s)")
+    
+    results = []
+    for spec, image, base_reused in zip(specs, images, reused):
+        if spec["use_highres"]:
+            final_w, final_h = highres_size(preset)
+        else:
+            final_w, final_h = preset['base_width'], preset['base_height']
+        results.append((image, spec["seed"], time.time() - start, final_w, final_h, spec["occupation"], base_reused))
+    
+    print(f"\n✅ GPU done: {len(specs)} image(s) in {time.time() - start:.1f}s\n")
+    
+    return results
+
+def warm_up(model, model_img2img):
+    """WARMUP_STEPS-step renders of each WARMUP_PRESETS preset, base and highres, twice each
+
+    The first run carries the one-time costs at that resolution, the second is steady state;
+    both land in warmup_times. Kernels are chosen per shape, so other checkpoints of the
+    same architecture benefit too.
+    """
+    if not WARMUP_PRESETS:
+        return
+    names = list(QUALITY_PRESETS) if WARMUP_PRESETS == "all" else [name.strip() for name in WARMUP_PRESETS.split(",") if name.strip()]
+    for name in names:
+        if name not in QUALITY_PRESETS:
+            print(f"⚠️ Warm-up: unknown preset '{name}'")
+            continue
+        preset = QUALITY_PRESETS[name]
+        short = dict(preset, steps=WARMUP_STEPS, highres_steps=math.ceil(WARMUP_STEPS / preset['highres_denoise']))
+        for use_highres in (False, True):
+            label = f"{name}+highres" if use_highres else name
+            runs = []
+            try:
+                for _ in range(2):
+                    start = time.perf_counter()
+                    render_batch(model, model_img2img, prompts=[PROMPTS["standing"]], negative_prompt=NEGATIVE_PROMPT,
+                                 preset=short, seeds=[0], use_highres=[use_highres])
+                    runs.append(time.perf_counter() - start)
+            except Exception as e:
+                print(f"⚠️ Warm-up {label} failed: {e}")
+                free_gpu_memory()
+                warmup_times[label] = {"error": str(e)}
+                continue
+            warmup_times[label] = {"first_s": round(runs[0], 3), "steady_s": round(runs[1], 3), "one_time_s": round(runs[0] - runs[1], 3)}
+            print(f"🔥 Warm-up {label}: first {runs[0]:.2f}s, steady {runs[1]:.2f}s")
+    # Serving stats start now
+    stage_meter.reset()
+
+def postprocess_image(spec: dict, image: Image.Image) -> Image.Image:
+    """Post-process stage (CPU)"""
+    if not spec["enhance"]:
+        return image
+    with stage_meter.track("postprocess"):
         print("🎨 Enhance...")
-        image = enhance_image(image)
-    
-    gen_time = time.time() - start
+        return enhance_image(image)
+
+def generate_image(character: CharacterData, pose_name: str, quality: str, seed: Optional[int], use_highres: bool, enhance: bool):
+    """Generate image"""
+    with stage_meter.track("prompt"):
+        spec = prepare_generation(character, pose_name, quality, seed, use_highres, enhance)
+    image, seed, gen_time, width, height, occupation, _ = generate_batch([spec])[0]
+    return postprocess_image(spec, image), seed, gen_time, width, height, occupation
+
+def render_jobs(jobs: list):
+    """GPU stages for a micro-batch of jobs - runs on the GPU worker thread"""
+    return generate_batch([job.payload for job in jobs], controls=jobs)
+
+def render_jobs_continuous(jobs: list):
+    """GPU stages on the denoise engine - runs on the GPU worker thread
+
+    Queued jobs on the same preset join between denoising steps, and each job
+    moves on to the CPU stage as soon as its own image is decoded.
+    """
+    global denoise_engine
+    model, model_img2img = load_models(jobs[0].payload.get("model"))
+    if denoise_engine is None or denoise_engine.unet is not model.unet:
+        denoise_engine = DenoiseEngine(model.unet, model.scheduler, slots=DENOISE_SLOTS)
+    preset = QUALITY_PRESETS[jobs[0].payload["quality"]]
+    cancelled = []
+    
+    def complete(job, image=None, error=None, reused=False):
+        if error is not None:
+            if isinstance(error, JobCancelledError):
+                cancelled.append(error.recovered_s)
+            return gpu_worker.complete(job, error=error)
+        spec = job.payload
+        if spec["use_highres"]:
+            width, height = highres_size(preset)
+        else:
+            width, height = preset['base_width'], preset['base_height']
+        gpu_worker.complete(job, (image, spec["seed"], time.time() - job.started_at, width, height, spec["occupation"], reused))
     
-    print(f"\n✅ Done: {final_w}x{final_h} in {gen_time:.1f}s\n")
+    try:
+        render_continuous(
+            denoise_engine,
+            model,
+            model_img2img,
+            NEGATIVE_PROMPT,
+            preset,
+            jobs,
+            admit=lambda limit: gpu_worker.admit(jobs, limit),
+            complete=complete,
+            latent_cache=latent_cache,
+        )
+    except Exception:
+        # The worker fails every unfinished job; samples still queued or mid-denoise in the
+        # engine belong to those jobs and must not complete them later - start from a fresh engine
+        denoise_engine = None
+        raise
+    if cancelled:
+        # Like an aborted micro-batch: hand back the blocks the cancelled samples held
+        free_gpu_memory()
+        print(f"🛑 {len(cancelled)} cancelled, ~{sum(cancelled):.1f}s of GPU time saved")
+    return [None] * len(jobs)  # every job was handed over through gpu_worker.complete()
+
+def encode_result(job, result):
+    """CPU stages for one job: enhance + PNG (+ base64 for /generate) - runs on the CPU pool
+
+    The GPU thread is already rendering the next batch while this runs.
+    """
+    image, seed, _, width, height, occupation, base_reused = result
+    spec = job.payload
+    job.emit({"type": "stage", "stage": "postprocess"})
+    image = postprocess_image(spec, image)
+    
+    job.emit({"type": "stage", "stage": "encode"})
+    with stage_meter.track("encode"):
+        buffered = BytesIO()
+        image.save(buffered, format="PNG", quality=98)
+        png = buffered.getvalue()
+        image_base64 = base64.b64encode(png).decode() if spec.get("inline") else None
     
-    return image, seed, gen_time, final_w, final_h, occupation
+    return png, image_base64, seed, time.time() - job.started_at, width, height, occupation, base_reused
 
 # ============================================
 # API ENDPOINTS
@@ -1637,20 +1999,88 @@ async def root():
         "total_occupations": len(OCCUPATION_SETTINGS)
     }
 
+def catalog_response(request: Request, payload) -> Response:
+    """Pre-encoded catalog bytes: 304 if the client has this version, gzip if it accepts it"""
+    gzip_ok = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "ETag": payload.etag_gzip if gzip_ok else payload.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Catalog-Version": catalog.version,
+    }
+    if payload.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=payload.gzipped, media_type="application/json", headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
+
+@app.get("/catalog")
+async def get_catalog(request: Request):
+    """Everything at once: categories, presets with work units, poses with metadata, occupations"""
+    return catalog_response(request, catalog.full)
+
 @app.get("/poses")
-async def get_poses():
-    return {"total": len(PROMPTS), "poses": list(PROMPTS.keys())}
+async def get_poses(request: Request, category: Optional[str] = None, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1, le=500)):
+    """Pose names (+ per-pose metadata in items), optionally one category and one page"""
+    try:
+        payload = catalog.page(category, offset, limit)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown category '{category}' (one of: {', '.join(catalog.by_category)})")
+    return catalog_response(request, payload)
 
 @app.get("/occupations")
-async def get_occupations():
-    return {"total": len(OCCUPATION_SETTINGS), "occupations": list(OCCUPATION_SETTINGS.keys())}
+async def get_occupations(request: Request):
+    return catalog_response(request, catalog.occupation_list)
+
+def register_found_models() -> Dict[str, List[str]]:
+    """Register SDXL checkpoints new to the catalog - realpath -> names it is served as"""
+    served: Dict[str, List[str]] = {}
+    for name, path in model_registry.models().items():
+        served.setdefault(os.path.realpath(path), []).append(name)
+    for entry in model_catalog.find("sdxl"):
+        if entry["path"] not in served and model_registry.register(entry["name"], entry["path"]):
+            served[entry["path"]] = [entry["name"]]
+            print(f"🆕 Model '{entry['name']}' found in {MODELS_DIR}")
+    return served
+
+@app.get("/models")
+async def list_models():
+    """Checkpoints in MODELS_DIR (rescanned - only new or changed headers are read) and which ones "model" accepts"""
+    entries = await asyncio.to_thread(model_catalog.scan)
+    served = await asyncio.to_thread(register_found_models)
+    registry = model_registry.stats()["models"]
+    return {
+        "default": model_registry.default,
+        "models": [
+            {
+                **entry,
+                "served_as": served.get(entry["path"], []),
+                "tier": registry[served[entry["path"]][0]]["tier"] if entry["path"] in served else None,
+            }
+            for entry in entries
+        ],
+        "scan": model_catalog.stats(),
+    }
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate(request: GenerateRequest):
-    try:
+# ============================================
+# JOB ENGINE
+# ============================================
+async def start_job(request: GenerateRequest, inline: bool = False) -> JobRecord:
+    """Resolve the request, queue it on the GPU worker and track it in job_store
+
+    inline=True also base64-encodes the PNG on the CPU pool (for /generate).
+    Raises QueueFullError / AdmissionError / DuplicateJobError before anything is stored.
+    """
+    received_at = time.time()
+    model = model_registry.resolve(request.model)
+    job_id = request.job_id or uuid.uuid4().hex
+    if job_id in job_store and not job_store.get(job_id).finished:
+        raise DuplicateJobError(f"Job '{job_id}' is already queued or running")
+    
+    with stage_meter.track("prompt"):
         pose_name = get_pose_name(request.character, request.pose_name)
-        
-        image, seed, gen_time, width, height, occupation = generate_image(
+        spec = prepare_generation(
             character=request.character,
             pose_name=pose_name,
             quality=request.quality,
@@ -1658,40 +2088,467 @@ async def generate(request: GenerateRequest):
             use_highres=request.use_highres,
             enhance=request.enhance
         )
-        
-        # Convert to base64
-        buffered = BytesIO()
-        image.save(buffered, format="PNG", quality=98)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
-        return GenerateResponse(
-            success=True,
-            image_base64=img_base64,
-            character_name=request.character.name,
-            pose=pose_name,
-            occupation=occupation,
-            quality=request.quality,
-            resolution=f"{width}x{height}",
-            generation_time=f"{gen_time:.2f}s",
-            seed=seed
-        )
-    
+    spec["model"] = model
+    # With storage the response carries a URL - no base64 to build on the CPU pool
+    spec["inline"] = inline and uploader is None
+    preset = QUALITY_PRESETS[request.quality]
+    
+    record = JobRecord(job_id, meta={
+        "character_name": request.character.name,
+        "pose": pose_name,
+        "quality": request.quality,
+        "model": model,
+        "priority": request.priority,
+        "seed": spec["seed"],
+    })
+    if spec["tokens"] is not None:
+        record.meta["prompt_tokens"] = spec["tokens"].length
+        record.meta["prompt_truncated"] = spec["tokens"].truncated
+    
+    # No seed: any variant will do - hand out a pre-rendered one if the pool has it
+    if request.seed is None and inventory is not None:
+        combo = canonical_key(spec["prompt"], NEGATIVE_PROMPT, request.quality, None, request.use_highres, request.enhance, model)
+        inventory.record(combo, spec)
+        variant = inventory.take(combo)
+        if variant is not None:
+            print(f"📦 Inventory hit for job {job_id} (seed {variant['seed']})")
+            record.meta["inventory"] = True
+            record.meta["seed"] = variant["seed"]
+            job_store.remove(job_id)
+            job_store.add(record)
+            job_store.succeed(record, variant, size=len(variant["png"]))
+            return record
+    
+    key = canonical_key(spec["prompt"], NEGATIVE_PROMPT, request.quality, spec["seed"], request.use_highres, request.enhance, model)
+    
+    # Caller-chosen seed: the output is deterministic, so it may already be on disk
+    cache_key = None
+    if request.seed is not None and result_cache is not None:
+        cache_key = ResultCache.key(model_identity(model_registry.path(model)), key)
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            png, meta = cached
+            print(f"💾 Cache hit for job {job_id} (seed {spec['seed']})")
+            record.meta["cached"] = True
+            job_store.remove(job_id)
+            job_store.add(record)
+            stored = await publish_image(png)
+            job_store.succeed(record, {"png": png, "image_base64": None, **stored, **meta}, size=len(png))
+            return record
+    
+    # Same resolved inputs already rendering (retry / double submit) - wait on that run
+    flight = flights.get(key)
+    if flight is not None:
+        record.meta["coalesced"] = True
+        job_store.remove(job_id)
+        job_store.add(record)
+        flights.attach(flight, record)
+        print(f"🔗 Coalesced job {job_id} onto an in-flight render ({len(flight.records)} waiting)")
+        return record
+    
+    preempt_refill()
+    
+    # Requests on the same model + preset inside the batch window share one GPU call.
+    # The denoise engine admits late arrivals between steps, so it needs no window.
+    gpu_job = gpu_worker.enqueue(
+        render_jobs_continuous if CONTINUOUS_BATCHING else render_jobs,
+        spec,
+        batch_key=(model, request.quality),
+        max_batch=DENOISE_SLOTS if CONTINUOUS_BATCHING else preset.get("max_batch", 1),
+        window_s=0 if CONTINUOUS_BATCHING else preset.get("batch_window_ms", 0) / 1000,
+        priority=request.priority,
+        deadline=received_at + request.deadline_s if request.deadline_s else None,
+        finish=encode_result,
+        cost=preset_units(preset, request.use_highres)
+    )
+    job_store.remove(job_id)
+    job_store.add(record)
+    flight = flights.start(key, gpu_job, record)
+    
+    # Progress comes from the GPU thread - hop back onto the loop before touching subscribers
+    loop = asyncio.get_running_loop()
+    gpu_job.on_event = lambda event: loop.call_soon_threadsafe(flight.publish, event)
+    gpu_job.has_listeners = flight.has_listeners
+    gpu_job.preview_every = PREVIEW_EVERY if request.preview_every is None else request.preview_every
+    gpu_job.preview_size = request.preview_size or PREVIEW_SIZE
+    
+    asyncio.create_task(finish_job(flight, cache_key))
+    return record
+
+async def publish_image(png: bytes) -> dict:
+    """Upload on the storage pool -> image_url / upload_path; {} (base64 fallback) when storage is off or fails"""
+    if uploader is None:
+        return {}
+    try:
+        key, url = await asyncio.wrap_future(uploader.submit(png))
+    except Exception as e:
+        print(f"⚠️ Image upload failed, answering with base64: {e}")
+        return {}
+    return {"image_url": url, "upload_path": key}
+
+def make_result(png: bytes, image_base64: Optional[str], stored: dict, seed: int, gen_time: float, width: int, height: int, occupation: str, base_reused: bool) -> dict:
+    """What a succeeded JobRecord holds"""
+    return {
+        "png": png,
+        "image_base64": image_base64,
+        **stored,
+        "occupation": occupation,
+        "resolution": f"{width}x{height}",
+        "generation_time": f"{gen_time:.2f}s",
+        "seed": seed,
+        "base_reused": base_reused,
+    }
+
+def preempt_refill():
+    """Real work is coming - stop the inventory refill at its next denoising step"""
+    global last_gpu_request
+    last_gpu_request = time.time()
+    if refill_job is not None:
+        gpu_worker.cancel(refill_job.job_id, "preempted")
+
+async def refill_inventory():
+    """Idle GPU time -> spare variants for the hottest unseeded combinations, one at a time"""
+    global refill_job
+    while True:
+        await asyncio.sleep(0.5)
+        if not model_loader.ready or not gpu_worker.idle or time.time() - last_gpu_request < INVENTORY_IDLE_S:
+            continue
+        pick = inventory.next_refill()
+        if pick is None:
+            continue
+        combo, spec = pick
+        spec = {**spec, "seed": torch.randint(0, 2**32, (1,)).item(), "inline": False}
+        preset = QUALITY_PRESETS[spec["quality"]]
+        try:
+            refill_job = gpu_worker.enqueue(
+                render_jobs_continuous if CONTINUOUS_BATCHING else render_jobs,
+                spec,
+                batch_key=(spec["model"], spec["quality"]),
+                max_batch=DENOISE_SLOTS if CONTINUOUS_BATCHING else preset.get("max_batch", 1),
+                priority="bulk",
+                finish=encode_result,
+                cost=preset_units(preset, spec["use_highres"]),
+            )
+            png, image_base64, seed, gen_time, width, height, occupation, base_reused = await refill_job.future
+        except JobCancelledError:
+            inventory.done(combo, None, preempted=True)
+            continue
+        except Exception as e:
+            print(f"⚠️ Inventory refill failed: {e}")
+            inventory.done(combo, None)
+            continue
+        finally:
+            refill_job = None
+        stored = await publish_image(png)
+        inventory.done(combo, make_result(png, image_base64, stored, seed, gen_time, width, height, occupation, base_reused))
+        print(f"📦 Inventory: +1 variant ({inventory.total()} in stock)")
+
+async def finish_job(flight, cache_key: Optional[str] = None):
+    """Move the GPU result (or error) into every job record attached to the flight"""
+    try:
+        png, image_base64, seed, gen_time, width, height, occupation, base_reused = await flight.gpu_job.future
+    except DeadlineError as e:
+        for record in flights.land(flight):
+            job_store.fail(record, "dropped", str(e), 504)
+    except JobCancelledError as e:
+        # 499: client closed request (nginx convention)
+        for record in flights.land(flight):
+            job_store.fail(record, "cancelled", str(e), 499)
     except Exception as e:
         print(f"❌ Error: {e}")
         import traceback
         traceback.print_exc()
+        for record in flights.land(flight):
+            job_store.fail(record, "failed", str(e), 500)
+    else:
+        stored = await publish_image(png)
+        result = make_result(png, image_base64, stored, seed, gen_time, width, height, occupation, base_reused)
+        for record in flights.land(flight):
+            record.meta["base_reused"] = base_reused
+            job_store.succeed(record, result, size=len(png) + len(image_base64 or ""))
+        
+        if cache_key is not None:
+            meta = {key: result[key] for key in ("occupation", "resolution", "generation_time", "seed")}
+            try:
+                await asyncio.to_thread(result_cache.put, cache_key, png, meta, gen_time)
+            except OSError as e:
+                print(f"⚠️ Result cache write failed: {e}")
+
+def cancel_record(job_id: str, reason: str) -> Optional[str]:
+    """Cancel one caller's job. The shared GPU run stops only when nobody else waits on it."""
+    flight = flights.of(job_id)
+    if flight is None:
+        return None
+    record = job_store.get(job_id)
+    if record is not None and len(flight.records) > 1:
+        flights.detach(record)
+        job_store.fail(record, "cancelled", f"Job cancelled ({reason})", 499)
+        return "cancelled"
+    return gpu_worker.cancel(flight.gpu_job.job_id, reason)
+
+def job_status(record: JobRecord) -> dict:
+    status = record.to_dict()
+    flight = flights.of(record.job_id)
+    gpu_job = flight.gpu_job if flight is not None else None
+    if not record.finished and gpu_job is not None and gpu_worker.get(gpu_job.job_id) is not None:
+        status["status"] = "running" if gpu_job.started_at else "queued"
+        status["position"] = gpu_worker.position(gpu_job.job_id)
+        status["queue_depth"] = gpu_worker.depth
+        status["eta_s"] = gpu_worker.eta(gpu_job.job_id)
+        status["shared_with"] = len(flight.records) - 1
+    status["status_url"] = f"/jobs/{record.job_id}"
+    status["result_url"] = f"/jobs/{record.job_id}/result"
+    if record.status == "succeeded" and record.result.get("image_url"):
+        status["image_url"] = record.result["image_url"]
+    return status
+
+def job_response(record: JobRecord, base_url: str = "") -> "GenerateResponse":
+    """Finished record -> the classic /generate response (or its HTTP error)
+
+    Stored images are referenced by URL (relative ones resolved against base_url);
+    base64 is only built when the image has no URL.
+    """
+    if record.status != "succeeded":
+        raise HTTPException(status_code=record.error_code or 500, detail=record.error)
+    result = record.result
+    image_url = result.get("image_url")
+    if image_url is not None:
+        image_url = urljoin(base_url, image_url)
+    return GenerateResponse(
+        success=True,
+        image_base64=None if image_url else result["image_base64"] or base64.b64encode(result["png"]).decode(),
+        image_url=image_url,
+        upload_path=result.get("upload_path"),
+        file_size_kb=len(result["png"]) // 1024,
+        character_name=record.meta["character_name"],
+        pose=record.meta["pose"],
+        occupation=result["occupation"],
+        quality=record.meta["quality"],
+        resolution=result["resolution"],
+        generation_time=result["generation_time"],
+        seed=result["seed"],
+        model=record.meta.get("model"),
+        base_reused=result.get("base_reused", False)
+    )
+
+def submission_error(e: Exception) -> HTTPException:
+    if isinstance(e, (QueueFullError, AdmissionError)):
+        print(f"⚠️ {e}, rejecting")
+        return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, UnknownModelError):
+        return HTTPException(status_code=400, detail=str(e))
+    return HTTPException(status_code=409, detail=str(e))
+
+async def watch_disconnect(http_request: Request, job_id: str):
+    """Cancel the render as soon as the HTTP client goes away"""
+    while True:
+        await asyncio.sleep(0.5)
+        if await http_request.is_disconnected():
+            cancel_record(job_id, "client_disconnected")
+            return
+
+@app.post("/generate", response_model=GenerateResponse)
+async def generate(request: GenerateRequest, http_request: Request):
+    """Synchronous wrapper over the job engine - holds the connection until the image is ready"""
+    try:
+        record = await start_job(request, inline=True)
+    except (QueueFullError, AdmissionError, DuplicateJobError, UnknownModelError) as e:
+        raise submission_error(e)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    watcher = asyncio.create_task(watch_disconnect(http_request, record.job_id))
+    try:
+        await record.wait()
+    finally:
+        watcher.cancel()
+    
+    # The caller gets the image (or its URL) in the response, no need to keep it around
+    try:
+        return job_response(record, str(http_request.base_url))
+    finally:
+        job_store.remove(record.job_id)
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: GenerateRequest):
+    """Queue a generation and return its id right away"""
+    try:
+        record = await start_job(request)
+    except (QueueFullError, AdmissionError, DuplicateJobError, UnknownModelError) as e:
+        raise submission_error(e)
+    except Exception as e:
+        print(f"❌ Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return {"success": True, **job_status(record)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    record = job_store.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired")
+    return job_status(record)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, http_request: Request, format: Literal["png", "json"] = "png"):
+    record = job_store.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired")
+    if not record.finished:
+        return JSONResponse(status_code=202, content=job_status(record))
+    if record.status != "succeeded":
+        raise HTTPException(status_code=record.error_code or 500, detail=record.error)
+    
+    if format == "json":
+        return job_response(record, str(http_request.base_url))
+    
+    result = record.result
+    return Response(
+        content=result["png"],
+        media_type="image/png",
+        headers={
+            "X-Seed": str(result["seed"]),
+            "X-Resolution": result["resolution"],
+            "X-Generation-Time": result["generation_time"],
+            "X-Base-Reused": "1" if result.get("base_reused") else "0",
+        }
+    )
+
+@app.get("/images/{shard}/{name}")
+async def get_image(shard: str, name: str):
+    """Images stored by the local backend (STORAGE_BACKEND=local)"""
+    path = uploader.backend.path(f"{shard}/{name}") if uploader is not None and isinstance(uploader.backend, LocalStorage) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # Content-addressed: the bytes behind a URL never change
+    return FileResponse(path, media_type="image/png", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/estimate")
+async def estimate(quality: str = "ultra_hd", use_highres: bool = True, priority: Literal["interactive", "bulk"] = "interactive", deadline_s: Optional[float] = None, model: Optional[str] = None):
+    """What a /generate or /jobs call with these options would cost right now, and whether it would be admitted"""
+    if quality not in QUALITY_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown quality '{quality}'")
+    try:
+        model = model_registry.resolve(model)
+    except UnknownModelError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    units = preset_units(QUALITY_PRESETS[quality], use_highres)
+    deadline = time.time() + deadline_s if deadline_s else None
+    return {
+        "quality": quality,
+        "use_highres": use_highres,
+        "priority": priority,
+        "work_units": round(units, 2),
+        "model": model,
+        **gpu_worker.estimate(priority, units, (model, quality), deadline),
+    }
+
+def sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request):
+    """Server-Sent Events: status, stage, per-step progress and latent previews"""
+    record = job_store.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired")
+    
+    async def stream():
+        queue = record.subscribe()
+        try:
+            yield sse({"type": "connected", "job_id": job_id})
+            yield sse({"type": "status", **job_status(record)})
+            if record.finished:
+                return
+            if record.last_progress is not None:
+                yield sse(record.last_progress)
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield sse(event)
+        finally:
+            record.unsubscribe(queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued/running job, or discard a finished job's result"""
+    state = cancel_record(job_id, "deleted")
+    if state is not None:
+        return {"success": True, "job_id": job_id, "status": state}
+    
+    if job_store.remove(job_id) is not None:
+        return {"success": True, "job_id": job_id, "status": "deleted"}
+    raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or expired")
 
 @app.get("/health")
 async def health():
     return {
         "status": "healthy",
         "gpu": torch.cuda.is_available(),
-        "model_loaded": pipe is not None
+        "model_loaded": model_loader.ready,
+        "queue": gpu_worker.stats()
+    }
+
+@app.get("/live")
+async def live():
+    """Liveness - the process answers; only a failed model load (needs a restart) is fatal"""
+    if model_loader.failed:
+        return JSONResponse(status_code=503, content={"alive": False, "error": model_loader.error})
+    return {"alive": True}
+
+@app.get("/ready")
+async def ready():
+    """Readiness - 503 with load progress until the pipelines are usable"""
+    status = {**model_loader.status(), "warmup": dict(warmup_times)}
+    if not model_loader.ready:
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": "5"})
+    return status
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "queue": gpu_worker.stats(),
+        "jobs": job_store.stats(),
+        "stages": stage_meter.stats(),
+        "cost_model": gpu_worker.cost_model.stats(),
+        "coalescing": flights.stats(),
+        "result_cache": result_cache.stats() if result_cache is not None else None,
+        "embedding_cache": embedding_cache.stats(),
+        "prompt_library": prompt_library.stats() if prompt_library is not None else None,
+        "embedding_store": embedding_store.stats() if embedding_store is not None else None,
+        "storage": uploader.stats() if uploader is not None else None,
+        "inventory": inventory.stats() if inventory is not None else None,
+        "latent_cache": latent_cache.stats() if latent_cache is not None else None,
+        "catalog": catalog.stats(),
+        "engine": denoise_engine.stats() if denoise_engine is not None else None,
+        "model_load": {**model_loader.status(), "weights": model_load_times},
+        "warmup": dict(warmup_times),
+        "models": model_registry.stats(),
+        "model_catalog": model_catalog.stats(),
     }
 
 @app.on_event("startup")
 async def startup():
+    global refill_task
+    gpu_worker.start()
+    # Requests accepted meanwhile wait in the GPU queue for this load
+    model_loader.start()
+    if inventory is not None:
+        refill_task = asyncio.create_task(refill_inventory())
     print("\n" + "="*80)
     print("🚀 NSFW IMAGE GENERATOR API")
     print("="*80)
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+"""
+GPU Worker - single owner of the GPU
+Blocking render calls run on one dedicated thread, fed by a bounded queue,
+so the uvicorn event loop stays free for /health, /poses and new requests.
+Jobs that share a batch key and arrive within the key's window are handed
+to the GPU thread together as one micro-batch.
+Interactive jobs are always served before bulk jobs, and queued jobs whose
+deadline can no longer be met are dropped before they reach the GPU.
+Jobs can be cancelled by id: queued jobs are removed, running jobs see their
+cancel_event set and abort at the next denoising step.
+Render code reports progress through job.emit(), which is safe to call from
+the GPU thread.
+Jobs may carry a CPU finish stage (post-processing, encoding). It runs on a
+separate thread pool, so the GPU thread moves straight on to the next batch.
+For continuous batching, a running batch can admit() more compatible jobs from
+the GPU thread and complete() each job as soon as it is done.
+With a cost model, each job carries its work units. Queue ETAs are the sum of
+the work ahead, and jobs that would overload the queue or miss their deadline
+are refused at submission.
+"""
+import asyncio
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# Lanes in service order - interactive character creation before bulk scripts
+PRIORITIES = ("interactive", "bulk")
+
+
+# ============================================
+# ERRORS
+# ============================================
+class QueueFullError(Exception):
+    """Raised when the GPU queue is at capacity"""
+
+    def __init__(self, depth: int, retry_after: int):
+        super().__init__(f"GPU queue is full ({depth} jobs waiting)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class DeadlineError(Exception):
+    """Raised when a queued job is dropped because its deadline cannot be met"""
+
+    def __init__(self, reason: str, waited: float):
+        super().__init__(f"Job dropped before rendering ({reason}) after waiting {waited:.1f}s")
+        self.reason = reason
+        self.waited = waited
+
+
+class AdmissionError(Exception):
+    """Raised at submission when the queue ETA says the job should not be taken"""
+
+    def __init__(self, reason: str, eta: float, retry_after: int):
+        super().__init__(f"Job not admitted ({reason}): estimated {eta:.0f}s until done")
+        self.reason = reason
+        self.eta = eta
+        self.retry_after = retry_after
+
+
+class DuplicateJobError(ValueError):
+    """Raised when a caller-chosen job id is already queued or running"""
+
+
+class JobCancelledError(Exception):
+    """Raised when a job is cancelled (client gone or DELETE /jobs/{id})
+
+    recovered_s is the GPU time the abort saved, when it is known.
+    """
+
+    def __init__(self, reason: str = "cancelled", recovered_s: float = 0.0):
+        super().__init__(f"Job cancelled ({reason})")
+        self.reason = reason
+        self.recovered_s = recovered_s
+
+
+# ============================================
+# JOB
+# ============================================
+class GPUJob:
+    """One unit of GPU work plus the future its caller awaits
+
+    run_batch takes the list of batched jobs (read job.payload, poll
+    job.is_cancelled()) and returns one result per job.
+    Jobs with the same batch_key may be run together, up to max_batch.
+    finish(job, result), if set, turns the GPU result into the final one on the CPU pool.
+    """
+
+    def __init__(
+        self,
+        payload: Any,
+        run_batch: Callable[[List["GPUJob"]], List[Any]],
+        future: asyncio.Future,
+        batch_key: Optional[Hashable] = None,
+        max_batch: int = 1,
+        window_s: float = 0.0,
+        priority: str = "interactive",
+        deadline: Optional[float] = None,
+        job_id: Optional[str] = None,
+        finish: Optional[Callable[["GPUJob", Any], Any]] = None,
+        cost: float = 0.0,
+    ):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.payload = payload
+        self.run_batch = run_batch
+        self.finish = finish
+        self.future = future
+        self.batch_key = batch_key
+        self.max_batch = max_batch
+        self.window_s = window_s
+        self.priority = priority
+        self.deadline = deadline
+        self.cost = cost  # work units for the cost model, 0 = unknown
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.gpu_s = 0.0  # this job's share of the GPU time while it ran (continuous batching)
+        # Set from the event loop, polled from the GPU thread
+        self.cancel_event = threading.Event()
+        self.cancel_reason: Optional[str] = None
+        # Set when the GPU thread hands the result over early via GPUWorker.complete()
+        self.completed = False
+
+        # Progress reporting - wired up by whoever owns the job
+        self.on_event: Optional[Callable[[dict], None]] = None
+        self.has_listeners: Callable[[], bool] = lambda: False
+        self.preview_every = 0
+        self.preview_size = 256
+
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def emit(self, event: dict):
+        """Report progress - any thread"""
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def wants_preview(self, step: int) -> bool:
+        return self.preview_every > 0 and step % self.preview_every == 0 and self.has_listeners()
+
+    @property
+    def wait_time(self) -> float:
+        return (self.started_at or time.time()) - self.enqueued_at
+
+
+# ============================================
+# WORKER
+# ============================================
+class GPUWorker:
+    """Serialises all GPU work onto a single thread"""
+
+    def __init__(self, max_queue: int = 8, history: int = 100, cpu_workers: int = 2, cost_model=None, max_eta_s: Optional[float] = None):
+        self.max_queue = max_queue  # per lane
+        self.cost_model = cost_model
+        self.max_eta_s = max_eta_s  # shed new work once the queue is this far behind
+        self._lanes: Dict[str, deque] = {lane: deque() for lane in PRIORITIES}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+        self._cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="cpu")
+        self._running: List[GPUJob] = []
+        self._sharing: List[GPUJob] = []  # running jobs not completed yet - they split the GPU time
+        self._shared_at = 0.0
+        self._finishing: set = set()  # finish tasks on the CPU pool
+        self._jobs: Dict[str, GPUJob] = {}  # queued + running, by id
+
+        # Metrics
+        self._waits: deque = deque(maxlen=history)
+        self._runs: deque = deque(maxlen=history)
+        self._batch_sizes: deque = deque(maxlen=history)
+        self._key_run_s: Dict[Hashable, float] = {}
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.shed: Dict[str, int] = {"overloaded": 0, "cannot_meet": 0}
+        self.batches = 0
+        self.dropped: Dict[str, int] = {"expired": 0, "cannot_meet": 0}
+        self.dropped_by_lane: Dict[str, int] = {lane: 0 for lane in PRIORITIES}
+        self.cancelled: Dict[str, int] = {"queued": 0, "running": 0}
+        self.cancel_reasons: Dict[str, int] = {}
+        self.gpu_s_recovered = 0.0
+
+    # ---------- lifecycle ----------
+    def start(self):
+        """Start the dispatcher on the running event loop"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._cpu_executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------- submission ----------
+    async def submit(self, fn: Callable, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for the GPU thread and await its result"""
+        call = partial(fn, *args, **kwargs)
+        return await self.submit_batchable(lambda jobs: [call()], None)
+
+    async def submit_batchable(self, run_batch: Callable[[List[GPUJob]], List[Any]], payload: Any, **options):
+        """Queue a payload that may be merged with other payloads of the same batch_key and await it"""
+        job = self.enqueue(run_batch, payload, **options)
+        return await job.future
+
+    def enqueue(
+        self,
+        run_batch: Callable[[List[GPUJob]], List[Any]],
+        payload: Any,
+        batch_key: Optional[Hashable] = None,
+        max_batch: int = 1,
+        window_s: float = 0.0,
+        priority: str = "interactive",
+        deadline: Optional[float] = None,
+        job_id: Optional[str] = None,
+        finish: Optional[Callable[[GPUJob, Any], Any]] = None,
+        cost: float = 0.0,
+    ) -> GPUJob:
+        """Queue a payload without waiting - await job.future for the result
+
+        deadline is an absolute time.time() after which the caller no longer wants the result.
+        Raises QueueFullError / AdmissionError / DuplicateJobError straight away.
+        """
+        if priority not in self._lanes:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+        if job_id is not None and job_id in self._jobs:
+            raise DuplicateJobError(f"Job '{job_id}' is already queued or running")
+
+        lane = self._lanes[priority]
+        if len(lane) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(len(lane), self.retry_after())
+
+        estimate = self.estimate(priority, cost, batch_key, deadline)
+        if not estimate["admit"]:
+            self.shed[estimate["reason"]] += 1
+            raise AdmissionError(estimate["reason"], estimate["finish_s"], estimate["retry_after"])
+
+        job = GPUJob(
+            payload,
+            run_batch,
+            asyncio.get_running_loop().create_future(),
+            batch_key=batch_key,
+            max_batch=max_batch,
+            window_s=window_s,
+            priority=priority,
+            deadline=deadline,
+            job_id=job_id,
+            finish=finish,
+            cost=cost,
+        )
+        self._jobs[job.job_id] = job
+        job.future.add_done_callback(lambda _: self._jobs.pop(job.job_id, None))
+        lane.append(job)
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[GPUJob]:
+        return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """0-based place in service order, None if not queued"""
+        for index, job in enumerate(self._pending_jobs()):
+            if job.job_id == job_id:
+                return index
+        return None
+
+    # ---------- cancellation ----------
+    def cancel(self, job_id: str, reason: str = "cancelled") -> Optional[str]:
+        """Cancel a queued or running job. Returns its new state, or None if unknown."""
+        job = self._jobs.get(job_id)
+        if job is None or job.future.done():
+            return None
+
+        job.cancel_reason = reason
+        job.cancel_event.set()
+        self.cancel_reasons[reason] = self.cancel_reasons.get(reason, 0) + 1
+
+        queue = self._lanes[job.priority]
+        if job in queue:
+            queue.remove(job)
+            self.cancelled["queued"] += 1
+            self.gpu_s_recovered += self.estimate_job(job)
+            job.future.set_exception(JobCancelledError(reason))
+            print(f"🛑 Cancelled queued job {job_id} ({reason})")
+            return "cancelled"
+
+        # Running: the GPU thread aborts at the next step boundary
+        print(f"🛑 Cancelling running job {job_id} ({reason})")
+        return "cancelling"
+
+    # ---------- continuous batching (called from the GPU thread) ----------
+    def admit(self, batch: List[GPUJob], limit: int) -> List[GPUJob]:
+        """Move up to limit queued jobs with batch's key into the running batch"""
+        if limit <= 0:
+            return []
+        return asyncio.run_coroutine_threadsafe(self._admit(batch, limit), self._loop).result()
+
+    def complete(self, job: GPUJob, result: Any = None, error: Optional[Exception] = None):
+        """Hand one job's result (or error) back before the rest of its batch is done"""
+        job.completed = True
+        self._loop.call_soon_threadsafe(self._complete, job, result, error)
+
+    async def _admit(self, batch: List[GPUJob], limit: int) -> List[GPUJob]:
+        self._sweep_deadlines()
+        admitted = [batch[0]]
+        self._take_compatible(admitted, limit=limit + 1)
+        admitted = admitted[1:]
+
+        started_at = time.time()
+        for job in admitted:
+            job.started_at = started_at
+            self._waits.append(job.wait_time)
+            job.emit({"type": "status", "status": "running", "batch_size": len(batch) + len(admitted)})
+        self._accrue(started_at)
+        self._sharing.extend(admitted)
+        batch.extend(admitted)
+        return admitted
+
+    def _accrue(self, now: float):
+        """Split the GPU time since the last change evenly over the jobs sharing it"""
+        if self._sharing:
+            share = (now - self._shared_at) / len(self._sharing)
+            for job in self._sharing:
+                job.gpu_s += share
+        self._shared_at = now
+
+    def _complete(self, job: GPUJob, result: Any, error: Optional[Exception]):
+        job.finished_at = time.time()
+        self._accrue(job.finished_at)
+        if job in self._sharing:
+            self._sharing.remove(job)
+        if isinstance(error, JobCancelledError):
+            self.cancelled["running"] += 1
+            self.gpu_s_recovered += error.recovered_s
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        if error is not None:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+
+        # The job's share of the steps, not its wall time - that window was shared with its batch-mates,
+        # and the cost model would learn a rate inflated by the concurrency
+        self._record_run([job], job.gpu_s)
+        self._deliver(job, result)
+
+    # ---------- scheduling ----------
+    def _pending_jobs(self):
+        """All queued jobs in service order"""
+        for lane in PRIORITIES:
+            yield from self._lanes[lane]
+
+    def _next_head(self) -> Optional[GPUJob]:
+        for lane in PRIORITIES:
+            queue = self._lanes[lane]
+            while queue:
+                job = queue.popleft()
+                if not job.future.cancelled():
+                    return job
+        return None
+
+    def _drop_reason(self, job: GPUJob, now: float) -> Optional[str]:
+        """Why job can no longer meet its deadline, or None if it still can"""
+        if job.deadline is None:
+            return None
+        if now >= job.deadline:
+            return "expired"
+        if now + self.estimate_job(job) > job.deadline:
+            return "cannot_meet"
+        return None
+
+    def _drop(self, job: GPUJob, reason: str):
+        self.dropped[reason] += 1
+        self.dropped_by_lane[job.priority] += 1
+        print(f"⏱️ Dropping {job.priority} job ({reason}) after {job.wait_time:.1f}s in queue")
+        if not job.future.done():
+            job.future.set_exception(DeadlineError(reason, job.wait_time))
+
+    def _sweep_deadlines(self):
+        """Drop every queued job that would finish after its deadline"""
+        now = time.time()
+        for lane in PRIORITIES:
+            queue = self._lanes[lane]
+            for job in list(queue):
+                reason = self._drop_reason(job, now)
+                if reason:
+                    queue.remove(job)
+                    self._drop(job, reason)
+
+    def _take_compatible(self, batch: List[GPUJob], limit: Optional[int] = None):
+        """Move pending jobs with the same batch key into batch, interactive first"""
+        head = batch[0]
+        limit = head.max_batch if limit is None else limit
+        for lane in PRIORITIES:
+            queue = self._lanes[lane]
+            for job in list(queue):
+                if len(batch) >= limit:
+                    return
+                if job.batch_key == head.batch_key and not job.future.cancelled():
+                    queue.remove(job)
+                    batch.append(job)
+
+    async def _collect_batch(self, head: GPUJob) -> List[GPUJob]:
+        """Wait up to the head job's window for compatible jobs to arrive"""
+        batch = [head]
+        if head.batch_key is None or head.max_batch <= 1:
+            return batch
+
+        # Window counts from when the head job arrived: under backlog we never add latency
+        close_at = head.enqueued_at + head.window_s
+        while True:
+            self._take_compatible(batch)
+            remaining = close_at - time.time()
+            if len(batch) >= head.max_batch or remaining <= 0:
+                return batch
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self._sweep_deadlines()
+            head = self._next_head()
+            if head is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            batch = await self._collect_batch(head)
+
+            # Last check before the GPU: the batch window may have eaten the slack
+            now = time.time()
+            for job in list(batch):
+                reason = self._drop_reason(job, now)
+                if reason:
+                    batch.remove(job)
+                    self._drop(job, reason)
+            if not batch:
+                continue
+            head = batch[0]
+
+            started_at = time.time()
+            for job in batch:
+                job.started_at = started_at
+                self._waits.append(job.wait_time)
+                job.emit({"type": "status", "status": "running", "batch_size": len(batch)})
+            self._running = batch
+            self._sharing, self._shared_at = list(batch), started_at
+            self._batch_sizes.append(len(batch))
+            self.batches += 1
+
+            aborted = False
+            try:
+                results = await loop.run_in_executor(self._executor, head.run_batch, batch)
+            except JobCancelledError as e:
+                # Whole batch aborted mid-denoise
+                aborted = True
+                self.gpu_s_recovered += e.recovered_s
+                for job in batch:
+                    if not job.future.done() and not job.completed:
+                        self.cancelled["running"] += 1
+                        job.future.set_exception(JobCancelledError(job.cancel_reason or e.reason, e.recovered_s))
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done() and not job.completed:
+                        self.failed += 1
+                        job.future.set_exception(e)
+            else:
+                for job, result in zip(batch, results):
+                    if not job.completed:
+                        self._deliver(job, result)
+            finally:
+                finished_at = time.time()
+                for job in batch:
+                    if not job.completed:
+                        job.finished_at = finished_at
+                self._running = []
+                self._sharing = []
+
+                # Aborted runs would make the estimates look too fast; early-completed
+                # jobs already recorded their own run times
+                if not aborted and not any(job.completed for job in batch):
+                    self._record_run(batch, finished_at - started_at)
+
+    def _record_run(self, jobs: List[GPUJob], elapsed: float):
+        self._runs.append(elapsed)
+
+        # Per batch-key run time (EWMA) - the fallback for jobs without a cost
+        batch_key = jobs[0].batch_key
+        previous = self._key_run_s.get(batch_key)
+        self._key_run_s[batch_key] = elapsed if previous is None else 0.7 * previous + 0.3 * elapsed
+
+        if self.cost_model is not None and all(job.cost for job in jobs):
+            self.cost_model.observe(sum(job.cost for job in jobs), elapsed)
+
+    def _deliver(self, job: GPUJob, result: Any):
+        """GPU stage done - run the CPU finish stage or resolve the future"""
+        if job.future.done():
+            return
+        if job.is_cancelled():
+            # Shared the batch with live jobs, finished anyway
+            self.cancelled["running"] += 1
+            job.future.set_exception(JobCancelledError(job.cancel_reason))
+        elif job.finish is not None:
+            task = self._loop.create_task(self._run_finish(job, result))
+            self._finishing.add(task)
+            task.add_done_callback(self._finishing.discard)
+        else:
+            self.processed += 1
+            job.future.set_result(result)
+
+    async def _run_finish(self, job: GPUJob, result: Any):
+        """CPU stage of one job - overlaps with the next batch on the GPU"""
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._cpu_executor, job.finish, job, result)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        if job.future.done():
+            return
+        if job.is_cancelled():
+            self.cancelled["running"] += 1
+            job.future.set_exception(JobCancelledError(job.cancel_reason))
+        else:
+            self.processed += 1
+            job.future.set_result(result)
+
+    # ---------- metrics ----------
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._lanes.values())
+
+    @property
+    def idle(self) -> bool:
+        """Nothing queued and nothing on the GPU"""
+        return self.depth == 0 and all(job.completed for job in self._running)
+
+    def avg_run_time(self) -> float:
+        return sum(self._runs) / len(self._runs) if self._runs else 0.0
+
+    def estimate_run_time(self, batch_key: Optional[Hashable] = None) -> float:
+        """Expected GPU time for one batch of batch_key (0 until we have measurements)"""
+        return self._key_run_s.get(batch_key, self.avg_run_time())
+
+    def estimate_job(self, job: GPUJob) -> float:
+        """Expected GPU time for one job - cost model if it has a cost, else its key's average"""
+        if job.cost and self.cost_model is not None:
+            return self.cost_model.seconds(job.cost)
+        return self.estimate_run_time(job.batch_key)
+
+    def _running_remaining(self) -> float:
+        running = [job for job in self._running if not job.completed]
+        if not running:
+            return 0.0
+        elapsed = time.time() - running[0].started_at
+        return max(0.0, sum(self.estimate_job(job) for job in running) - elapsed)
+
+    def queue_eta(self, priority: str = "interactive") -> float:
+        """Seconds until a new job of this priority would reach the GPU"""
+        eta = self._running_remaining()
+        for lane in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+            eta += sum(self.estimate_job(job) for job in self._lanes[lane])
+        return eta
+
+    def eta(self, job_id: str) -> Optional[float]:
+        """Seconds until a queued job is expected to finish"""
+        eta = self._running_remaining()
+        for job in self._pending_jobs():
+            eta += self.estimate_job(job)
+            if job.job_id == job_id:
+                return round(eta, 1)
+        return None
+
+    def estimate(self, priority: str = "interactive", cost: float = 0.0, batch_key: Optional[Hashable] = None, deadline: Optional[float] = None) -> dict:
+        """Admission decision for a job that has not been submitted yet"""
+        wait = self.queue_eta(priority)
+        if cost and self.cost_model is not None:
+            run = self.cost_model.seconds(cost)
+        else:
+            run = self.estimate_run_time(batch_key)
+        finish = wait + run
+
+        reason = None
+        if deadline is not None and time.time() + finish > deadline:
+            reason = "cannot_meet"
+        elif self.max_eta_s is not None and wait > self.max_eta_s:
+            reason = "overloaded"
+
+        if reason == "overloaded":
+            retry_after = max(1, math.ceil(wait - self.max_eta_s))
+        else:
+            retry_after = max(1, math.ceil(finish - (deadline - time.time()))) if reason else 0
+        return {
+            "queue_eta_s": round(wait, 2),
+            "run_s": round(run, 2),
+            "finish_s": round(finish, 2),
+            "admit": reason is None,
+            "reason": reason,
+            "retry_after": retry_after,
+        }
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up"""
+        return max(1, math.ceil(self.avg_run_time() or 30.0))
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "queue_depth": self.depth,
+            "lanes": {lane: len(queue) for lane, queue in self._lanes.items()},
+            "max_queue": self.max_queue,
+            "running": sum(1 for job in self._running if not job.completed),
+            "running_for_s": round(time.time() - self._running[0].started_at, 2) if self._running else 0.0,
+            "finishing": len(self._finishing),
+            "oldest_wait_s": round(max((job.wait_time for job in self._pending_jobs()), default=0.0), 2),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "shed": dict(self.shed),
+            "eta_s": {lane: round(self.queue_eta(lane), 1) for lane in PRIORITIES},
+            "max_eta_s": self.max_eta_s,
+            "batches": self.batches,
+            "dropped": dict(self.dropped),
+            "dropped_by_lane": dict(self.dropped_by_lane),
+            "cancelled": dict(self.cancelled),
+            "cancel_reasons": dict(self.cancel_reasons),
+            "gpu_s_recovered": round(self.gpu_s_recovered, 1),
+            "avg_batch_size": round(sum(self._batch_sizes) / len(self._batch_sizes), 2) if self._batch_sizes else 0.0,
+            "avg_wait_s": round(sum(waits) / len(waits), 2) if waits else 0.0,
+            "p95_wait_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0.0,
+            "avg_run_s": round(self.avg_run_time(), 2),
+        }
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Inventory - pre-rendered variants for popular unseeded requests
+Most requests without a seed ask for the same few pose x occupation x
+attribute combinations. Any seed is a valid answer to those, so idle GPU time
+renders spare variants of the hottest combinations and a matching request is
+answered from the pool at once. Each variant is handed out exactly once.
+
+Demand per combination is a request count with exponential decay. The image
+budget is split between the combinations above min_demand in proportion to
+their demand (capped per combination), so the pool follows what is being
+asked for right now. The refill loop lives in the API: it only renders while
+the GPU is idle and its job is cancelled as soon as real work arrives.
+
+Self-check:  python inventory.py
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+
+class InventoryPool:
+    """combination key -> pre-rendered results, sized by decayed demand"""
+
+    def __init__(
+        self,
+        max_images: int = 16,
+        per_combo: int = 4,
+        min_demand: float = 1.5,
+        half_life_s: float = 600.0,
+        ttl_s: float = 3600.0,
+        max_tracked: int = 1024,
+    ):
+        self.max_images = max_images
+        self.per_combo = per_combo
+        self.min_demand = min_demand
+        self.half_life_s = half_life_s
+        self.ttl_s = ttl_s
+        self.max_tracked = max_tracked
+        self._demand: Dict[str, Tuple[float, float]] = {}  # key -> (score, updated_at)
+        self._specs: Dict[str, dict] = {}  # key -> render spec without a seed
+        self._stock: Dict[str, deque] = {}  # key -> (created_at, result)
+        self._inflight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.served = 0
+        self.missed = 0
+        self.rendered = 0
+        self.preempted = 0
+        self.failed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    # ---------- demand ----------
+    def _score(self, key: str, now: float) -> float:
+        score, updated_at = self._demand.get(key, (0.0, now))
+        return score * 0.5 ** ((now - updated_at) / self.half_life_s)
+
+    def record(self, key: str, spec: dict, now: Optional[float] = None):
+        """One unseeded request for key; spec is what a refill renders (its seed is replaced)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._demand[key] = (self._score(key, now) + 1.0, now)
+            self._specs[key] = spec
+            if len(self._demand) > self.max_tracked:
+                self._forget_coldest(now)
+
+    def _forget_coldest(self, now: float):
+        idle = [key for key in self._demand if not self._stock.get(key) and not self._inflight.get(key)]
+        if idle:
+            coldest = min(idle, key=lambda key: self._score(key, now))
+            del self._demand[coldest]
+            self._specs.pop(coldest, None)
+
+    def targets(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Variants each hot combination should have in stock"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._targets(now)
+
+    def _targets(self, now: float) -> Dict[str, int]:
+        hot = {key: self._score(key, now) for key in self._demand}
+        hot = {key: score for key, score in hot.items() if score >= self.min_demand}
+        total = sum(hot.values())
+        return {key: min(self.per_combo, max(1, round(self.max_images * score / total))) for key, score in hot.items()}
+
+    # ---------- stock ----------
+    def _purge(self, now: float):
+        for stock in self._stock.values():
+            while stock and now - stock[0][0] > self.ttl_s:
+                stock.popleft()
+                self.expired += 1
+
+    def take(self, key: str, now: Optional[float] = None) -> Optional[dict]:
+        """A pre-rendered result for key, removed from the pool - never handed out twice"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._purge(now)
+            stock = self._stock.get(key)
+            if not stock:
+                self.missed += 1
+                return None
+            self.served += 1
+            return stock.popleft()[1]
+
+    def next_refill(self, now: Optional[float] = None) -> Optional[Tuple[str, dict]]:
+        """(key, spec) of the combination furthest below its target, counted as in flight - None when all are stocked"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._purge(now)
+            if self.total() >= self.max_images:
+                return None
+            best, best_gap = None, 0
+            for key, target in self._targets(now).items():
+                gap = target - len(self._stock.get(key, ())) - self._inflight.get(key, 0)
+                if gap > best_gap or (gap == best_gap and gap > 0 and self._score(key, now) > self._score(best, now)):
+                    best, best_gap = key, gap
+            if best is None:
+                return None
+            self._inflight[best] = self._inflight.get(best, 0) + 1
+            return best, self._specs[best]
+
+    def done(self, key: str, result: Optional[dict] = None, preempted: bool = False, now: Optional[float] = None):
+        """A refill finished (result) or was abandoned (None)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._inflight[key] = max(0, self._inflight.get(key, 0) - 1)
+            if result is None:
+                if preempted:
+                    self.preempted += 1
+                else:
+                    self.failed += 1
+                return
+            self.rendered += 1
+            self._stock.setdefault(key, deque()).append((now, result))
+            while self.total() > self.max_images:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop the oldest variant of the combination most over its target"""
+        targets = self._targets(now)
+        key = max((key for key, stock in self._stock.items() if stock), key=lambda key: len(self._stock[key]) - targets.get(key, 0))
+        self._stock[key].popleft()
+        self.evicted += 1
+
+    def total(self) -> int:
+        return sum(len(stock) for stock in self._stock.values())
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            targets = self._targets(now)
+            lookups = self.served + self.missed
+            return {
+                "images": self.total(),
+                "max_images": self.max_images,
+                "hot_combinations": len(targets),
+                "stocked_combinations": sum(1 for stock in self._stock.values() if stock),
+                "tracked": len(self._demand),
+                "in_flight": sum(self._inflight.values()),
+                "served": self.served,
+                "missed": self.missed,
+                "hit_rate": round(self.served / lookups, 3) if lookups else 0.0,
+                "rendered": self.rendered,
+                "preempted": self.preempted,
+                "failed": self.failed,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+# ============================================
+# SELF-CHECK (simulated clock)
+# ============================================
+if __name__ == "__main__":
+    import random
+
+    pool = InventoryPool(max_images=8, per_combo=4, min_demand=2.0, half_life_s=600, ttl_s=3600)
+    t = 0.0
+
+    # Demand: "hot" 6x, "warm" 3x, "cold" once (below min_demand)
+    for key, count in (("hot", 6), ("warm", 3), ("cold", 1)):
+        for _ in range(count):
+            pool.record(key, {"prompt": key}, now=t)
+    targets = pool.targets(now=t)
+    assert set(targets) == {"hot", "warm"} and targets["hot"] == 4 and targets["warm"] == 3, targets
+
+    # Idle refill until stocked; hottest combination first
+    order = []
+    while True:
+        pick = pool.next_refill(now=t)
+        if pick is None:
+            break
+        key, spec = pick
+        order.append(key)
+        pool.done(key, {"seed": random.getrandbits(32), "prompt": spec["prompt"]}, now=t)
+    assert order[0] == "hot" and order.count("hot") == 4 and order.count("warm") == 3, order
+
+    # A preempted refill is retried, not lost
+    pool.take("warm", now=t)
+    key, _ = pool.next_refill(now=t)
+    pool.done(key, None, preempted=True, now=t)
+    assert pool.next_refill(now=t)[0] == "warm"
+    pool.done("warm", {"seed": 1, "prompt": "warm"}, now=t)
+
+    # Every variant is served once
+    seen = set()
+    for _ in range(4):
+        result = pool.take("hot", now=t)
+        assert result is not None and result["seed"] not in seen
+        seen.add(result["seed"])
+    assert pool.take("hot", now=t) is None and pool.take("cold", now=t) is None
+
+    # Demand moves: "warm" cools off over hours, "new" takes over the budget
+    t += 4 * 3600
+    for _ in range(5):
+        pool.record("new", {"prompt": "new"}, now=t)
+    assert pool.targets(now=t) == {"new": 4}
+    assert pool.take("warm", now=t) is None, "expired variants must not be served"
+    print(f"✅ Inventory pool follows demand and serves each variant once ({pool.stats()})")
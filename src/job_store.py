@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Job Store - in-process registry of async generation jobs
+Finished results are kept for a TTL, and the store is bounded by job count and
+result bytes. The oldest finished jobs are evicted first. Active jobs are never
+evicted.
+Each record also fans progress events out to its SSE subscribers.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Terminal states
+FINISHED_STATES = ("succeeded", "failed", "cancelled", "dropped")
+
+
+# ============================================
+# RECORD
+# ============================================
+class JobRecord:
+    """Status + result of one job, as seen by GET /jobs/{id}"""
+
+    def __init__(self, job_id: str, meta: Optional[Dict[str, Any]] = None):
+        self.job_id = job_id
+        self.meta = meta or {}
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.result_bytes = 0
+        self.error: Optional[str] = None
+        self.error_code: Optional[int] = None
+        self._done = asyncio.Event()
+        self.subscribers: List[asyncio.Queue] = []
+        self.last_progress: Optional[dict] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    async def wait(self):
+        await self._done.wait()
+
+    # ---------- progress fan-out (event loop only) ----------
+    def subscribe(self, maxsize: int = 64) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def publish(self, event: Optional[dict]):
+        """Send event to every subscriber; None closes the streams"""
+        if event is not None and event.get("type") == "progress":
+            self.last_progress = {k: v for k, v in event.items() if k != "preview"}
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow reader - drop its oldest event rather than block the GPU
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            **self.meta,
+        }
+
+
+# ============================================
+# STORE
+# ============================================
+class JobStore:
+    """Bounded, TTL-evicted job registry"""
+
+    def __init__(self, max_jobs: int = 200, max_bytes: int = 512 * 1024 * 1024, ttl_s: float = 900.0):
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._jobs: "OrderedDict[str, JobRecord]" = OrderedDict()
+        self._bytes = 0
+        self.evicted = 0
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._jobs
+
+    def add(self, record: JobRecord):
+        self._jobs[record.job_id] = record
+        self.evict()
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        self.evict()
+        return self._jobs.get(job_id)
+
+    def remove(self, job_id: str) -> Optional[JobRecord]:
+        record = self._jobs.pop(job_id, None)
+        if record is not None:
+            self._bytes -= record.result_bytes
+        return record
+
+    # ---------- transitions ----------
+    def succeed(self, record: JobRecord, result: Dict[str, Any], size: int = 0):
+        record.result = result
+        # A record removed meanwhile (DELETE while the image was uploading) still wakes its waiters,
+        # but its bytes are not counted - nothing would ever subtract them again
+        if self._jobs.get(record.job_id) is record:
+            record.result_bytes = size
+            self._bytes += size
+        self._finish(record, "succeeded")
+
+    def fail(self, record: JobRecord, status: str, error: str, code: int):
+        record.error = error
+        record.error_code = code
+        self._finish(record, status)
+
+    def _finish(self, record: JobRecord, status: str):
+        record.status = status
+        record.finished_at = time.time()
+        record._done.set()
+        record.publish({"type": "status", "status": status, "error": record.error})
+        record.publish(None)
+        self.evict()
+
+    # ---------- eviction ----------
+    def evict(self):
+        """Drop expired results, then the oldest finished jobs while over budget"""
+        now = time.time()
+        for job_id, record in list(self._jobs.items()):
+            if record.finished and now - record.finished_at > self.ttl_s:
+                self.remove(job_id)
+                self.evicted += 1
+
+        for job_id, record in list(self._jobs.items()):
+            if len(self._jobs) <= self.max_jobs and self._bytes <= self.max_bytes:
+                break
+            if record.finished:
+                self.remove(job_id)
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        states: Dict[str, int] = {}
+        for record in self._jobs.values():
+            states[record.status] = states.get(record.status, 0) + 1
+        return {
+            "jobs": len(self._jobs),
+            "max_jobs": self.max_jobs,
+            "result_mb": round(self._bytes / 1024 / 1024, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "ttl_s": self.ttl_s,
+            "evicted": self.evicted,
+            "states": states,
+        }
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Latent Cache - base-pass output latents kept for follow-up requests
+Clients often resend a seed with use_highres or enhance flipped. The base
+txt2img pass only depends on the model, prompt, negative prompt, base
+size / steps / cfg and seed, so its latents are kept here and a follow-up
+starts at decode + highres instead of repeating the base denoise.
+Entries live in CPU RAM (~120KB each at SDXL base sizes), LRU by bytes.
+"""
+import hashlib
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+
+class LatentCache:
+    """(model, prompt, negative prompt, base settings, seed) -> base latents, LRU by bytes"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Component module -> token, so a reloaded model never hits stale entries
+        self._model_tokens: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.steps_saved = 0
+
+    def _token(self, module) -> str:
+        if module not in self._model_tokens:
+            self._model_tokens[module] = uuid.uuid4().hex
+        return self._model_tokens[module]
+
+    def key(self, model, prompt: str, negative_prompt: str, preset: dict, seed: int) -> str:
+        """Everything the base pass output depends on - highres and enhance settings are not part of it"""
+        parts = [
+            self._token(model.unet), self._token(model.text_encoder), self._token(model.text_encoder_2),
+            prompt, negative_prompt,
+            str(preset['base_width']), str(preset['base_height']), str(preset['steps']), repr(float(preset['cfg'])),
+            str(int(seed)),
+        ]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str, steps: int = 0) -> Optional[torch.Tensor]:
+        with self._lock:
+            latents = self._entries.get(key)
+            if latents is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.steps_saved += steps
+            return latents
+
+    def put(self, key: str, latents: torch.Tensor):
+        latents = latents.detach().to("cpu")
+        size = latents.numel() * latents.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.numel() * old.element_size()
+            self._entries[key] = latents
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.numel() * old.element_size()
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "mb": round(self._bytes / 1024 / 1024, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evicted": self.evicted,
+            "base_steps_saved": self.steps_saved,
+        }
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Latent Previews - cheap in-progress images for SSE progress streams
+SDXL latents are projected to RGB with a fixed 4x3 linear map instead of a VAE
+decode. That is one tiny matmul on a 1/8-resolution tensor, so a preview costs
+almost nothing on the GPU.
+"""
+from io import BytesIO
+from typing import Optional
+
+import torch
+from PIL import Image
+
+# SDXL latent channel -> RGB (same approximation ComfyUI/A1111 use for live previews)
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+_factors_cache = {}
+
+
+def _factors(device, dtype):
+    key = (str(device), dtype)
+    if key not in _factors_cache:
+        _factors_cache[key] = (
+            torch.tensor(SDXL_LATENT_RGB_FACTORS, device=device, dtype=dtype),
+            torch.tensor(SDXL_LATENT_RGB_BIAS, device=device, dtype=dtype),
+        )
+    return _factors_cache[key]
+
+
+def latents_to_image(latents: torch.Tensor, max_size: int = 256) -> Image.Image:
+    """(4, h, w) latent -> small RGB PIL image"""
+    latents = latents.float()
+    factors, bias = _factors(latents.device, latents.dtype)
+    rgb = torch.einsum("chw,cr->hwr", latents, factors) + bias
+    rgb = ((rgb + 1.0) / 2.0).clamp(0, 1).mul(255).to(torch.uint8).cpu().numpy()
+
+    image = Image.fromarray(rgb)
+    if max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.BILINEAR)
+    elif max(image.size) < max_size:
+        # Latents are 1/8 scale - upscale so the preview is actually viewable
+        scale = max_size / max(image.size)
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR)
+    return image
+
+
+def latents_to_jpeg(latents: torch.Tensor, max_size: int = 256, quality: int = 70) -> Optional[bytes]:
+    """(4, h, w) latent -> JPEG bytes, None if the latent is not SDXL-shaped"""
+    if latents.dim() != 3 or latents.shape[0] != len(SDXL_LATENT_RGB_FACTORS):
+        return None
+    buffered = BytesIO()
+    latents_to_image(latents.detach(), max_size).save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Model Catalog - checkpoints discovered from their safetensors headers
+A .safetensors file starts with an 8-byte length and a JSON header listing
+every tensor (name, dtype, shape, byte range). That header alone tells the
+architecture (SDXL / SD1 / SD2 / refiner / VAE / LoRA, from the key layout),
+the dtype mix, the parameter count and whether the file is complete - without
+reading gigabytes of weights.
+
+The fingerprint hashes the header plus a few evenly spaced 64KB samples of the
+tensor data: cheap, stable across copies and renames, and different for any
+two real checkpoints (a full sha256 is what the checkpoint cache computes on
+first load). Scan results are kept in a JSON cache keyed by path, size and
+mtime, so a restart only reads headers of new or changed files.
+
+Self-check + benchmark:  python model_catalog.py
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+HEADER_LIMIT = 100 * 1024 * 1024  # the safetensors format caps headers at 100MB
+SAMPLES = 16
+SAMPLE_BYTES = 64 * 1024
+CACHE_VERSION = 1
+
+
+def read_header(path: str) -> Tuple[dict, int]:
+    """(header dict, header length) - raises ValueError for anything that is not safetensors"""
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) < 8:
+            raise ValueError("file too short")
+        (length,) = struct.unpack("<Q", prefix)
+        if length > HEADER_LIMIT:
+            raise ValueError(f"header length {length} too large")
+        raw = f.read(length)
+    if len(raw) < length:
+        raise ValueError("header truncated")
+    try:
+        header = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"header is not JSON: {e}") from None
+    if not isinstance(header, dict):
+        raise ValueError("header is not a JSON object")
+    return header, length
+
+
+def detect_architecture(keys: Sequence[str], metadata: dict) -> str:
+    """Model family from the tensor names (original single-file or diffusers layout)"""
+    def has(prefix: str) -> bool:
+        return any(key.startswith(prefix) for key in keys)
+
+    if any("lora_down" in key or "lora_A." in key or key.startswith(("lora_unet_", "lora_te")) for key in keys):
+        return "lora"
+    if has("model.diffusion_model."):
+        if has("conditioner.embedders.1."):
+            return "sdxl"
+        if has("conditioner.embedders.0.model."):
+            return "sdxl-refiner"
+        if has("cond_stage_model.model."):
+            return "sd2"
+        if has("cond_stage_model.transformer."):
+            return "sd1"
+        return "sdxl" if has("model.diffusion_model.label_emb.") else "sd-unet"
+    if has("down_blocks.") and has("conv_in."):
+        return "sdxl-unet" if has("add_embedding.") else "unet"
+    if has("encoder.down") and has("decoder.up"):
+        return "vae"
+    if has("text_model."):
+        return "text-encoder"
+    # modelspec metadata (e.g. "stable-diffusion-xl-v1-base") when the keys say nothing
+    spec = str(metadata.get("modelspec.architecture", ""))
+    if "xl" in spec:
+        return "sdxl"
+    return "unknown"
+
+
+def fingerprint(path: str, header_length: int, size: int) -> str:
+    """blake2b of the header + SAMPLES slices spread over the tensor data"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(8 + header_length))
+        start = 8 + header_length
+        span = max(0, size - start - SAMPLE_BYTES)
+        for index in range(SAMPLES):
+            f.seek(start + span * index // max(1, SAMPLES - 1))
+            digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def model_name(path: str) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"[^a-z0-9]+", "_", stem.lower()).strip("_")
+
+
+def describe(path: str) -> dict:
+    """Catalog entry for one file - reads the header and the fingerprint samples only
+
+    A file that is not usable safetensors (unreadable, malformed header or
+    tensor entries) is still listed, as architecture "invalid" with the error.
+    """
+    size = os.path.getsize(path)
+    entry = {"name": model_name(path), "path": os.path.realpath(path), "size_bytes": size, "size_gb": round(size / 1024 ** 3, 2)}
+    try:
+        entry.update(_inspect(path, size))
+    except (KeyError, TypeError, ValueError, OSError) as e:
+        return {**entry, "architecture": "invalid", "error": f"{type(e).__name__}: {e}"}
+    return entry
+
+
+def _inspect(path: str, size: int) -> dict:
+    header, length = read_header(path)
+    metadata = header.pop("__metadata__", None) or {}
+    if not isinstance(metadata, dict):
+        raise ValueError("__metadata__ is not a JSON object")
+    dtype_bytes: Dict[str, int] = {}
+    params = 0
+    data_end = 0
+    for name, info in header.items():
+        if not isinstance(info, dict):
+            raise ValueError(f"tensor {name!r} is not a JSON object")
+        begin, end = (int(offset) for offset in info["data_offsets"])
+        if not 0 <= begin <= end:
+            raise ValueError(f"tensor {name!r} has data_offsets {begin}..{end}")
+        dtype = str(info["dtype"])
+        dtype_bytes[dtype] = dtype_bytes.get(dtype, 0) + end - begin
+        if not isinstance(info["shape"], list):
+            raise TypeError(f"tensor {name!r} shape is not a list")
+        count = 1
+        for dim in info["shape"]:
+            count *= int(dim)
+        params += count
+        data_end = max(data_end, end)
+
+    found = {
+        "architecture": detect_architecture(list(header), metadata),
+        "dtype": max(dtype_bytes, key=dtype_bytes.get) if dtype_bytes else None,
+        "dtypes": {dtype: round(count / max(1, data_end), 3) for dtype, count in sorted(dtype_bytes.items())},
+        "params": params,
+        "tensors": len(header),
+        "fingerprint": fingerprint(path, length, size),
+    }
+    if "modelspec.title" in metadata:
+        found["title"] = str(metadata["modelspec.title"])
+    if size < 8 + length + data_end:
+        found["error"] = f"truncated: {size} of {8 + length + data_end} bytes"
+    return found
+
+
+class ModelCatalog:
+    """*.safetensors in root (plus extra paths) -> entries, scan cached in cache_path"""
+
+    def __init__(self, root: str, cache_path: Optional[str] = None, extra: Sequence[str] = ()):
+        self.root = root
+        self.cache_path = cache_path
+        self.extra = list(extra)
+        self.entries: List[dict] = []
+        self._cache: Optional[dict] = None  # read on the first scan - constructing touches no files
+
+        # Metrics
+        self.scans = 0
+        self.headers_read = 0
+        self.cache_hits = 0
+        self.last_scan_ms = 0.0
+
+    def _load_cache(self) -> dict:
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get("files", {}) if data.get("version") == CACHE_VERSION else {}
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        tmp = f"{self.cache_path}.tmp{os.getpid()}"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": CACHE_VERSION, "files": self._cache}, f, indent=1)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"⚠️ Model catalog cache not written: {e}")
+
+    def paths(self) -> List[str]:
+        found = []
+        if os.path.isdir(self.root):
+            with os.scandir(self.root) as listing:
+                found = [entry.path for entry in listing if entry.name.endswith(".safetensors") and entry.is_file()]
+        found += [path for path in self.extra if os.path.isfile(path)]
+        unique = {os.path.realpath(path): None for path in found}
+        return sorted(unique)
+
+    def scan(self) -> List[dict]:
+        """Every checkpoint, sorted by name - only new or changed files are read"""
+        start = time.perf_counter()
+        if self._cache is None:
+            self._cache = self._load_cache()
+        seen, changed = {}, False
+        for path in self.paths():
+            try:
+                stat = os.stat(path)
+                cached = self._cache.get(path)
+                if isinstance(cached, dict) and cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns and "entry" in cached:
+                    self.cache_hits += 1
+                    seen[path] = cached
+                    continue
+                self.headers_read += 1
+                entry = describe(path)
+            except OSError as e:
+                # Deleted or unreadable between listing and stat - skip it, the next scan retries
+                print(f"⚠️ Model catalog skipped {path}: {e}")
+                continue
+            seen[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "entry": entry}
+            changed = True
+        if changed or seen.keys() != self._cache.keys():
+            self._cache = seen
+            self._save_cache()
+        self.entries = sorted((cached["entry"] for cached in seen.values()), key=lambda entry: (entry["name"], entry["path"]))
+        self.scans += 1
+        self.last_scan_ms = round((time.perf_counter() - start) * 1000, 1)
+        return self.entries
+
+    def find(self, architecture: Optional[str] = None) -> List[dict]:
+        """Usable entries (no error), optionally of one architecture"""
+        return [entry for entry in self.entries if "error" not in entry and (architecture is None or entry["architecture"] == architecture)]
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "files": len(self.entries),
+            "scans": self.scans,
+            "headers_read": self.headers_read,
+            "cache_hits": self.cache_hits,
+            "last_scan_ms": self.last_scan_ms,
+        }
+
+
+# ============================================
+# SELF-CHECK + BENCHMARK
+# ============================================
+if __name__ == "__main__":
+    import tempfile
+
+    import torch
+    from safetensors.torch import save_file
+
+    def write(path: str, keys: Sequence[str], dtype=torch.float16, metadata: Optional[dict] = None):
+        save_file({key: torch.zeros(4, 4, dtype=dtype) for key in keys}, path, metadata=metadata)
+
+    def write_large(path: str, key: str, gigabytes: int):
+        """A multi-GB checkpoint as a sparse file: real header, tensor bytes never written"""
+        size = gigabytes * 1024 ** 3
+        header = json.dumps({key: {"dtype": "F16", "shape": [size // 2], "data_offsets": [0, size]}}).encode()
+        with open(path, "wb") as f:
+            f.write(struct.pack("<Q", len(header)) + header)
+            f.truncate(8 + len(header) + size)
+
+    sdxl = ["model.diffusion_model.label_emb.0.0.weight", "conditioner.embedders.0.transformer.text_model.x",
+            "conditioner.embedders.1.model.transformer.x", "first_stage_model.decoder.up.0.x"]
+    with tempfile.TemporaryDirectory() as root:
+        write(f"{root}/CyberRealistic Pony.safetensors", sdxl)
+        write(f"{root}/lustify.safetensors", sdxl, dtype=torch.bfloat16)
+        write(f"{root}/sd15.safetensors", ["model.diffusion_model.input_blocks.0.x", "cond_stage_model.transformer.text_model.x"], dtype=torch.float32)
+        write(f"{root}/refiner.safetensors", ["model.diffusion_model.label_emb.0.0.weight", "conditioner.embedders.0.model.transformer.x"])
+        write(f"{root}/sdxl_vae.safetensors", ["encoder.down.0.block.0.x", "decoder.up.0.block.0.x"])
+        write(f"{root}/detail_lora.safetensors", ["lora_unet_down_blocks_0.lora_down.weight"])
+        write(f"{root}/spec_only.safetensors", ["weights"], metadata={"modelspec.architecture": "stable-diffusion-xl-v1-base"})
+        with open(f"{root}/broken.safetensors", "wb") as f:
+            f.write(b"not a checkpoint")
+        for name, tensors in {"no_offsets": {"x": {"dtype": "F16", "shape": [4]}}, "not_entry": {"x": 5},
+                              "bad_shape": {"x": {"dtype": "F16", "shape": "4", "data_offsets": [0, 8]}}}.items():
+            header = json.dumps(tensors).encode()
+            with open(f"{root}/{name}.safetensors", "wb") as f:
+                f.write(struct.pack("<Q", len(header)) + header + bytes(8))
+        for index in range(24):
+            write_large(f"{root}/big_{index:02d}.safetensors", "model.diffusion_model.label_emb.0.0.weight", 6)
+
+        cache_path = f"{root}/.catalog.json"
+        catalog = ModelCatalog(root, cache_path)
+        start = time.perf_counter()
+        entries = {entry["name"]: entry for entry in catalog.scan()}
+        cold = time.perf_counter() - start
+        assert entries["cyberrealistic_pony"]["architecture"] == "sdxl" and entries["cyberrealistic_pony"]["dtype"] == "F16"
+        assert entries["lustify"]["dtype"] == "BF16" and entries["sd15"]["architecture"] == "sd1"
+        assert entries["refiner"]["architecture"] == "sdxl-refiner" and entries["sdxl_vae"]["architecture"] == "vae"
+        assert entries["detail_lora"]["architecture"] == "lora" and entries["spec_only"]["architecture"] == "sdxl"
+        for name in ("broken", "no_offsets", "not_entry", "bad_shape"):
+            assert entries[name]["architecture"] == "invalid" and "error" in entries[name], entries[name]
+        assert entries["big_00"]["size_gb"] == 6.0 and entries["big_00"]["params"] == 3 * 1024 ** 3
+        assert entries["cyberrealistic_pony"]["fingerprint"] != entries["lustify"]["fingerprint"]
+        names = [entry["name"] for entry in catalog.find("sdxl")]
+        assert names == sorted(names) and "broken" not in names
+        print(f"✅ {len(entries)} files classified from headers ({sum(e['size_bytes'] for e in entries.values()) / 1024 ** 3:.0f}GB on disk)")
+
+        # Restart: nothing unchanged is read again; a touched file is
+        restarted = ModelCatalog(root, cache_path)
+        start = time.perf_counter()
+        again = restarted.scan()
+        warm = time.perf_counter() - start
+        assert again == catalog.entries and restarted.headers_read == 0
+        os.utime(f"{root}/lustify.safetensors", ns=(time.time_ns(), time.time_ns() + 1))
+        restarted.scan()
+        assert restarted.headers_read == 1
+        os.remove(f"{root}/sd15.safetensors")
+        assert "sd15" not in {entry["name"] for entry in restarted.scan()}
+        print(f"✅ Scan cache: cold {cold * 1000:.1f} ms, restart {warm * 1000:.1f} ms ({restarted.stats()})")
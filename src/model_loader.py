@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Model Loader - pipelines loaded on a background thread after the server is up
+Loading SDXL takes from seconds (checkpoint cache) to minutes (first
+conversion). The API answers /live at once, /ready reports progress through
+the load stages with 503 until the pipelines are usable, and renders that
+arrive meanwhile wait in the GPU queue: the GPU thread blocks in wait() on
+the one load already running instead of starting a second.
+
+The load function receives step(name) and calls it as it enters each stage;
+progress is the share of the declared stages already finished.
+
+Self-check:  python model_loader.py
+"""
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Optional, Sequence
+
+
+class ModelLoader:
+    """load(step) run once on its own thread; state idle -> loading -> ready | failed"""
+
+    def __init__(self, load: Callable[[Callable[[str], None]], object], stages: Sequence[str] = ()):
+        self._load = load
+        self.stages = list(stages)
+        self.state = "idle"
+        self.stage: Optional[str] = None
+        self.error: Optional[str] = None
+        self.result = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.timings: Dict[str, float] = {}  # finished stage -> seconds
+        self.waiting = 0
+        self._stage_started = 0.0
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    # ---------- lifecycle ----------
+    def start(self) -> bool:
+        """Begin loading in the background - False if it already started"""
+        with self._lock:
+            if self.state != "idle":
+                return False
+            self.state = "loading"
+            self.started_at = time.time()
+        threading.Thread(target=self._run, name="model-loader", daemon=True).start()
+        return True
+
+    def _step(self, name: str):
+        now = time.time()
+        with self._lock:
+            self._close_stage(now)
+            self.stage, self._stage_started = name, now
+        print(f"⏳ Loading: {name}")
+
+    def _close_stage(self, now: float):
+        if self.stage is not None:
+            self.timings[self.stage] = round(now - self._stage_started, 2)
+
+    def _run(self):
+        try:
+            result = self._load(self._step)
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                self._close_stage(time.time())
+                self.state = "failed"
+                self.error = f"{type(e).__name__}: {e}"
+            print(f"❌ Model load failed: {self.error}")
+        else:
+            with self._lock:
+                self._close_stage(time.time())
+                self.stage = None
+                self.result = result
+                self.state = "ready"
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+
+    # ---------- callers ----------
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def failed(self) -> bool:
+        return self.state == "failed"
+
+    def wait(self, timeout: Optional[float] = None):
+        """The load result - starts loading if nothing has, then blocks until it finishes"""
+        self.start()
+        with self._lock:
+            self.waiting += 1
+        try:
+            if not self._done.wait(timeout):
+                raise TimeoutError(f"Model still loading after {timeout}s ({self.stage})")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if self.failed:
+            raise RuntimeError(f"Model failed to load: {self.error}")
+        return self.result
+
+    def progress(self) -> float:
+        if self.ready:
+            return 1.0
+        if not self.stages:
+            return 0.0
+        return round(sum(1 for stage in self.stages if stage in self.timings) / len(self.stages), 2)
+
+    def status(self) -> dict:
+        end = self.finished_at or time.time()
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "stage": self.stage,
+            "progress": self.progress(),
+            "elapsed_s": round(end - self.started_at, 1) if self.started_at else 0.0,
+            "stages": dict(self.timings),
+            "waiting": self.waiting,
+            "error": self.error,
+        }
+
+
+# ============================================
+# SELF-CHECK
+# ============================================
+if __name__ == "__main__":
+    release = threading.Event()
+    loads = []
+
+    def load(step):
+        loads.append(time.time())
+        step("weights")
+        time.sleep(0.05)
+        step("pipelines")
+        release.wait(5)
+        return "pipe"
+
+    loader = ModelLoader(load, stages=("weights", "pipelines"))
+    assert loader.status()["state"] == "idle" and loader.start() and not loader.start()
+
+    # Callers during warm-up wait on the same load
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(loader.wait())) for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    time.sleep(0.2)
+    status = loader.status()
+    assert status["state"] == "loading" and status["stage"] == "pipelines" and status["progress"] == 0.5, status
+    assert status["waiting"] == 3 and results == []
+    release.set()
+    for thread in waiters:
+        thread.join()
+    assert results == ["pipe"] * 3 and len(loads) == 1 and loader.ready and loader.progress() == 1.0
+    print(f"✅ One background load shared by all waiters ({loader.status()})")
+
+    # A failure is reported to every caller, not retried
+    def broken(step):
+        step("weights")
+        raise FileNotFoundError("/workspace/model.safetensors")
+
+    loader = ModelLoader(broken, stages=("weights",))
+    try:
+        loader.wait(timeout=5)
+        raise AssertionError("expected a failure")
+    except RuntimeError as e:
+        assert "FileNotFoundError" in str(e) and loader.failed and loader.status()["error"]
+    print("✅ Load failure surfaces as an error with its cause")
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Model Registry - several SDXL checkpoints behind one GPU
+Requests name a checkpoint; its pipelines live in one of three tiers:
+- gpu:  components on the device, ready to render
+- ram:  components in pinned CPU memory (fast, async copy back to the GPU)
+- disk: not loaded - the loader (checkpoint cache / from_single_file) runs again
+Both budgets are enforced least-recently-used first: acquiring a model moves
+the LRU models' components from the GPU to RAM, and RAM overflow drops whole
+models back to disk.
+
+Checkpoints are often merges that keep the base text encoders or VAE. Every
+component is fingerprinted by its weights on load; an identical one that is
+already resident is reused (both pipelines point at the same module), so it
+is stored, moved and budgeted once. Embedding and latent caches key by module,
+so shared text encoders also share cached prompt embeddings. Hashing ~6GB
+of weights is slow, so the hashes are kept in a JSON file per checkpoint
+(path, size, mtime) and a restart only hashes new or changed checkpoints.
+
+acquire() is called from the GPU thread only; moves happen between renders.
+Loads and moves hold their own lock: register(), models() and stats() (a
+snapshot published after every change) never wait behind a minutes-long load.
+
+Self-check with tiny pipelines:  python model_registry.py
+"""
+import gc
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import torch
+
+from result_cache import model_identity
+
+COMPONENTS = ("unet", "vae", "text_encoder", "text_encoder_2")
+
+
+class UnknownModelError(ValueError):
+    pass
+
+
+def module_bytes(module: torch.nn.Module) -> int:
+    return sum(tensor.numel() * tensor.element_size() for tensor in itertools.chain(module.parameters(), module.buffers()))
+
+
+def weights_hash(module: torch.nn.Module) -> str:
+    """Fingerprint of class, config and every tensor - equal hash = interchangeable module"""
+    digest = hashlib.blake2b(digest_size=16)
+    config = getattr(module, "config", None)
+    if config is not None:
+        config = config.to_dict() if hasattr(config, "to_dict") else dict(config)
+        # _name_or_path, _diffusers_version, ... say where it was loaded from, not what it is
+        config = {key: value for key, value in config.items() if not key.startswith("_")}
+    digest.update(json.dumps([type(module).__name__, config], sort_keys=True, default=str).encode())
+    for name, tensor in sorted(module.state_dict().items()):
+        tensor = tensor.detach().contiguous().cpu()
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+
+class Component:
+    """One resident module, possibly used by several models"""
+
+    def __init__(self, key: str, module: torch.nn.Module):
+        self.key = key
+        self.module = module
+        self.bytes = module_bytes(module)
+        self.tier = "ram"
+        self.users = set()
+
+
+class ModelEntry:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.pipes: Optional[tuple] = None
+        self.components: Dict[str, Component] = {}
+        self.last_used = 0
+        self.loads = 0
+        self.load_s = 0.0
+
+    @property
+    def tier(self) -> str:
+        if self.pipes is None:
+            return "disk"
+        return "gpu" if all(component.tier == "gpu" for component in self.components.values()) else "ram"
+
+
+class ModelRegistry:
+    """name -> checkpoint path; acquire(name) gives its pipelines on the device"""
+
+    def __init__(
+        self,
+        models: Dict[str, str],
+        loader: Callable[[str], tuple],
+        default: Optional[str] = None,
+        gpu_budget: int = 12 * 1024 ** 3,
+        ram_budget: int = 24 * 1024 ** 3,
+        device: str = "cuda",
+        pin_memory: Optional[bool] = None,
+        hash_path: Optional[str] = None,
+    ):
+        if not models:
+            raise ValueError("No models configured")
+        self._models = {name: ModelEntry(name, path) for name, path in models.items()}
+        self._loader = loader
+        self.default = default or next(iter(models))
+        if self.default not in self._models:
+            raise UnknownModelError(f"Default model '{self.default}' is not configured")
+        self.gpu_budget = gpu_budget
+        self.ram_budget = ram_budget
+        self.device = device
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._components: Dict[str, Component] = {}
+        self.hash_path = hash_path
+        self._hashes: Dict[str, Dict[str, str]] = self._load_hashes()  # checkpoint identity -> component -> weights hash
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()  # _models and the published snapshot - never held for long
+        self._moves = threading.RLock()  # loads and tier moves, one at a time
+        self.loading: Optional[str] = None
+
+        # Metrics
+        self.hits = 0
+        self.swaps = 0
+        self.loads = 0
+        self.offloads = 0
+        self.unloads = 0
+        self.reused = 0
+        self.reused_bytes = 0
+        self.hashed = 0
+        self.swap_s = 0.0
+        self._snapshot: dict = {}
+        self._publish()
+
+    # ---------- lookup ----------
+    @property
+    def names(self):
+        return list(self._models)
+
+    def resolve(self, name: Optional[str]) -> str:
+        """Request value -> configured name (None = default)"""
+        if name is None:
+            return self.default
+        if name not in self._models:
+            raise UnknownModelError(f"Unknown model '{name}' (one of: {', '.join(self._models)})")
+        return name
+
+    def models(self) -> Dict[str, str]:
+        """name -> checkpoint path"""
+        with self._lock:
+            return {name: entry.path for name, entry in self._models.items()}
+
+    def register(self, name: str, path: str) -> bool:
+        """Add a checkpoint (loaded on first acquire) - False if the name is taken"""
+        with self._lock:
+            if name in self._models:
+                return False
+            entry = self._models[name] = ModelEntry(name, path)
+            # On disk until acquired - added to the snapshot without touching the tiers
+            self._snapshot = {**self._snapshot, "models": {**self._snapshot["models"], name: self._entry_stats(entry)}}
+            return True
+
+    def path(self, name: Optional[str]) -> str:
+        return self._models[self.resolve(name)].path
+
+    def tier(self, name: str) -> str:
+        return self._snapshot["models"][self.resolve(name)]["tier"]
+
+    # ---------- acquire ----------
+    def acquire(self, name: Optional[str] = None) -> tuple:
+        """Pipelines of name with every component on the device - evicts LRU models to fit"""
+        with self._moves:
+            with self._lock:
+                entry = self._models[self.resolve(name)]
+            entry.last_used = next(self._clock)
+            tier = entry.tier
+            if tier == "gpu":
+                self.hits += 1
+                self._publish()
+                return entry.pipes
+            start = time.perf_counter()
+            if tier == "disk":
+                self.loading = entry.name
+                self._publish()
+                try:
+                    self._load(entry)
+                finally:
+                    self.loading = None
+            else:
+                self.swaps += 1
+            self._to_gpu(entry)
+            self._fit_ram(entry)
+            self.swap_s += time.perf_counter() - start
+            self._publish()
+            print(f"🔀 Model '{entry.name}' on {self.device} ({tier} -> gpu in {time.perf_counter() - start:.1f}s)")
+            return entry.pipes
+
+    def _load(self, entry: ModelEntry):
+        """disk -> ram, reusing resident components with the same weights"""
+        start = time.perf_counter()
+        pipes = self._loader(entry.path)
+        identity = model_identity(entry.path)
+        known = self._hashes.setdefault(identity, {})
+        missing = [name for name in COMPONENTS if name not in known]
+        for name in missing:
+            known[name] = weights_hash(getattr(pipes[0], name))
+            self.hashed += 1
+        if missing:
+            self._save_hashes(identity)
+        for name in COMPONENTS:
+            module = getattr(pipes[0], name)
+            key = known[name]
+            component = self._components.get(key)
+            if component is None:
+                component = self._components[key] = Component(key, module)
+                self._offload(component)
+            elif component.module is not module:
+                for pipe in pipes:
+                    if pipe is not None:
+                        setattr(pipe, name, component.module)
+                self.reused += 1
+                self.reused_bytes += component.bytes
+                print(f"♻️ Model '{entry.name}' reuses {name} ({component.bytes / 1024 ** 2:.0f}MB) of '{', '.join(sorted(component.users))}'")
+            component.users.add(entry.name)
+            entry.components[name] = component
+        entry.pipes = tuple(pipes)
+        entry.loads += 1
+        entry.load_s = round(time.perf_counter() - start, 2)
+        self.loads += 1
+
+    def _offload(self, component: Component):
+        """-> ram (pinned, so the copy back to the GPU is fast and async)"""
+        component.module.to("cpu")
+        if self.pin_memory:
+            for tensor in itertools.chain(component.module.parameters(), component.module.buffers()):
+                tensor.data = tensor.data.pin_memory()
+        component.tier = "ram"
+
+    def _to_gpu(self, entry: ModelEntry):
+        needed = {component.key: component for component in entry.components.values() if component.tier != "gpu"}
+        need = sum(component.bytes for component in needed.values())
+        while self._bytes("gpu") + need > self.gpu_budget:
+            victim = self._lru(lambda other: other is not entry and any(
+                component.tier == "gpu" and entry.name not in component.users for component in other.components.values()
+            ))
+            if victim is None:
+                print(f"⚠️ Model '{entry.name}' needs {need / 1024 ** 3:.1f}GB, over the GPU budget")
+                break
+            for component in victim.components.values():
+                if component.tier == "gpu" and entry.name not in component.users:
+                    self._offload(component)
+                    self.offloads += 1
+        for component in needed.values():
+            component.module.to(self.device, non_blocking=True)
+            component.tier = "gpu"
+        if needed and torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def _fit_ram(self, entry: ModelEntry):
+        freed = False
+        while self._bytes("ram") > self.ram_budget:
+            victim = self._lru(lambda other: other is not entry and other.pipes is not None and any(
+                component.tier == "ram" for component in other.components.values()
+            ))
+            if victim is None:
+                break
+            self._unload(victim)
+            freed = True
+        if freed:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def _unload(self, entry: ModelEntry):
+        """-> disk: drop the pipelines; components nobody else uses are freed"""
+        for component in entry.components.values():
+            component.users.discard(entry.name)
+            if not component.users:
+                del self._components[component.key]
+        entry.pipes = None
+        entry.components = {}
+        self.unloads += 1
+        print(f"💤 Model '{entry.name}' unloaded")
+
+    def _lru(self, eligible) -> Optional[ModelEntry]:
+        with self._lock:
+            entries = list(self._models.values())
+        candidates = [entry for entry in entries if eligible(entry)]
+        return min(candidates, key=lambda entry: entry.last_used) if candidates else None
+
+    def _bytes(self, tier: str) -> int:
+        return sum(component.bytes for component in self._components.values() if component.tier == tier)
+
+    # ---------- weight hashes ----------
+    def _load_hashes(self) -> Dict[str, Dict[str, str]]:
+        if not self.hash_path:
+            return {}
+        try:
+            with open(self.hash_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_hashes(self, identity: str):
+        """Persist the hashes - older versions of the same checkpoint file are dropped"""
+        if not self.hash_path:
+            return
+        source = identity.rsplit(":", 2)[0]
+        self._hashes = {key: value for key, value in self._hashes.items() if key == identity or key.rsplit(":", 2)[0] != source}
+        tmp = f"{self.hash_path}.tmp{os.getpid()}"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._hashes, f, indent=1)
+            os.replace(tmp, self.hash_path)
+        except OSError as e:
+            print(f"⚠️ Model weight hashes not written: {e}")
+
+    # ---------- metrics ----------
+    @staticmethod
+    def _entry_stats(entry: ModelEntry) -> dict:
+        return {"tier": entry.tier, "loads": entry.loads, "load_s": entry.load_s}
+
+    def _publish(self):
+        """Refresh the stats snapshot - called by whoever holds the move lock"""
+        with self._lock:
+            self._snapshot = {
+                "default": self.default,
+                "loading": self.loading,
+                "gpu_mb": round(self._bytes("gpu") / 1024 ** 2),
+                "gpu_budget_mb": round(self.gpu_budget / 1024 ** 2),
+                "ram_mb": round(self._bytes("ram") / 1024 ** 2),
+                "ram_budget_mb": round(self.ram_budget / 1024 ** 2),
+                "models": {entry.name: self._entry_stats(entry) for entry in self._models.values()},
+                "components": len(self._components),
+                "shared_components": sum(1 for component in self._components.values() if len(component.users) > 1),
+                "reused_mb": round(self.reused_bytes / 1024 ** 2),
+                "hits": self.hits,
+                "swaps": self.swaps,
+                "loads": self.loads,
+                "offloads": self.offloads,
+                "unloads": self.unloads,
+                "hashed": self.hashed,
+                "swap_s": round(self.swap_s, 2),
+            }
+
+    def stats(self) -> dict:
+        """Snapshot as of the last acquire or register - never waits for a load in progress"""
+        return self._snapshot
+
+
+# ============================================
+# SELF-CHECK (tiny pipelines on the CPU)
+# ============================================
+if __name__ == "__main__":
+    from tiny_sdxl import build_tiny_sdxl
+
+    def seeded(module: torch.nn.Module, seed: int) -> torch.nn.Module:
+        generator = torch.Generator().manual_seed(seed)
+        with torch.no_grad():
+            for parameter in module.parameters():
+                parameter.copy_(torch.randn(parameter.shape, generator=generator) * 0.02)
+        return module
+
+    # "a" and "b" are merges on the same base: identical text encoders + VAE, own UNet; "c" differs everywhere
+    recipes = {"a": (1, 0, 0), "b": (2, 0, 0), "c": (3, 3, 3)}
+    loaded = []
+
+    def loader(path: str):
+        loaded.append(path)
+        unet_seed, vae_seed, text_seed = recipes[path]
+        pipe, pipe_img2img = build_tiny_sdxl()
+        seeded(pipe.unet, unet_seed)
+        seeded(pipe.vae, vae_seed)
+        seeded(pipe.text_encoder, text_seed)
+        seeded(pipe.text_encoder_2, text_seed + 100)
+        return pipe, pipe_img2img
+
+    probe = loader("a")[0]
+    loaded.clear()
+    sizes = {name: module_bytes(getattr(probe, name)) for name in COMPONENTS}
+    one_model = sum(sizes.values())
+    shared = one_model - sizes["unet"]
+
+    import tempfile
+    hash_path = os.path.join(tempfile.mkdtemp(), "hashes.json")
+
+    # Room for one model + another UNet on the "GPU", a bit less than one model in RAM
+    registry = ModelRegistry({name: name for name in recipes}, loader, gpu_budget=one_model + sizes["unet"],
+                             ram_budget=one_model - 1, device="cpu", hash_path=hash_path)
+    pipe_a, _ = registry.acquire("a")
+    pipe_b, img2img_b = registry.acquire("b")
+    assert pipe_b.text_encoder is pipe_a.text_encoder and img2img_b.vae is pipe_a.vae and pipe_b.unet is not pipe_a.unet
+    assert registry.stats()["shared_components"] == 3 and registry.stats()["reused_mb"] == round(shared / 1024 ** 2)
+    assert registry.tier("a") == registry.tier("b") == "gpu", "shared parts are budgeted once - both fit"
+    assert registry.acquire("a")[0] is pipe_a and registry.hits == 1
+
+    # "c" needs a whole model of room: LRU "b" (and the parts it shares with "a") move to RAM,
+    # RAM overflow then drops "b" to disk - "a" keeps its UNet on the GPU and the shared parts in RAM
+    registry.acquire("c")
+    assert registry.tier("c") == "gpu" and registry.tier("a") == "ram" and registry.tier("b") == "disk", registry.stats()["models"]
+    assert registry.stats()["ram_mb"] <= registry.stats()["ram_budget_mb"]
+
+    # Back to "a": from RAM, no reload
+    registry.acquire("a")
+    assert registry.tier("a") == "gpu" and loaded == ["a", "b", "c"]
+    registry.acquire("b")
+    assert loaded == ["a", "b", "c", "b"], "weights were hashed once per checkpoint, the load itself repeats"
+
+    try:
+        registry.acquire("nope")
+        raise AssertionError("expected UnknownModelError")
+    except UnknownModelError:
+        pass
+    print(f"✅ Registry swaps tiers under budget and shares identical components ({registry.stats()})")
+
+    # A restart hashes nothing: the weight hashes come from hash_path
+    assert registry.hashed == 12
+    restarted = ModelRegistry({"a": "a", "b": "b"}, loader, device="cpu", hash_path=hash_path)
+    restarted.acquire("a")
+    restarted.acquire("b")
+    assert restarted.hashed == 0 and restarted.stats()["shared_components"] == 3, restarted.stats()
+    print("✅ Weight hashes persist across restarts")
+
+    # A slow load only holds the move lock: stats() and register() answer meanwhile
+    release, entered = threading.Event(), threading.Event()
+
+    def slow_loader(path: str):
+        entered.set()
+        release.wait(10)
+        return loader("c")
+
+    slow = ModelRegistry({"c": "c"}, slow_loader, device="cpu")
+    worker = threading.Thread(target=slow.acquire, args=("c",))
+    worker.start()
+    entered.wait(5)
+    start = time.perf_counter()
+    assert slow.stats()["loading"] == "c" and slow.register("d", "d") and slow.tier("d") == "disk"
+    assert time.perf_counter() - start < 1, "stats()/register() waited for the load"
+    release.set()
+    worker.join()
+    assert slow.tier("c") == "gpu" and slow.stats()["loading"] is None and "d" in slow.stats()["models"]
+    print("✅ stats() and register() do not wait for a load in progress")
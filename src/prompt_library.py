@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Prompt Library - PROMPTS templates and slot values, pre-tokenized
+SDXL's CLIP encoders keep 77 tokens (BOS + 75 + EOS) and most PROMPTS entries
+are well over 1,000, yet the pipeline tokenized every multi-kilobyte prompt
+twice per encoder on every request. At model load every template's literal
+parts and the known slot values (occupation settings, attribute phrases, ages)
+are tokenized once with both tokenizers and kept as uint16 arrays. A request
+then concatenates ids until the 75-token budget is full - the text past the
+cut-off is never looked at.
+
+Joining pre-tokenized pieces gives the same ids as tokenizing the joined text
+as long as no CLIP pre-token spans a join (letters/punctuation on both sides,
+an apostrophe contraction or a combining mark). Those rare joins fall back to
+tokenizing the rendered prompt.
+
+Self-check on CPU:  python prompt_library.py
+"""
+import threading
+import unicodedata
+import weakref
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from prompt_templates import PromptTemplate
+
+
+def joins(left: str, right: str) -> bool:
+    """Could the CLIP pre-tokenizer put the last char of left and the first of right in one pre-token?"""
+    if not left or not right:
+        return False
+    a, b = left[-1], right[0]
+    if a.isspace() or b.isspace():
+        return False
+    if unicodedata.combining(b):
+        return True
+    if a.isalpha() and b.isalpha():
+        return True
+    if a == "'" and b.isalpha():
+        return True  # 's 't 're 've 'm 'll 'd
+    return not a.isalnum() and not b.isalnum()  # one [^\s\p{L}\p{N}]+ run
+
+
+class TokenizedPrompt:
+    """Padded input ids per tokenizer (what the text encoders get) + the untruncated length"""
+
+    __slots__ = ("ids", "length", "max_tokens")
+
+    def __init__(self, ids: Tuple[List[int], ...], length: int, max_tokens: int):
+        self.ids = ids
+        self.length = length
+        self.max_tokens = max_tokens
+
+    @property
+    def truncated(self) -> bool:
+        return self.length > self.max_tokens
+
+    @property
+    def dropped(self) -> int:
+        return max(0, self.length - self.max_tokens)
+
+
+class PromptLibrary:
+    """Token ids for PromptTemplates and slot values, per tokenizer (SDXL: tokenizer, tokenizer_2)"""
+
+    def __init__(self, tokenizers: Sequence, templates: Iterable[PromptTemplate] = (), fragments: Iterable[str] = (), max_fragments: int = 4096):
+        self.tokenizers = list(tokenizers)
+        first = self.tokenizers[0]
+        self.max_tokens = first.model_max_length - 2  # BOS + EOS
+        self.typecode = "H" if max(len(tokenizer) for tokenizer in self.tokenizers) <= 0xFFFF else "I"
+        self._specials = [(t.bos_token_id, t.eos_token_id, t.pad_token_id, t.model_max_length) for t in self.tokenizers]
+
+        self._templates: "weakref.WeakKeyDictionary[PromptTemplate, list]" = weakref.WeakKeyDictionary()
+        self._fragments: Dict[str, Tuple[array, ...]] = {}
+        self.max_fragments = max_fragments
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.assembled = 0
+        self.fallbacks = 0
+        self.truncated = 0
+
+        for template in templates:
+            self.template_ids(template)
+        for text in fragments:
+            self.fragment_ids(text)
+        self._static_fragments = len(self._fragments)
+
+    # ---------- tokenization (startup, or first sight of a new value) ----------
+    def tokenize(self, text: str) -> Tuple[array, ...]:
+        return tuple(array(self.typecode, tokenizer(text, add_special_tokens=False).input_ids) for tokenizer in self.tokenizers)
+
+    def template_ids(self, template: PromptTemplate) -> list:
+        """Literal parts of a template as token ids (slots stay as names)"""
+        parts = self._templates.get(template)
+        if parts is None:
+            parts = [
+                self.tokenize(part) if i % 2 == 0 else part
+                for i, part in enumerate(template.parts)
+            ]
+            with self._lock:
+                self._templates[template] = parts
+        return parts
+
+    def fragment_ids(self, text: str) -> Tuple[array, ...]:
+        ids = self._fragments.get(text)
+        if ids is None:
+            ids = self.tokenize(text)
+            with self._lock:
+                if len(self._fragments) < self.max_fragments:
+                    self._fragments[text] = ids
+        return ids
+
+    # ---------- request path ----------
+    def assemble(self, template: PromptTemplate, values: Dict[str, str]) -> TokenizedPrompt:
+        """Input ids for template.render(values) from pre-tokenized pieces, cut at the encoder's limit"""
+        parts = self.template_ids(template)
+        texts = template.parts
+        pieces: List[Tuple[array, ...]] = []
+        previous = ""
+        for i, part in enumerate(parts):
+            text = texts[i] if i % 2 == 0 else values[part]
+            if not text:
+                continue
+            if joins(previous, text):
+                self.fallbacks += 1
+                return self.encode_text(template.render(values))
+            pieces.append(part if i % 2 == 0 else self.fragment_ids(text))
+            previous = text
+
+        length = sum(len(piece[0]) for piece in pieces)
+        ids = []
+        for k, (bos, eos, pad, max_length) in enumerate(self._specials):
+            row = [bos]
+            for piece in pieces:
+                need = self.max_tokens - (len(row) - 1)
+                if need <= 0:
+                    break
+                row.extend(piece[k][:need])
+            row.append(eos)
+            row.extend([pad] * (max_length - len(row)))
+            ids.append(row)
+
+        self.assembled += 1
+        if length > self.max_tokens:
+            self.truncated += 1
+        return TokenizedPrompt(tuple(ids), length, self.max_tokens)
+
+    def encode_text(self, text: str) -> TokenizedPrompt:
+        """Plain tokenization of a whole prompt (fallback path)"""
+        ids = []
+        length = 0
+        for k, tokenizer in enumerate(self.tokenizers):
+            full = tokenizer(text, add_special_tokens=False).input_ids
+            bos, eos, pad, max_length = self._specials[k]
+            row = [bos, *full[:self.max_tokens], eos]
+            row.extend([pad] * (max_length - len(row)))
+            ids.append(row)
+            if k == 0:
+                length = len(full)
+        return TokenizedPrompt(tuple(ids), length, self.max_tokens)
+
+    # ---------- reporting ----------
+    def prompt_info(self, prompt: str, context: int = 6) -> dict:
+        """Token count of a library prompt and where CLIP cuts it off"""
+        tokenizer = self.tokenizers[0]
+        ids = tokenizer(prompt, add_special_tokens=False).input_ids
+        kept = ids[:self.max_tokens]
+        return {
+            "tokens": len(ids),
+            "kept": len(kept),
+            "dropped": len(ids) - len(kept),
+            # The last few words the encoder still sees - everything after them is ignored
+            "cut_after": tokenizer.decode(kept[-context:]).strip() if len(ids) > self.max_tokens else None,
+        }
+
+    def stats(self) -> dict:
+        template_bytes = sum(
+            piece.itemsize * len(piece)
+            for parts in self._templates.values()
+            for i, part in enumerate(parts) if i % 2 == 0
+            for piece in part
+        )
+        return {
+            "templates": len(self._templates),
+            "fragments": len(self._fragments),
+            "ids_kb": round(template_bytes / 1024, 1),
+            "max_tokens": self.max_tokens,
+            "assembled": self.assembled,
+            "truncated": self.truncated,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# ============================================
+# SELF-CHECK + BENCHMARK (CPU, tiny SDXL tokenizers)
+# ============================================
+if __name__ == "__main__":
+    import itertools
+    import sys
+    import time
+
+    import torch
+
+    from tiny_sdxl import build_tiny_sdxl
+    from embedding_cache import encode_token_ids
+    import fastapicyber as fc
+
+    pipe, _ = build_tiny_sdxl()
+    tokenizers = (pipe.tokenizer, pipe.tokenizer_2)
+    library = PromptLibrary(tokenizers, fc.prompt_templates.templates(), fc.prompt_fragments())
+    print(f"🧪 {library.stats()}")
+
+    def reference(text: str) -> Tuple[List[int], ...]:
+        return tuple(
+            tokenizer(text, padding="max_length", max_length=tokenizer.model_max_length, truncation=True).input_ids
+            for tokenizer in tokenizers
+        )
+
+    # Every pose x occupation, with each attribute value in turn
+    characters = [fc.CharacterData(name="check", age=age, gender="female", description=description, hairStyle=style, eyeColor=eyes, ethnicity=ethnicity)
+                  for age, description, style, eyes, ethnicity in [
+                      (23, "blonde", None, None, None), (31, "brunette", "ponytail", "Green", "Latina"), (45, "red hair", "Long wavy", "hazel", "Black"),
+                      (19, "", "bun", "grey-blue", "Asian"), (27, "black hair", "pixie's cut", "Amber", None),
+                  ]]
+    checked, mismatches = 0, 0
+    for (pose, base), occupation, character in itertools.product(fc.PROMPTS.items(), fc.OCCUPATION_SETTINGS, characters):
+        template, values = fc.resolve_prompt(character, base, occupation)
+        assembled = library.assemble(template, values)
+        checked += 1
+        if assembled.ids != reference(template.render(values)):
+            mismatches += 1
+            if mismatches == 1:
+                print(f"❌ {pose} / {occupation}: assembled ids differ from the tokenizer")
+    if mismatches:
+        print(f"❌ {mismatches} of {checked} prompts differ")
+        sys.exit(1)
+    print(f"✅ {checked} assembled prompts match the tokenizer ({library.fallbacks} fell back to full tokenization)")
+
+    # Encoding from ids == the pipeline's own encode_prompt
+    template, values = fc.resolve_prompt(characters[1], fc.PROMPTS["doggy_style"], "Doctor")
+    text = template.render(values)
+    tokens = library.assemble(template, values)
+    for clip_skip in (None, 2):
+        expected, _, pooled, _ = pipe.encode_prompt(text, device="cpu", do_classifier_free_guidance=False, clip_skip=clip_skip)
+        embeds, pooled_ids = encode_token_ids(pipe, [tokens], clip_skip)
+        assert torch.equal(expected, embeds) and torch.equal(pooled, pooled_ids), f"clip_skip={clip_skip}: embeddings differ"
+    print(f"✅ Embeddings from assembled ids match encode_prompt ({tokens.length} tokens, {tokens.dropped} dropped)")
+
+    # Per-request cost: assembling vs what encode_prompt tokenizes (padded + untruncated, per tokenizer)
+    rounds = 200
+    work = [fc.resolve_prompt(characters[1], base, "Doctor") for base in fc.PROMPTS.values()]
+    start = time.perf_counter()
+    for _ in range(rounds // 10):
+        for template, values in work:
+            text = template.render(values)
+            for tokenizer in tokenizers:
+                tokenizer(text, padding="max_length", max_length=77, truncation=True)
+                tokenizer(text, padding="longest")
+    before = (time.perf_counter() - start) / (rounds // 10 * len(work))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for template, values in work:
+            library.assemble(template, values)
+    after = (time.perf_counter() - start) / (rounds * len(work))
+    print(f"   tokenize: {before * 1e6:8.1f} µs/prompt")
+    print(f"   assemble: {after * 1e6:8.1f} µs/prompt")
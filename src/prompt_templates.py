@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Prompt Templates - PROMPTS entries pre-parsed into slots
+build_custom_prompt used to run ~20 IGNORECASE re.sub calls over each
+multi-kilobyte prompt on every request. The rewrite rules only depend on the
+base prompt, so each prompt is compiled once: the rules run with slot markers
+in place of the character's values, and the result is split into literal text
+and named slots (age, hair, eyes, breasts, butt, ass, skin, setting). A request
+then fills the slots in one "".join.
+
+Slot values are inserted as plain text. The old cascade re-matched hair values
+it had already inserted ("blonde hair in ponytail" came out as "blonde hair in
+ponytail in ponytail", "red long wavy hair" as "red red long wavy hair") and
+read backslashes in values as group references - templates replace each phrase
+of the base prompt exactly once.
+"""
+import re
+from typing import Dict, List, Tuple
+
+MARK = "\x00"
+
+
+def slot(name: str) -> str:
+    return f"{MARK}{name}{MARK}"
+
+
+# (pattern, replacement) in the order the cascade applied them - replacements use slot markers
+RULES: List[Tuple["re.Pattern", str]] = [
+    # Age (e.g. "24 years old" -> "21 years old")
+    (re.compile(r'\b\d{2}\s+years old\b'), slot("age")),
+    # Hair - the long specific phrases first, then the generic ones
+    *[
+        (re.compile(pattern, re.IGNORECASE), slot("hair"))
+        for pattern in (
+            r'long blonde hair in high ponytail whipping around, hair flowing with motion',
+            r'long blonde hair in high ponytail swaying with motion',
+            r'long blonde hair in ponytail cascading down back swaying with motion',
+            r'long blonde hair in high ponytail',
+            r'long flowing blonde hair fanned out on pillow',
+            r'long blonde hair spread out',
+            r'blonde hair in ponytail or loose flowing',
+            r'long [\w\s]+ hair',
+            r'blonde hair',
+        )
+    ],
+    (re.compile(r'(?:piercing |bright |gorgeous )?(?:blue|brown|green|hazel|amber) eyes', re.IGNORECASE), slot("eyes")),
+    (re.compile(r'(?:small|medium|large|extremely large)(?: perky)?(?: natural)? breasts', re.IGNORECASE), slot("breasts")),
+    (re.compile(r'(?:small firm|round|round firm|round bubble|large round|huge bubble) butt', re.IGNORECASE), slot("butt")),
+    (re.compile(r'(?:round|large round) ass', re.IGNORECASE), slot("ass")),
+    # Skin
+    *[
+        (re.compile(pattern, re.IGNORECASE), slot("skin"))
+        for pattern in (
+            r'flawless smooth tan skin',
+            r'smooth tan skin',
+            r'smooth fair skin',
+            r'smooth dark skin',
+            r'(?:smooth |realistic |flawless )?(?:tan|fair|dark) skin',
+        )
+    ],
+    # Bedroom settings -> occupation setting
+    (re.compile(r'luxury master bedroom setting.*?full body shot composition', re.IGNORECASE),
+     slot("setting") + ", full body shot composition"),
+    (re.compile(r'bedroom setting, rumpled sheets, warm lighting', re.IGNORECASE), slot("setting")),
+    (re.compile(r'luxury bedroom, silk sheets underneath, soft romantic lighting, golden glow, intimate atmosphere', re.IGNORECASE),
+     slot("setting") + ", intimate atmosphere"),
+]
+
+
+class PromptTemplate:
+    """A base prompt split into literal text (even indexes) and slot names (odd indexes)"""
+
+    def __init__(self, base_prompt: str):
+        text = base_prompt
+        for pattern, replacement in RULES:
+            # Markers are not [\w\s], so later rules can never match across a slot
+            text = pattern.sub(replacement.replace("\\", "\\\\"), text)
+        self.parts = text.split(MARK)
+        self.slots = frozenset(self.parts[1::2])
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = self.parts[:]
+        parts[1::2] = [values[name] for name in parts[1::2]]
+        return "".join(parts)
+
+
+def slot_values(features: dict, occ_setting: dict) -> Dict[str, str]:
+    """Character features + occupation setting -> text for every slot"""
+    return {
+        "age": f"{features['age']} years old",
+        "hair": features['hair'],
+        "eyes": features['eyes'],
+        "breasts": features['breasts'],
+        "butt": features['butt'],
+        "ass": features['butt'].replace('butt', 'ass'),
+        "skin": features['skin'],
+        "setting": f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}",
+    }
+
+
+class TemplateCache:
+    """base prompt -> PromptTemplate; PROMPTS are compiled up front, fallback poses on first use"""
+
+    def __init__(self, prompts: Dict[str, str], max_dynamic: int = 256):
+        self._templates: Dict[str, PromptTemplate] = {text: PromptTemplate(text) for text in prompts.values()}
+        self._static = len(self._templates)
+        self.max_dynamic = max_dynamic
+
+    def get(self, base_prompt: str) -> PromptTemplate:
+        template = self._templates.get(base_prompt)
+        if template is None:
+            template = PromptTemplate(base_prompt)
+            if len(self._templates) - self._static < self.max_dynamic:
+                self._templates[base_prompt] = template
+        return template
+
+    def templates(self) -> List[PromptTemplate]:
+        return list(self._templates.values())
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+# ============================================
+# SELF-CHECK + BENCHMARK
+# ============================================
+if __name__ == "__main__":
+    import itertools
+    import sys
+    import time
+    from multiprocessing import Pool
+
+    from fastapicyber import PROMPTS, OCCUPATION_SETTINGS, CharacterData, parse_character_features
+
+    def legacy_custom_prompt(base_prompt: str, features: dict, occ_setting: dict) -> str:
+        """The rewrite part of build_custom_prompt before templates, verbatim"""
+        custom_prompt = base_prompt
+
+        # Replace age (e.g., "24 years old" -> "21 years old")
+        custom_prompt = re.sub(r'\b\d{2}\s+years old\b', f"{features['age']} years old", custom_prompt)
+
+        # Replace hair (more comprehensive patterns)
+        # Match patterns like "long blonde hair in high ponytail", "blonde hair", etc.
+        hair_patterns = [
+            r'long blonde hair in high ponytail whipping around, hair flowing with motion',
+            r'long blonde hair in high ponytail swaying with motion',
+            r'long blonde hair in ponytail cascading down back swaying with motion',
+            r'long blonde hair in high ponytail',
+            r'long flowing blonde hair fanned out on pillow',
+            r'long blonde hair spread out',
+            r'blonde hair in ponytail or loose flowing',
+            r'long [\w\s]+ hair',
+            r'blonde hair',
+        ]
+        for pattern in hair_patterns:
+            custom_prompt = re.sub(pattern, features['hair'], custom_prompt, flags=re.IGNORECASE)
+
+        # Replace eyes
+        custom_prompt = re.sub(r'(?:piercing |bright |gorgeous )?(?:blue|brown|green|hazel|amber) eyes', features['eyes'], custom_prompt, flags=re.IGNORECASE)
+
+        # Replace breasts
+        custom_prompt = re.sub(r'(?:small|medium|large|extremely large)(?: perky)?(?: natural)? breasts', features['breasts'], custom_prompt, flags=re.IGNORECASE)
+
+        # Replace butt
+        custom_prompt = re.sub(r'(?:small firm|round|round firm|round bubble|large round|huge bubble) butt', features['butt'], custom_prompt, flags=re.IGNORECASE)
+        custom_prompt = re.sub(r'(?:round|large round) ass', features['butt'].replace('butt', 'ass'), custom_prompt, flags=re.IGNORECASE)
+
+        # Replace skin (more comprehensive)
+        skin_patterns = [
+            r'flawless smooth tan skin',
+            r'smooth tan skin',
+            r'smooth fair skin',
+            r'smooth dark skin',
+            r'(?:smooth |realistic |flawless )?(?:tan|fair|dark) skin',
+        ]
+        for pattern in skin_patterns:
+            custom_prompt = re.sub(pattern, features['skin'], custom_prompt, flags=re.IGNORECASE)
+
+        # Replace setting with occupation
+        custom_prompt = re.sub(r'luxury master bedroom setting.*?full body shot composition',
+                              f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}, full body shot composition",
+                              custom_prompt, flags=re.IGNORECASE)
+
+        # Also handle other bedroom variations
+        custom_prompt = re.sub(r'bedroom setting, rumpled sheets, warm lighting',
+                              f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}",
+                              custom_prompt, flags=re.IGNORECASE)
+        custom_prompt = re.sub(r'luxury bedroom, silk sheets underneath, soft romantic lighting, golden glow, intimate atmosphere',
+                              f"{occ_setting['background']}, {occ_setting['props']}, {occ_setting['lighting']}, intimate atmosphere",
+                              custom_prompt, flags=re.IGNORECASE)
+        return custom_prompt
+
+    def rematched(hair: str) -> str:
+        """What the cascade's two generic hair rules made of a hair value an earlier hair rule had inserted"""
+        text = hair
+        for pattern in (r'long [\w\s]+ hair', r'blonde hair'):
+            text = re.sub(pattern, hair, text, flags=re.IGNORECASE)
+        return text
+
+    # Attribute values the frontend sends, plus the defaults (None)
+    ATTRIBUTES = {
+        "description": ["", "blonde", "brunette", "red hair", "black hair", "brown hair", "white hair"],
+        "hairStyle": [None, "ponytail", "bun", "braided", "straight", "curly", "short", "Long wavy"],
+        "eyeColor": [None, "Blue", "Brown", "Green", "Hazel", "Amber", "Grey"],
+        "breastSize": [None, "Small", "Medium", "Large", "Extra-Large"],
+        "buttSize": [None, "Small", "Medium", "Large", "Extra-Large"],
+        "ethnicity": [None, "White", "Black", "Asian", "Latina", "Arab", "Indian"],
+    }
+    bases = dict(PROMPTS)
+    # A pose that is not in PROMPTS - prepare_generation builds it from "standing"
+    bases["bent_over_desk"] = PROMPTS["standing"].replace("standing", "bent over desk").replace("Standing", "Bent Over Desk")
+
+    def features_of(combo) -> dict:
+        return parse_character_features(CharacterData(name="check", age=23, gender="female", **dict(zip(ATTRIBUTES, combo))))
+
+    # Every combination of attributes, deduplicated on the features they produce
+    products = {}
+    for combo in itertools.product(*ATTRIBUTES.values()):
+        feature = features_of(combo)
+        products.setdefault(tuple(sorted(feature.items())), feature)
+    # The setting slot is filled by the last three rules only: every occupation, with each attribute value
+    singles = {}
+    for attribute, values in ATTRIBUTES.items():
+        for value in values:
+            feature = features_of([value if name == attribute else ATTRIBUTES[name][0] for name in ATTRIBUTES])
+            singles.setdefault(tuple(sorted(feature.items())), feature)
+
+    cache = TemplateCache(PROMPTS)
+
+    def check_pose(pose: str):
+        """(renders, {(hair, pose): count} re-matched, [unexplained]) for one pose"""
+        base = bases[pose]
+        template = cache.get(base)
+        cases = [(feature, "None") for feature in products.values()]
+        cases += [(feature, occupation) for feature in singles.values() for occupation in OCCUPATION_SETTINGS]
+        renders, rewritten, unexplained = 0, {}, []
+        for feature, occupation in cases:
+            occ_setting = OCCUPATION_SETTINGS[occupation]
+            old = legacy_custom_prompt(base, feature, occ_setting)
+            new = template.render(slot_values(feature, occ_setting))
+            renders += 1
+            if old == new:
+                continue
+            # The hair value may be in the prompt more than once, and only the copies an earlier rule inserted were re-matched
+            pieces = new.split(feature["hair"])
+            if any(
+                old == pieces[0] + "".join(hair + piece for hair, piece in zip(choice, pieces[1:]))
+                for choice in itertools.product((feature["hair"], rematched(feature["hair"])), repeat=len(pieces) - 1)
+            ):
+                key = (feature["hair"], pose)
+                rewritten[key] = rewritten.get(key, 0) + 1
+            else:
+                unexplained.append((pose, occupation, feature))
+        return renders, rewritten, unexplained
+
+    start = time.perf_counter()
+    with Pool() as pool:
+        results = pool.map(check_pose, bases)
+    checked = sum(renders for renders, _, _ in results)
+    rewritten = {key: count for _, found, _ in results for key, count in found.items()}
+    mismatches = [case for _, _, unexplained in results for case in unexplained]
+
+    print(f"🧪 {checked} renders against the old cascade in {time.perf_counter() - start:.0f}s: {len(bases)} poses x "
+          f"({len(products)} attribute products + {len(singles)} single attributes x {len(OCCUPATION_SETTINGS)} occupations)")
+    print(f"   identical: {checked - sum(rewritten.values()) - len(mismatches)}, "
+          f"cascade re-matched its own hair value: {sum(rewritten.values())}")
+    for hair in sorted({hair for hair, _ in rewritten}):
+        poses = sorted(pose for value, pose in rewritten if value == hair)
+        print(f"   {hair!r} -> {rematched(hair)!r} in {len(poses)} poses: {', '.join(poses)}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} unexplained mismatches, e.g. {mismatches[0]}")
+        sys.exit(1)
+    print("✅ Templates match the old cascade, except where it re-matched its own hair value")
+
+    # Benchmark: one render per pose with a typical character
+    feature = parse_character_features(CharacterData(
+        name="bench", age=23, gender="female", description="brunette", hairStyle="ponytail", eyeColor="green",
+        breastSize="Medium", buttSize="Large", ethnicity="Latina",
+    ))
+    occ_setting = OCCUPATION_SETTINGS["None"]
+    rounds = 20
+    for label, fn in (
+        ("regex cascade", lambda base: legacy_custom_prompt(base, feature, occ_setting)),
+        ("template", lambda base: cache.get(base).render(slot_values(feature, occ_setting))),
+    ):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for base in bases.values():
+                fn(base)
+        per = (time.perf_counter() - start) / (rounds * len(bases))
+        print(f"   {label:>13}: {per * 1e6:8.1f} µs/prompt")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Result Cache - content-addressed PNGs on local disk
+A seeded generation is deterministic for a given model, final prompt, negative
+prompt, preset and flags, so its PNG can be served again without the GPU.
+Entries are keyed by a hash of those inputs plus the model file identity.
+
+Safe across uvicorn workers sharing one directory:
+- writes go to a temp file and are os.replace()d into place, so readers see
+  a whole entry or none
+- hits bump the file mtime, which is the LRU clock for every process
+- eviction runs under an flock, so only one process scans and deletes at a time
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+
+def model_identity(path: str) -> str:
+    """Cheap identity for a checkpoint file: path, size and mtime (no 6GB hash)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ResultCache:
+    """Disk-backed LRU of encoded results, bounded by total bytes"""
+
+    def __init__(self, root: str, max_bytes: int = 5 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock_path = os.path.join(root, ".evict.lock")
+        self._lock = threading.Lock()
+        self._approx_bytes = self._scan()[0]
+
+        # Metrics (this process)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.bytes_saved = 0
+        self.gpu_s_saved = 0.0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".bin")
+
+    # ---------- entries: one JSON header line + PNG bytes ----------
+    def get(self, key: str) -> Optional[Tuple[bytes, dict]]:
+        """(png, meta) or None - blocking file I/O, call it off the event loop"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                png = f.read()
+            os.utime(path)  # LRU touch, visible to every process
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        if len(png) != header.get("size"):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(png)
+            self.gpu_s_saved += header.get("gpu_s", 0.0)
+        return png, header["meta"]
+
+    def put(self, key: str, png: bytes, meta: dict, gpu_s: float = 0.0):
+        """Store an entry atomically, then evict if the cache looks over budget"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps({"size": len(png), "gpu_s": gpu_s, "meta": meta, "created_at": time.time()})
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.encode() + b"\n")
+                f.write(png)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            self._approx_bytes += len(png) + len(header) + 1
+            over = self._approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    # ---------- eviction ----------
+    def _scan(self):
+        """(total bytes, [(mtime, size, path)]) for every entry on disk"""
+        total, entries = 0, []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # evicted by another process mid-scan
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return total, entries
+
+    def evict(self):
+        """Delete least recently used entries until under max_bytes (one process at a time)"""
+        with open(self._lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another worker is already evicting
+
+            total, entries = self._scan()
+            evicted = 0
+            # Go down to 90% so every put doesn't trigger a full scan
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+
+        with self._lock:
+            self._approx_bytes = total
+            self.evicted += evicted
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "pid": os.getpid(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "writes": self.writes,
+            "evicted": self.evicted,
+            "bytes_saved": self.bytes_saved,
+            "gpu_s_saved": round(self.gpu_s_saved, 1),
+            "approx_mb": round(self._approx_bytes / 1024 / 1024, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+        }
@@ -9,10 +9,15 @@ const logger = require('../utils/logger');
  * Generate character image using AI API
  * @param {Object} characterData - Character data
  * @param {Object} pose - Selected pose with prompt
+ * @param {Object|string|null} occupation - Occupation object or name
+ * @param {Object} options - Scheduling options
+ * @param {string} options.priority - 'interactive' (default) or 'bulk'
  * @returns {Promise<string>} - Image file path
  */
-const generateCharacterImage = async (characterData, pose, occupation = null) => {
+const generateCharacterImage = async (characterData, pose, occupation = null, options = {}) => {
     try {
+        const priority = options.priority || 'interactive';
+        const requestTimeoutMs = 120000; // 2 minutes timeout
         const apiUrl = process.env.AI_GENERATION_API_URL || 'https://vtlt473h3x21jp-8000.proxy.runpod.net/generate';
         const quality = process.env.AI_GENERATION_QUALITY || 'hq';
 
@@ -76,7 +81,9 @@ const generateCharacterImage = async (characterData, pose, occupation = null) =>
             quality: mappedQuality,  // Use mapped quality value
             seed: null,  // Let Python generate random seed
             use_highres: true,  // Enable Highres Fix
-            enhance: true  // Enable post-processing enhancement
+            enhance: true,  // Enable post-processing enhancement
+            priority,  // Interactive work is rendered before bulk jobs
+            deadline_s: (requestTimeoutMs - 5000) / 1000  // Python drops the job if we'd have timed out anyway
         };
 
         // Log full character details before sending
@@ -99,6 +106,7 @@ const generateCharacterImage = async (characterData, pose, occupation = null) =>
         logger.info(`   Quality: ${mappedQuality}`);
         logger.info(`   Highres: ${requestPayload.use_highres}`);
         logger.info(`   Enhance: ${requestPayload.enhance}`);
+        logger.info(`   Priority: ${priority}`);
         logger.info(`\n📤 Request Payload:`);
         logger.info(JSON.stringify(requestPayload, null, 2));
         logger.info(`${'='.repeat(70)}\n`);
@@ -110,7 +118,7 @@ const generateCharacterImage = async (characterData, pose, occupation = null) =>
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                timeout: 120000 // 2 minutes timeout
+                timeout: requestTimeoutMs
             });
         } catch (axiosError) {
             logger.error('❌ Axios request failed:', {
@@ -310,7 +318,7 @@ const saveBase64Image = async (base64Image, displayId, characterName, characterI
 const generateMultipleImages = async (characterData, poses, count = 3) => {
     try {
         const imagePromises = poses.slice(0, count).map(pose =>
-            generateCharacterImage(characterData, pose)
+            generateCharacterImage(characterData, pose, null, { priority: 'bulk' })
         );
 
         const results = await Promise.allSettled(imagePromises);
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Stage Meter - busy time per generation stage
+A request goes through prompt build -> text encode -> denoise -> decode on the
+GPU thread, then post-process -> encode on the CPU pool. The meter records how
+long each stage is busy, and how much of the GPU thread's busy time overlapped
+with CPU stages. That overlap is the time the pipelining saved.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+# Stage -> resource it occupies, in pipeline order
+STAGES = {
+    "prompt": "cpu",
+    "text_encode": "gpu",
+    "denoise": "gpu",
+    "upscale": "gpu",  # LANCZOS between base and highres - CPU work, but it holds the GPU thread
+    "decode": "gpu",
+    "postprocess": "cpu",
+    "encode": "cpu",
+}
+
+
+class StageMeter:
+    """Thread-safe busy-time counters per stage and per resource"""
+
+    def __init__(self, stages: Dict[str, str] = STAGES):
+        self.resources = dict(stages)
+        self._lock = threading.Lock()
+        self._zero()
+
+    def _zero(self):
+        stages = self.resources
+        self.started_at = time.time()
+        self._last_change = self.started_at
+        self._calls = {stage: 0 for stage in stages}
+        self._busy = {stage: 0.0 for stage in stages}
+        self._active = {stage: 0 for stage in stages}
+        self._resource_active = {resource: 0 for resource in set(stages.values())}
+        self._resource_busy = {resource: 0.0 for resource in set(stages.values())}
+        self.overlap_s = 0.0
+
+    def reset(self):
+        """Start counting afresh - e.g. after warm-up renders, so stats describe serving only"""
+        with self._lock:
+            self._zero()
+
+    def _advance(self, now: float):
+        """Credit the time since the last change to whatever was running (lock held)"""
+        elapsed = now - self._last_change
+        for resource, active in self._resource_active.items():
+            if active:
+                self._resource_busy[resource] += elapsed
+        if all(self._resource_active.values()):
+            self.overlap_s += elapsed
+        self._last_change = now
+
+    @contextmanager
+    def track(self, stage: str):
+        resource = self.resources[stage]
+        with self._lock:
+            start = time.time()
+            self._advance(start)
+            self._active[stage] += 1
+            self._resource_active[resource] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                end = time.time()
+                self._advance(end)
+                self._active[stage] -= 1
+                self._resource_active[resource] -= 1
+                self._busy[stage] += end - start
+                self._calls[stage] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            self._advance(now)
+            uptime = max(1e-9, now - self.started_at)
+            gpu_busy = self._resource_busy.get("gpu", 0.0)
+            return {
+                "uptime_s": round(uptime, 1),
+                # Stage utilisation is busy time / uptime; CPU stages run on a pool, so they can exceed 1.0
+                "stages": {
+                    stage: {
+                        "resource": self.resources[stage],
+                        "calls": self._calls[stage],
+                        "in_flight": self._active[stage],
+                        "busy_s": round(self._busy[stage], 2),
+                        "avg_ms": round(self._busy[stage] / self._calls[stage] * 1000, 1) if self._calls[stage] else 0.0,
+                        "utilisation": round(self._busy[stage] / uptime, 3),
+                    }
+                    for stage in self.resources
+                },
+                "utilisation": {resource: round(busy / uptime, 3) for resource, busy in self._resource_busy.items()},
+                "overlap_s": round(self.overlap_s, 2),
+                # Share of GPU-thread time during which CPU stages were also running
+                "overlap_ratio": round(self.overlap_s / gpu_busy, 3) if gpu_busy else 0.0,
+            }
+
+
+# Shared by the render code and the API
+stage_meter = StageMeter()
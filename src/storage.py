@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Storage - generated images uploaded once, referenced by URL
+/generate used to answer with the PNG as base64 inside JSON (~4/3 of a
+multi-megabyte file per response), which the Node worker then decoded and
+wrote to disk. Images now go to a storage backend on a background upload
+pool and responses carry the URL:
+- LocalStorage: files under a directory, served by this API at /images,
+  bounded by total bytes and age - oldest files (by mtime, which a repeated
+  put refreshes) are deleted first, like the result cache
+- S3Storage: any S3-compatible bucket (AWS, R2, MinIO) through boto3, or a
+  stand-in client with the same put_object / head_object calls
+Keys are content hashes, so a repeated seeded render is stored once.
+
+Self-check + benchmark:  python storage.py
+"""
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]+$")
+
+
+def content_key(data: bytes, extension: str = "png") -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest[:2]}/{digest}.{extension}"
+
+
+class LocalStorage:
+    """Images as files under root; url = base_url + key (relative URLs resolve against the API)
+
+    max_bytes / max_age_s (0 = unbounded) are enforced after writes, under an
+    flock so one process at a time scans and deletes.
+    """
+
+    name = "local"
+    SWEEP_EVERY_S = 300.0  # age check even while under max_bytes
+
+    def __init__(self, root: str, base_url: str = "/images", max_bytes: int = 0, max_age_s: float = 0.0):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        os.makedirs(root, exist_ok=True)
+        self._lock_path = os.path.join(root, ".evict.lock")
+        self._lock = threading.Lock()
+        self._approx_bytes = self._scan()[0]
+        self._swept_at = 0.0
+        self.evicted = 0
+
+    def path(self, key: str) -> Optional[str]:
+        """File for a stored key - None for anything that is not one of our keys"""
+        if not KEY_PATTERN.match(key):
+            return None
+        path = os.path.join(self.root, key)
+        return path if os.path.exists(path) else None
+
+    def put(self, key: str, data: bytes, content_type: str) -> str:
+        path = os.path.join(self.root, key)
+        if not (os.path.exists(path) and os.path.getsize(path) == len(data)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp{threading.get_ident()}"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self._lock:
+                self._approx_bytes += len(data)
+        else:
+            os.utime(path)  # handed out again - restart its age
+        with self._lock:
+            due = (self.max_bytes and self._approx_bytes > self.max_bytes) or (
+                self.max_age_s and time.time() - self._swept_at > self.SWEEP_EVERY_S)
+        if due:
+            self.evict()
+        return f"{self.base_url}/{key}"
+
+    # ---------- eviction ----------
+    def _scan(self):
+        """(total bytes, [(mtime, size, path)]) for every stored image"""
+        total, entries = 0, []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(folder, name)
+                if not KEY_PATTERN.match(os.path.relpath(path, self.root)):
+                    continue  # lock file, writes in progress
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # evicted by another process mid-scan
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return total, entries
+
+    def evict(self):
+        """Delete images older than max_age_s, then the oldest until under max_bytes"""
+        with open(self._lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another worker is already evicting
+
+            now = time.time()
+            total, entries = self._scan()
+            evicted = 0
+            for mtime, size, path in sorted(entries):
+                expired = self.max_age_s and now - mtime > self.max_age_s
+                # Go down to 90% so every put doesn't trigger a full scan
+                if not expired and not (self.max_bytes and total > self.max_bytes * 0.9):
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+
+        with self._lock:
+            self._approx_bytes = total
+            self._swept_at = now
+            self.evicted += evicted
+
+    def stats(self) -> dict:
+        return {
+            "approx_mb": round(self._approx_bytes / 1024 / 1024, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "max_age_h": round(self.max_age_s / 3600, 1),
+            "evicted": self.evicted,
+        }
+
+
+class S3Storage:
+    """Images in an S3-compatible bucket - client is a boto3 S3 client or anything with put_object / head_object"""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, public_url: Optional[str] = None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise RuntimeError("S3 storage needs boto3 (pip install boto3)") from e
+            client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        if public_url:
+            self.base_url = public_url.rstrip("/")
+        elif endpoint_url:
+            self.base_url = f"{endpoint_url.rstrip('/')}/{bucket}"  # path-style (MinIO, R2)
+        else:
+            self.base_url = f"https://{bucket}.s3.amazonaws.com"
+
+    def put(self, key: str, data: bytes, content_type: str) -> str:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+        return f"{self.base_url}/{self.prefix}{key}"
+
+
+class Uploader:
+    """Background upload pool in front of a storage backend"""
+
+    def __init__(self, backend, workers: int = 4):
+        self.backend = backend
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.pending = 0
+        self.uploads = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def _put(self, key: str, data: bytes, content_type: str) -> Tuple[str, str]:
+        start = time.perf_counter()
+        try:
+            url = self.backend.put(key, data, content_type)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+        with self._lock:
+            self.uploads += 1
+            self.bytes += len(data)
+            self.seconds += time.perf_counter() - start
+        return key, url
+
+    def submit(self, data: bytes, extension: str = "png", content_type: str = "image/png") -> "Future[Tuple[str, str]]":
+        """Upload in the background - the future gives (key, url)"""
+        with self._lock:
+            self.pending += 1
+        return self._pool.submit(self._put, content_key(data, extension), data, content_type)
+
+    def stats(self) -> dict:
+        backend_stats = getattr(self.backend, "stats", None)
+        return {
+            **(backend_stats() if backend_stats is not None else {}),
+            "backend": self.backend.name,
+            "pending": self.pending,
+            "uploads": self.uploads,
+            "failures": self.failures,
+            "mb": round(self.bytes / 1024 / 1024, 1),
+            "avg_ms": round(self.seconds / self.uploads * 1000, 1) if self.uploads else 0.0,
+        }
+
+
+# ============================================
+# SELF-CHECK + BENCHMARK
+# ============================================
+if __name__ == "__main__":
+    import base64
+    import json
+    import tempfile
+
+    class StandInS3:
+        """In-memory put_object / head_object - what a MinIO container would answer"""
+
+        def __init__(self):
+            self.objects = {}
+
+        def put_object(self, Bucket, Key, Body, ContentType, **kwargs):
+            self.objects[(Bucket, Key)] = (Body, ContentType)
+
+        def head_object(self, Bucket, Key):
+            return {"ContentLength": len(self.objects[(Bucket, Key)][0])}
+
+    png = os.urandom(3 * 1024 * 1024)  # incompressible, like a 1024x1536 PNG
+    with tempfile.TemporaryDirectory() as root:
+        local = Uploader(LocalStorage(root), workers=2)
+        key, url = local.submit(png).result()
+        assert url == f"/images/{key}" and open(local.backend.path(key), "rb").read() == png
+        assert local.submit(png).result() == (key, url)  # same content, same key
+        assert local.backend.path("../../etc/passwd") is None
+        print(f"✅ Local storage: {url[:32]}... {local.stats()}")
+
+    # Bounded: over max_bytes the oldest images go first, anything past max_age_s goes regardless
+    with tempfile.TemporaryDirectory() as root:
+        small = 64 * 1024
+        bounded = LocalStorage(root, max_bytes=4 * small, max_age_s=3600)
+        images = [os.urandom(small) for _ in range(6)]
+        keys = []
+        for index, image in enumerate(images):
+            key = content_key(image)
+            bounded.put(key, image, "image/png")
+            os.utime(os.path.join(root, key), (time.time() - 600 + index, time.time() - 600 + index))
+            keys.append(key)
+        bounded.evict()
+        kept = [key for key in keys if bounded.path(key)]
+        assert kept == keys[-3:] and bounded.stats()["approx_mb"] <= 4 * small / 1024 / 1024, (kept, bounded.stats())
+        os.utime(os.path.join(root, keys[-1]), (time.time() - 7200, time.time() - 7200))
+        bounded.evict()
+        assert bounded.path(keys[-1]) is None and bounded.path(keys[-2]) is not None
+        print(f"✅ Local storage stays under its byte and age caps ({bounded.stats()})")
+
+    stand_in = StandInS3()
+    s3 = Uploader(S3Storage("renders", prefix="generated", endpoint_url="http://minio:9000", client=stand_in))
+    key, url = s3.submit(png).result()
+    assert url == f"http://minio:9000/renders/generated/{key}"
+    assert stand_in.head_object(Bucket="renders", Key=f"generated/{key}")["ContentLength"] == len(png)
+    print(f"✅ S3 storage (stand-in client): {url[:48]}...")
+
+    # Response body + JSON encode cost: base64 inline vs URL
+    fields = {"success": True, "character_name": "bench", "pose": "standing", "occupation": "None", "quality": "ultra_hd",
+              "resolution": "1024x1536", "generation_time": "9.81s", "seed": 42}
+    inline = {**fields, "image_base64": base64.b64encode(png).decode()}
+    by_url = {**fields, "image_url": url, "upload_path": key, "file_size_kb": len(png) // 1024, "format": "png"}
+    for label, body in (("base64", inline), ("url", by_url)):
+        rounds = 20
+        start = time.perf_counter()
+        for _ in range(rounds):
+            encoded = json.dumps(body).encode()
+        per = (time.perf_counter() - start) / rounds
+        print(f"   {label:>6}: {len(encoded) / 1024:9.1f} KB response, {per * 1000:7.3f} ms json encode")
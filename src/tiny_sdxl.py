@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tiny SDXL - randomly initialised, SDXL-shaped pipelines for CPU checks
+Same component layout as the real checkpoint (two CLIP encoders, text_time UNet,
+4-channel VAE) so batching/caching code paths can be exercised without a GPU.
+"""
+import json
+import os
+import tempfile
+
+import torch
+from diffusers import (
+    AutoencoderKL,
+    DPMSolverMultistepScheduler,
+    StableDiffusionXLImg2ImgPipeline,
+    StableDiffusionXLPipeline,
+    UNet2DConditionModel,
+)
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+
+
+# ============================================
+# TOKENIZER
+# ============================================
+def bytes_to_unicode() -> dict:
+    """GPT-2/CLIP byte -> printable unicode table"""
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, [chr(c) for c in cs]))
+
+def build_tiny_tokenizer(max_length: int = 77) -> CLIPTokenizer:
+    """Character-level CLIP tokenizer written to a temp dir (no hub access)"""
+    chars = list(bytes_to_unicode().values())
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for c in chars:
+        vocab.setdefault(c, len(vocab))
+        vocab.setdefault(c + "</w>", len(vocab))
+
+    folder = tempfile.mkdtemp(prefix="tiny_sdxl_tok_")
+    with open(os.path.join(folder, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(folder, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+
+    return CLIPTokenizer.from_pretrained(folder, model_max_length=max_length, pad_token="<|endoftext|>")
+
+
+# ============================================
+# PIPELINES
+# ============================================
+def build_tiny_sdxl(seed: int = 0, device: str = "cpu", dtype: torch.dtype = torch.float32):
+    """Return (pipe, pipe_img2img) sharing components, like load_models()"""
+    torch.manual_seed(seed)
+
+    tokenizer = build_tiny_tokenizer()
+    text_config = CLIPTextConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        projection_dim=32,
+        max_position_embeddings=77,
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_act="gelu",
+    )
+    text_encoder = CLIPTextModel(text_config)
+    text_encoder_2 = CLIPTextModelWithProjection(text_config)
+
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=80,  # 6 * 8 time ids + 32 pooled
+        cross_attention_dim=64,  # 32 + 32 from both encoders
+        norm_num_groups=1,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        sample_size=128,
+        norm_num_groups=1,
+    )
+    scheduler = DPMSolverMultistepScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        use_karras_sigmas=True,
+        algorithm_type="sde-dpmsolver++",
+        solver_order=2,
+    )
+
+    pipe = StableDiffusionXLPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        text_encoder_2=text_encoder_2,
+        tokenizer=tokenizer,
+        tokenizer_2=tokenizer,
+        unet=unet,
+        scheduler=scheduler,
+    ).to(device, dtype)
+    pipe.set_progress_bar_config(disable=True)
+
+    pipe_img2img = StableDiffusionXLImg2ImgPipeline(
+        vae=pipe.vae,
+        text_encoder=pipe.text_encoder,
+        text_encoder_2=pipe.text_encoder_2,
+        tokenizer=pipe.tokenizer,
+        tokenizer_2=pipe.tokenizer_2,
+        unet=pipe.unet,
+        scheduler=pipe.scheduler,
+    ).to(device, dtype)
+    pipe_img2img.set_progress_bar_config(disable=True)
+
+    return pipe, pipe_img2img
+
+
+# Small presets with the same keys as QUALITY_PRESETS
+TINY_PRESETS = {
+    "tiny": {
+        "base_width": 64,
+        "base_height": 96,
+        "steps": 4,
+        "cfg": 5.0,
+        "highres_scale": 1.5,
+        "highres_steps": 4,
+        "highres_denoise": 0.5,
+        "max_batch": 4,
+        "batch_window_ms": 50,
+    },
+}